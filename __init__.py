@@ -1,4 +1,3 @@
 
-
-__all__ = ["sunpy__load", "sunpy__plot", "sunpy__synthetic_image"]
+__all__ = ["sunpy__load", "sunpy__plot", "sunpy__synthetic_image", "sunpy__remote", "sunpy__catalog", "sunpy__index", "sunpy__profile", "sunpy__mock", "sunpy__benchmark", "sunpy__pipeline", "sunpy__writer", "sunpy__sweep", "sunpy__psf", "sunpy__sed", "sunpy__lazy", "sunpy__server", "sunpy__photometry", "sunpy__morphology", "sunpy__atlas", "sunpy__pyramid"]
 
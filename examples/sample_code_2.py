@@ -11,22 +11,15 @@ import numpy as np
 import wget
 import sunpy.sunpy__load as sunpy__load
 import sunpy.sunpy__plot as sunpy__plot
+import sunpy.sunpy__catalog as sunpy__catalog
 import os
 
 dl_base='http://illustris.rc.fas.harvard.edu/data/'
 
-try:
-    catalog = np.loadtxt('directory_catalog_135.txt',
-		    dtype={'names'  : ('subdirs', 'galaxy_numbers', 'galaxy_masses'),
-                           'formats': ('S3', 'i10', 'f8')})
-except:
-    wget.download(dl_base+"illustris_images_aux/directory_catalog_135.txt")
-    catalog = np.loadtxt('directory_catalog_135.txt',
-		    dtype={'names'  : ('subdirs', 'galaxy_numbers', 'galaxy_masses'),
-	                   'formats': ('S3', 'i10','f8')})
-
-all_subdirs = catalog['subdirs']
-all_galnrs  = catalog['galaxy_numbers']
+catalog   = sunpy__catalog.load_catalog('directory_catalog_135.txt')	# converted to a binary table on first use
+selection = catalog.select_file_order()	# same order as the lines of the text catalog
+all_galnrs = catalog.galaxy_numbers[selection]
+all_urls   = catalog.urls(selection, base=dl_base)
 
 
 common_args = { 
@@ -61,7 +54,7 @@ def restore_common_args():
 
 
 for index,galnr in enumerate(all_galnrs[:1]):
-    url=dl_base+"illustris_images/subdir_"+str(all_subdirs[index])+"/broadband_"+str(galnr)+".fits"
+    url=all_urls[index]
     
     if( !(os.path.isfile("./broadband_"+str(galnr)+".fits")) )
         filename = wget.download(url)
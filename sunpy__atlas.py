@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+""" Atlas / contact sheets of many galaxies, rendered straight into one large png or fits canvas.
+
+build_atlas renders any sunpy__plot image product (see sunpy__plot.image_products) for a list of
+files -- e.g. galaxy_catalog.filenames(selection) -- and places each image as a tile of a grid.
+The canvas is never held in memory: an atlas_canvas keeps only the row of tiles being filled
+and streams every completed row to disk, through a png encoder written on zlib (one IDAT chunk
+per tile row) or into a preallocated fits file at the row's offset.  Memory is therefore bounded
+by one row of tiles, whatever the number of galaxies.  Labels (e.g. galaxy numbers) are drawn
+into the tiles with a built-in 5x7 bitmap font, without matplotlib.
+
+Tiles appear as my_save_image shows the images (origin lower), galaxy 0 at the top left, in
+both formats.  png canvases hold the 8-bit display image, fits canvases the float32 values.
+
+Example usage:
+    filenames = catalog.filenames( catalog.select_mass(10.5, 11.0), directory='./images' )
+    sunpy__atlas.build_atlas(filenames, 'atlas_gri.png', product='sdss_gri', n_cols=100,
+                             tile_pixels=64, labels=True, n_processes=8)
+"""
+import numpy as np
+import os
+import sys
+import zlib
+import struct
+import itertools
+import traceback
+import multiprocessing
+
+import sunpy.sunpy__plot as sunpy__plot
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+# products whose renderers already return values in [0, 1]; the others are scaled per tile
+unit_range_products = ['sdss_gri', 'h_band', 'johnson_uvk', 'stellar_mass']
+
+# 5x7 bitmap font: 7 rows of 5 bits per glyph, as hex bytes (lower case is drawn as upper case)
+font_5x7 = { '0': '0e11131519110e', '1': '040c040404040e', '2': '0e11010204081f',
+             '3': '1f02040201110e', '4': '02060a121f0202', '5': '1f101e0101110e',
+             '6': '0608101e11110e', '7': '1f010204080808', '8': '0e11110e11110e',
+             '9': '0e11110f01020c', 'A': '0e11111f111111', 'B': '1e11111e11111e',
+             'C': '0e11101010110e', 'D': '1c12111111121c', 'E': '1f10101e10101f',
+             'F': '1f10101e101010', 'G': '0e11101711110f', 'H': '1111111f111111',
+             'I': '0e04040404040e', 'J': '0702020202120c', 'K': '11121418141211',
+             'L': '1010101010101f', 'M': '111b1515111111', 'N': '11111915131111',
+             'O': '0e11111111110e', 'P': '1e11111e101010', 'Q': '0e11111115120d',
+             'R': '1e11111e141211', 'S': '0f10100e01011e', 'T': '1f040404040404',
+             'U': '1111111111110e', 'V': '11111111110a04', 'W': '1111111515150a',
+             'X': '11110a040a1111', 'Y': '1111110a040404', 'Z': '1f01020408101f',
+             ' ': '00000000000000', '-': '0000001f000000', '_': '0000000000001f',
+             '.': '00000000000c0c', ':': '000c0c000c0c00', '/': '00010204081000',
+             '=': '00001f001f0000', '+': '0004041f040400', '?': '0e110102040004' }
+
+
+def text_mask(text, scale=1):
+    """ boolean (7 scale) x (6 len(text) scale) mask of text in the bitmap font """
+    mask = np.zeros( (7, 6 * len(text)), dtype=bool )
+    for index, char in enumerate(str(text).upper()):
+        glyph = font_5x7.get(char, font_5x7['?'])
+        rows = np.array( [ int(glyph[2*i:2*i+2], 16) for i in range(7) ] )
+        mask[:, 6*index:6*index+5] = ( (rows[:,np.newaxis] >> np.arange(4, -1, -1)[np.newaxis,:]) & 1 ).astype(bool)
+    return np.repeat( np.repeat(mask, scale, axis=0), scale, axis=1 )
+
+
+def draw_text(img, text, row=1, col=1, scale=1, value=1.0, shadow=0.0):
+    """ draw text into img (rows x cols [x channels], row 0 at the top) in place, clipped at the
+        edges, with a one pixel shadow below and to the right so it reads on bright tiles  """
+    mask = text_mask(text, scale)
+    for offset, this_value in [ (1, shadow), (0, value) ]:
+        if this_value is None:
+            continue
+        r0, c0 = row + offset, col + offset
+        rows = min(mask.shape[0], img.shape[0] - r0)
+        cols = min(mask.shape[1], img.shape[1] - c0)
+        if rows <= 0 or cols <= 0:
+            continue
+        window = img[r0:r0+rows, c0:c0+cols]
+        window[ mask[:rows,:cols] ] = this_value
+    return img
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+class png_stream:
+    """ 8-bit grey (n_channels=1) or RGB (3) png written scanline by scanline; rows arrive top first """
+    def __init__(self, filename, width, height, n_channels=3, compress_level=6):
+        if n_channels not in [1, 3]:
+            print "png_stream: n_channels must be 1 or 3, not", n_channels
+            sys.exit()
+        self.filename   = filename
+        self.width      = width
+        self.height     = height
+        self.n_channels = n_channels
+        self.n_written  = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.f = open(filename, 'wb')
+        self.f.write('\x89PNG\r\n\x1a\n')
+        self.f.write( png_chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, {1: 0, 3: 2}[n_channels], 0, 0, 0)) )
+
+    def write_rows(self, rows):
+        """ append rows (n x width [x 3] uint8) as one IDAT chunk """
+        rows = np.asarray(rows, dtype=np.uint8).reshape( (-1, self.width * self.n_channels) )
+        scanlines = np.zeros( (rows.shape[0], rows.shape[1] + 1), dtype=np.uint8 )    # filter type 0 per line
+        scanlines[:,1:] = rows
+        data = self.compressor.compress(scanlines.tostring())
+        if len(data) > 0:
+            self.f.write( png_chunk('IDAT', data) )
+        self.n_written += rows.shape[0]
+
+    def close(self):
+        if self.n_written != self.height:
+            print "png_stream: wrote "+str(self.n_written)+" of "+str(self.height)+" rows of "+self.filename
+        self.f.write( png_chunk('IDAT', self.compressor.flush()) )
+        self.f.write( png_chunk('IEND', '') )
+        self.f.close()
+
+
+def write_png(filename, img):
+    """ write a rows x cols (x 3) uint8 image, row 0 at the top, with png_stream """
+    img = np.asarray(img, dtype=np.uint8)
+    stream = png_stream(filename, img.shape[1], img.shape[0], 1 if img.ndim == 2 else img.shape[2])
+    stream.write_rows(img)
+    stream.close()
+
+
+def fits_card(keyword, value, comment=None):
+    if isinstance(value, bool):
+        value = 'T' if value else 'F'
+    elif isinstance(value, str):
+        value = ("'" + value.replace("'", "''") + "'").ljust(20)
+    card = keyword.ljust(8) + '= ' + str(value).rjust(20)
+    if comment is not None:
+        card += ' / ' + comment
+    return card[:80].ljust(80)
+
+
+class fits_stream:
+    """ float32 primary image (width x height [x n_channels planes]) preallocated on disk and
+        filled by row ranges at their offsets; rows are given top first (display order)  """
+    def __init__(self, filename, width, height, n_channels=1, cards=[]):
+        self.filename   = filename
+        self.width      = width
+        self.height     = height
+        self.n_channels = n_channels
+        header = [ fits_card('SIMPLE', True), fits_card('BITPIX', -32), fits_card('NAXIS', 2 if n_channels == 1 else 3),
+                   fits_card('NAXIS1', width), fits_card('NAXIS2', height) ]
+        if n_channels > 1:
+            header.append( fits_card('NAXIS3', n_channels) )
+        header += [ fits_card(keyword, value) for keyword, value in cards ] + [ 'END'.ljust(80) ]
+        header = ''.join(header)
+        self.data_offset = 2880 * ( (len(header) + 2879) // 2880 )
+        data_size = 4 * width * height * n_channels
+        self.f = open(filename, 'wb')
+        self.f.write(header.ljust(self.data_offset))
+        self.f.truncate( self.data_offset + 2880 * ( (data_size + 2879) // 2880 ) )     # zero filled
+
+    def write_rows(self, first_row, rows):
+        """ rows (n x width [x n_channels]) starting first_row rows from the top of the image """
+        rows = np.asarray(rows, dtype='>f4').reshape( (-1, self.width, self.n_channels) )
+        bottom = self.height - first_row - rows.shape[0]            # fits row 0 is the bottom row
+        for plane in range(self.n_channels):
+            self.f.seek( self.data_offset + 4 * ( plane * self.width * self.height + bottom * self.width ) )
+            self.f.write( rows[::-1, :, plane].tostring() )
+
+    def close(self):
+        self.f.close()
+
+
+class atlas_canvas:
+    """ n_rows x n_cols grid of tile_pixels tiles streamed to filename (.png or .fits).  Tiles
+        can be added in any order; each completed row of tiles is written and dropped, so only
+        the rows with missing tiles are kept in memory                                  """
+    def __init__(self, filename, n_rows, n_cols, tile_pixels, n_channels=3, background=0.0, cards=[]):
+        self.filename    = filename
+        self.n_rows      = n_rows
+        self.n_cols      = n_cols
+        self.tile_pixels = tile_pixels
+        self.n_channels  = n_channels
+        self.background  = background
+        self.use_fits    = filename.lower().endswith('.fits') or filename.lower().endswith('.fit')
+        width, height = n_cols * tile_pixels, n_rows * tile_pixels
+        if self.use_fits:
+            self.stream = fits_stream(filename, width, height, n_channels, cards=cards)
+        else:
+            self.stream = png_stream(filename, width, height, n_channels)
+        self.rows      = {}             # tile row -> (buffer, set of filled columns)
+        self.next_row  = 0              # rows before this one are written
+
+    def _row(self, row):
+        if row not in self.rows:
+            dtype = np.float32 if self.use_fits else np.uint8
+            buffer = np.zeros( (self.tile_pixels, self.n_cols * self.tile_pixels, self.n_channels), dtype=dtype )
+            buffer[...] = self.background
+            self.rows[row] = (buffer, set())
+        return self.rows[row]
+
+    def add_tile(self, index, tile=None):
+        """ place tile (tile_pixels x tile_pixels [x n_channels], row 0 at the top; uint8 for png)
+            at grid position index (row major); tile=None leaves the background          """
+        row, col = divmod(index, self.n_cols)
+        if row < self.next_row or row >= self.n_rows:
+            print "atlas_canvas: tile "+str(index)+" is outside the grid or its row was already written"
+            sys.exit()
+        buffer, filled = self._row(row)
+        if tile is not None:
+            tile = np.asarray(tile).reshape( (self.tile_pixels, self.tile_pixels, -1) )
+            buffer[:, col*self.tile_pixels:(col+1)*self.tile_pixels, :] = tile
+        filled.add(col)
+        while self.next_row in self.rows and len(self.rows[self.next_row][1]) == self.n_cols:
+            self._write_row(self.next_row)
+
+    def _write_row(self, row):
+        buffer, filled = self._row(row)
+        del self.rows[row]
+        if self.use_fits:
+            self.stream.write_rows(row * self.tile_pixels, buffer)
+        else:
+            self.stream.write_rows(buffer)
+        self.next_row = row + 1
+
+    def close(self):
+        """ write the remaining rows (missing tiles stay background) and close the file """
+        while self.next_row < self.n_rows:
+            self._write_row(self.next_row)
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return False
+
+
+def resize_tile(img, tile_pixels):
+    """ block average by the integer factor when the image is a multiple of tile_pixels,
+        nearest pixel otherwise                                                         """
+    n_pixels = img.shape[0]
+    if n_pixels == tile_pixels:
+        return img
+    if n_pixels % tile_pixels == 0:
+        factor = n_pixels // tile_pixels
+        return img.reshape( (tile_pixels, factor, tile_pixels, factor) + img.shape[2:] ).mean(axis=3).mean(axis=1)
+    index = ( (np.arange(tile_pixels) + 0.5) * n_pixels / float(tile_pixels) ).astype(int)
+    return img[index][:, index]
+
+
+def scale_to_uint8(img, display_range=None):
+    """ img scaled linearly from display_range (default: its finite min / max) to 0..255 """
+    if display_range is None:
+        finite = img[ np.isfinite(img) ]
+        display_range = (finite.min(), finite.max()) if len(finite) > 0 else (0.0, 1.0)
+    lo, hi = display_range
+    with np.errstate(divide='ignore', invalid='ignore'):
+        img = np.clip( np.nan_to_num( (img - lo) / (hi - lo) ), 0.0, 1.0 )
+    return np.round(255.0 * img).astype(np.uint8)
+
+
+def display_tile(img, product, tile_pixels, display_range=None, to_uint8=True, label=None, label_scale=1):
+    """ a rendered product as a tile: resized, flipped to row 0 at the top (as my_save_image shows
+        it), scaled from display_range (default [0, 1] for unit_range_products, else the tile's
+        own finite min / max) to 0..255 if to_uint8, and labelled                        """
+    img = resize_tile(np.asarray(img, dtype=np.float64), tile_pixels)[::-1]
+    if to_uint8:
+        if display_range is None and product in unit_range_products:
+            display_range = (0.0, 1.0)
+        img = scale_to_uint8(img, display_range)
+        value = 255
+    else:
+        img = img.astype(np.float32)
+        value = np.nanmax(img) if np.isfinite(img).any() else 1.0
+    if label is not None:
+        draw_text(img, label, scale=label_scale, value=value, shadow=0)
+    return img
+
+
+def default_label(filename):
+    """ galaxy number of a broadband_<number>.fits file, else the file name """
+    name = os.path.splitext( os.path.basename(filename) )[0]
+    return name[len('broadband_'):] if name.startswith('broadband_') else name
+
+
+def _render_tile(args):
+    """ render, resize, scale and label one tile (worker function for build_atlas) """
+    index, filename, product, camera, options, tile_pixels, display_range, to_uint8, label, label_scale = args
+    try:
+        img = sunpy__plot.render_products(filename, camera=camera, products=[product], **{product: options})[product]
+        return index, display_tile(img, product, tile_pixels, display_range, to_uint8, label, label_scale), None
+    except (Exception, SystemExit):
+        return index, None, traceback.format_exc()
+
+
+def first_image_pixels(filenames, camera=0):
+    """ image size of the first file that exists and has a broadband cube for camera, else None """
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
+        try:
+            return fits.getheader(filename, 'CAMERA'+str(camera)+'-BROADBAND-NONSCATTER')['NAXIS1']
+        except (IOError, KeyError):
+            continue
+    return None
+
+
+def build_atlas(filenames, output, product='sdss_gri', camera=0, n_cols=None, tile_pixels=None,
+                labels=None, label_scale=1, display_range=None, product_options={}, n_processes=1,
+                chunksize=4, verbose=True):
+    """ render product for every file into an atlas canvas written to output (.png or .fits).
+        n_cols defaults to a square grid, tile_pixels to the image size of the first readable file
+        (images of other sizes are resized).  labels: None, True (galaxy numbers) or one string per file.  Files that fail
+        leave an empty tile.  Returns the list of failed files.                          """
+    filenames = [ str(f) for f in filenames ]
+    n_images = len(filenames)
+    if n_cols is None:
+        n_cols = int( np.ceil( np.sqrt(n_images) ) )
+    n_rows = int( np.ceil( n_images / float(n_cols) ) )
+    if labels is True:
+        labels = [ default_label(f) for f in filenames ]
+    elif labels is None:
+        labels = [None] * n_images
+    to_uint8 = not (output.lower().endswith('.fits') or output.lower().endswith('.fit'))
+    if tile_pixels is None:
+        tile_pixels = first_image_pixels(filenames, camera)
+        if tile_pixels is None:
+            print "[build_atlas] none of the files could be read, nothing written to", output
+            return filenames
+
+    tasks = [ (index, filename, product, camera, product_options, tile_pixels, display_range, to_uint8,
+               labels[index], label_scale) for index, filename in enumerate(filenames) ]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes)
+        results = pool.imap(_render_tile, tasks, chunksize)       # in order: tile rows complete one by one
+    else:
+        pool = None
+        results = itertools.imap(_render_tile, tasks)
+
+    canvas, waiting, failed = None, [], []
+    try:
+        for index, tile, error in results:
+            if error is not None:
+                failed.append(filenames[index])
+                if verbose:
+                    print "[build_atlas] failed:", filenames[index]+":", error.strip().split('\n')[-1]
+            if canvas is None:
+                if tile is None:
+                    waiting.append(index)               # placed once the canvas geometry is known
+                    continue
+                canvas = atlas_canvas(output, n_rows, n_cols, tile_pixels, n_channels=1 if tile.ndim == 2 else tile.shape[2],
+                                      cards=[ ('PRODUCT', product), ('CAMERA', camera), ('NCOLS', n_cols), ('NTILES', n_images) ])
+                for waiting_index in waiting:
+                    canvas.add_tile(waiting_index, None)
+            canvas.add_tile(index, tile)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if canvas is None:
+        print "[build_atlas] no image could be rendered, nothing written to", output
+        return failed
+    canvas.close()
+    if verbose:
+        print "[build_atlas] "+str(n_images - len(failed))+" of "+str(n_images)+" tiles written to "+output
+    return failed
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+""" Benchmark suite for the sunpy loaders, synthetic_image stages and plotting routines.
+
+All inputs are written offline with sunpy__mock, so no downloads are needed.  For each image
+size the suite times every loader in sunpy__load, every synthetic_image stage (through
+sunpy__profile), congrid, the Lupton composite and my_save_image.  Import times of the sunpy
+modules are measured in fresh interpreters and checked against import_budgets.  Results are
+written as json so that runs can be compared with compare_benchmarks to track regressions.
+
+Example usage:
+    python sunpy__benchmark.py sunpy_benchmarks.json
+    sunpy__benchmark.compare_benchmarks('old.json', 'new.json')
+"""
+import numpy as np
+import os
+import sys
+import time
+import json
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__profile as sunpy__profile
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+import sunpy.sunpy__plot as sunpy__plot
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+
+
+default_sizes = [128, 256, 512]
+
+stage_args = { 'band':              'r_SDSS.res',
+               'add_background':    True,
+               'add_noise':         True,
+               'add_psf':           True,
+               'rebin_phys':        True,
+               'resize_rp':         True,
+               'rebin_gz':          True,
+               'pixelsize_arcsec':  0.24,
+               'psf_fwhm_arcsec':   1.0,
+               'sn_limit':          25.0,
+               'redshift':          0.05,
+               'seed':              1,
+               'verbose':           False }
+
+
+# wall-time budgets (s) for importing a module in a fresh interpreter, on top of importing numpy;
+# the heavy dependencies (astropy.io.fits, scipy, matplotlib, pyfits) must stay lazy to meet them
+import_budgets = { 'sunpy.sunpy__load':            0.15,
+                   'sunpy.sunpy__synthetic_image': 0.15,
+                   'sunpy.sunpy__plot':            0.15,
+                   'sunpy.sunpy__index':           0.15,
+                   'sunpy.sunpy__sed':             0.15,
+                   'sunpy.sunpy__pipeline':        0.15,
+                   'sunpy.sunpy__writer':          0.15 }
+
+
+def time_call(function, n_repeat, *args, **kwargs):
+    """ wall times of n_repeat calls of function(*args, **kwargs) """
+    times = []
+    for index in range(n_repeat):
+        start_time = time.time()
+        function(*args, **kwargs)
+        times.append(time.time() - start_time)
+    return times
+
+
+def summarize(name, group, times, **parameters):
+    result = { 'name':      name,
+               'group':     group,
+               'n_repeat':  len(times),
+               'best':      float(np.min(times)),
+               'mean':      float(np.mean(times)),
+               'std':       float(np.std(times)) }
+    result.update(parameters)
+    return result
+
+
+def benchmark_loaders(filename, n_repeat=3, **parameters):
+    loaders = [ ('load_all_broadband_images',    sunpy__load.load_all_broadband_images,    {}),
+                ('load_broadband_image',         sunpy__load.load_broadband_image,         {'band': 'r_SDSS.res'}),
+                ('load_broadband_names',         sunpy__load.load_broadband_names,         {}),
+                ('load_broadband_effective_wavelengths', sunpy__load.load_broadband_effective_wavelengths, {'band': 'r_SDSS.res'}),
+                ('load_fov',                     sunpy__load.load_fov,                     {}),
+                ('load_redshift',                sunpy__load.load_redshift,                {}),
+                ('load_camera_angles',           sunpy__load.load_camera_angles,           {}),
+                ('load_all_broadband_photometry', sunpy__load.load_all_broadband_photometry, {}),
+                ('load_sed_lambda',              sunpy__load.load_sed_lambda,              {}),
+                ('load_sed_l_lambda',            sunpy__load.load_sed_l_lambda,            {}),
+                ('load_stellar_mass_map',        sunpy__load.load_stellar_mass_map,        {}),
+                ('load_mass_weighted_stellar_age_map', sunpy__load.load_mass_weighted_stellar_age_map, {}),
+                ('load_stellar_metal_map',       sunpy__load.load_stellar_metal_map,       {}) ]
+    results = []
+    for name, loader, kwargs in loaders:
+        results.append( summarize(name, 'loader', time_call(loader, n_repeat, filename, **kwargs), **parameters) )
+    return results
+
+
+def benchmark_stages(filename, n_repeat=3, synthetic_args=stage_args, **parameters):
+    """ per-stage timings of synthetic_image, taken from the sunpy__profile reports """
+    reports = []
+    sunpy__profile.enable_profiling(callback=reports.append)
+    try:
+        for index in range(n_repeat):
+            sunpy__synthetic_image.synthetic_image(filename, **synthetic_args)
+    finally:
+        sunpy__profile.disable_profiling()
+
+    stage_times = {}
+    for report in reports:
+        for stage in report['stages']:
+            stage_times.setdefault(stage['stage'], []).append(stage['wall_time'])
+
+    results = []
+    for name in stage_times:
+        results.append( summarize(name, 'synthetic_image', stage_times[name], **parameters) )
+    results.append( summarize('synthetic_image', 'synthetic_image', [ r['total_wall_time'] for r in reports ], **parameters) )
+    return results
+
+
+def benchmark_congrid(n_pixels, n_repeat=3, **parameters):
+    parameters['n_pixels'] = n_pixels
+    image = np.random.RandomState(0).rand(n_pixels, n_pixels)
+    results = []
+    for name, factor in [ ('congrid_up_4x', 4.0), ('congrid_down_4x', 0.25) ]:
+        newdims = (int(n_pixels * factor), int(n_pixels * factor))
+        results.append( summarize(name, 'congrid', time_call(sunpy__synthetic_image.congrid, n_repeat, image, newdims), **parameters) )
+    return results
+
+
+def benchmark_plotting(n_pixels, workdir, n_repeat=3, **parameters):
+    parameters['n_pixels'] = n_pixels
+    random_state = np.random.RandomState(0)
+    bands = [ 1e12 * random_state.rand(n_pixels, n_pixels) for index in range(3) ]
+    results = [ summarize('lupton_rgb', 'plot', time_call(sunpy__plot.lupton_rgb, n_repeat, *bands,
+                            lupton_alpha=2e-12, lupton_Q=10, scale_min=1e-10), **parameters) ]
+
+    img = sunpy__plot.lupton_rgb(*bands, lupton_alpha=2e-12, lupton_Q=10, scale_min=1e-10)
+    savefile = os.path.join(workdir, 'benchmark.png')
+    results.append( summarize('my_save_image', 'plot', time_call(sunpy__plot.my_save_image, n_repeat, img, savefile), **parameters) )
+    return results
+
+
+def time_import(module, baseline='numpy'):
+    """ seconds to import module in a fresh interpreter, after baseline has been imported """
+    code = "import time, "+baseline+"; start_time = time.time(); import "+module+"; print time.time() - start_time"
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return float(output.strip().split('\n')[-1])
+
+
+def benchmark_imports(modules=None, n_repeat=3, **parameters):
+    """ import times of the sunpy modules (best of n_repeat fresh interpreters) """
+    if modules is None:
+        modules = sorted(import_budgets.keys())
+    results = []
+    for module in modules:
+        times = [ time_import(module) for index in range(n_repeat) ]
+        results.append( summarize(module, 'import', times, **parameters) )
+    return results
+
+
+def check_import_budgets(results, budgets=import_budgets):
+    """ print and return the imports whose best time is over budget """
+    over_budget = []
+    for result in results:
+        if result['group'] == 'import' and result['name'] in budgets and result['best'] > budgets[result['name']]:
+            over_budget.append( (result['name'], budgets[result['name']], result['best']) )
+            print "OVER BUDGET: import "+result['name']+"  "+str(result['best'])+" s > "+str(budgets[result['name']])+" s"
+    return over_budget
+
+
+def run_benchmarks(output='sunpy_benchmarks.json', sizes=default_sizes, n_bands=36, n_repeat=3,
+                   workdir=None, synthetic_args=stage_args):
+    """ run the full suite over the image sizes and write the results to output as json """
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='sunpy_benchmark_')
+    output   = os.path.abspath(output)
+    orig_dir = os.getcwd()
+    os.chdir(workdir)               # backgrounds are found relative to the working directory (see bg_base)
+
+    results = benchmark_imports(n_repeat=n_repeat, n_pixels=0)
+    check_import_budgets(results)
+    try:
+        sunpy__mock.write_mock_backgrounds()
+        for n_pixels in sizes:
+            print "benchmarking n_pixels = "+str(n_pixels)
+            filename = sunpy__mock.write_mock_sunrise_file('broadband_'+str(n_pixels)+'.fits',
+                                                           n_pixels=n_pixels, n_bands=n_bands)
+            parameters = { 'n_pixels': n_pixels, 'n_bands': n_bands }
+            results += benchmark_loaders(filename, n_repeat=n_repeat, **parameters)
+            results += benchmark_stages(filename, n_repeat=n_repeat, synthetic_args=synthetic_args, **parameters)
+            results += benchmark_congrid(n_pixels, n_repeat=n_repeat, n_bands=n_bands)
+            results += benchmark_plotting(n_pixels, workdir, n_repeat=n_repeat, n_bands=n_bands)
+    finally:
+        os.chdir(orig_dir)
+        if cleanup:
+            shutil.rmtree(workdir)
+
+    benchmarks = { 'metadata': { 'time':     time.strftime('%Y-%m-%d %H:%M:%S'),
+                                 'host':     socket.gethostname(),
+                                 'python':   platform.python_version(),
+                                 'numpy':    np.__version__,
+                                 'platform': platform.platform() },
+                   'results':  results }
+    f = open(output, 'w')
+    json.dump(benchmarks, f, indent=1)
+    f.close()
+    return benchmarks
+
+
+def compare_benchmarks(old_filename, new_filename, tolerance=0.2):
+    """ print and return the benchmarks whose best time got slower than (1+tolerance) x the old one """
+    old = json.load( open(old_filename) )['results']
+    new = json.load( open(new_filename) )['results']
+    old_best = dict( [ ((r['name'], r['n_pixels']), r['best']) for r in old ] )
+
+    regressions = []
+    for result in new:
+        key = (result['name'], result['n_pixels'])
+        if key in old_best and old_best[key] > 0 and result['best'] > (1.0 + tolerance) * old_best[key]:
+            regressions.append( (key[0], key[1], old_best[key], result['best']) )
+            print "REGRESSION: "+key[0]+" n_pixels="+str(key[1])+"  "+str(old_best[key])+" s -> "+str(result['best'])+" s"
+    return regressions
+
+
+if __name__ == '__main__':    #code to execute if called from command-line
+    if len(sys.argv) > 1:
+        run_benchmarks(output=sys.argv[1])
+    else:
+        run_benchmarks()
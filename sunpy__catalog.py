@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+""" Indexed binary version of the Illustris image directory catalog.
+
+The directory catalog (directory_catalog_135.txt) lists the subdir number, galaxy number and
+log stellar mass of every galaxy in the image set.  Parsing it with np.loadtxt on every run
+is slow, so convert_catalog writes it once as a binary table sorted by galaxy number, along
+with an index that orders the table by stellar mass.  Both are memory-mapped on load.  The
+table keeps the line of each galaxy in the text file (file_rows), so select_file_order gives
+the galaxies in the order of directory_catalog_135.txt, as scripts that read it directly see them.
+
+Example usage:
+    catalog   = sunpy__catalog.load_catalog('directory_catalog_135.txt')
+    selection = catalog.select_mass(10.0, 11.0)
+    for url, filename in zip(catalog.urls(selection), catalog.filenames(selection)):
+        ...
+"""
+import numpy as np
+import os
+import sys
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+dl_base = 'http://illustris.rc.fas.harvard.edu/data/'
+catalog_dtype = np.dtype( [ ('subdirs', 'S3'), ('galaxy_numbers', 'i8'), ('galaxy_masses', 'f8') ] )
+table_dtype   = np.dtype( catalog_dtype.descr + [ ('file_rows', 'i8') ] )
+mass_index_dtype = np.dtype( [ ('rows', 'i8'), ('galaxy_masses', 'f8') ] )
+
+
+def catalog_filenames(txt_filename):
+    """ names of the binary table and the mass index written for a text catalog """
+    base = os.path.splitext(txt_filename)[0]
+    return base+'.npy', base+'_mass_index.npy'
+
+
+def convert_catalog(txt_filename):
+    """ convert the text catalog into a binary table sorted by galaxy number plus a mass index """
+    if (not os.path.exists(txt_filename)):
+        print "file not found:", txt_filename
+        sys.exit()
+
+    text_catalog = np.loadtxt(txt_filename, dtype=catalog_dtype, ndmin=1)
+    catalog = np.zeros(text_catalog.shape[0], dtype=table_dtype)
+    for name in catalog_dtype.names:
+        catalog[name] = text_catalog[name]
+    catalog['file_rows'] = np.arange(catalog.shape[0])
+    catalog = catalog[ np.argsort(catalog['galaxy_numbers'], kind='mergesort') ]
+    mass_order = np.argsort(catalog['galaxy_masses'], kind='mergesort')
+    mass_index = np.zeros(catalog.shape[0], dtype=mass_index_dtype)
+    mass_index['rows']          = mass_order
+    mass_index['galaxy_masses'] = catalog['galaxy_masses'][mass_order]
+
+    table_filename, index_filename = catalog_filenames(txt_filename)
+    np.save(table_filename, catalog)
+    np.save(index_filename, mass_index)
+    return table_filename, index_filename
+
+
+def load_catalog(txt_filename='directory_catalog_135.txt', download=True):
+    """ load (converting and downloading as needed) the binary galaxy catalog """
+    table_filename, index_filename = catalog_filenames(txt_filename)
+
+    if (not os.path.exists(txt_filename)) and (not os.path.exists(table_filename)) and download:
+        import wget
+        this_file = wget.download(dl_base+'illustris_images_aux/'+os.path.basename(txt_filename))
+        os.rename(this_file, txt_filename)
+
+    if (not os.path.exists(table_filename)) or (not os.path.exists(index_filename)) or \
+       (os.path.exists(txt_filename) and os.path.getmtime(txt_filename) > os.path.getmtime(table_filename)) or \
+       np.load(table_filename, mmap_mode='r').dtype != table_dtype:        # written before file_rows
+        convert_catalog(txt_filename)
+
+    return galaxy_catalog(table_filename, index_filename)
+
+
+class galaxy_catalog:
+    """ memory-mapped galaxy catalog with fast lookups by galaxy number and stellar mass """
+    def __init__(self, table_filename, index_filename):
+        self.table      = np.load(table_filename, mmap_mode='r')
+        self.mass_index = np.load(index_filename, mmap_mode='r')
+        self.galaxy_numbers = self.table['galaxy_numbers']
+        self.galaxy_masses  = self.table['galaxy_masses']
+        self.subdirs        = self.table['subdirs']
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    def find(self, galaxy_numbers):
+        """ row indices for one or more galaxy numbers (binary search on the sorted table) """
+        galaxy_numbers = np.asarray(galaxy_numbers)
+        rows = np.searchsorted(self.galaxy_numbers, galaxy_numbers)
+        rows = np.minimum(rows, len(self) - 1)
+        missing = self.galaxy_numbers[rows] != galaxy_numbers
+        if np.any(missing):
+            print "galaxy number(s) not found in catalog:", np.atleast_1d(galaxy_numbers)[np.atleast_1d(missing)]
+            sys.exit()
+        return rows
+
+    def subdir(self, galaxy_numbers):
+        """ subdir string(s) for one or more galaxy numbers """
+        return self.subdirs[ self.find(galaxy_numbers) ]
+
+    def select_mass(self, min_mass=-np.inf, max_mass=np.inf):
+        """ row indices (in galaxy number order) of galaxies with min_mass <= log mass < max_mass """
+        sorted_masses = self.mass_index['galaxy_masses']
+        lo = np.searchsorted(sorted_masses, min_mass, side='left')
+        hi = np.searchsorted(sorted_masses, max_mass, side='left')
+        return np.sort( self.mass_index['rows'][lo:hi] )
+
+    def select_all(self):
+        """ row indices of every galaxy, in galaxy number order """
+        return np.arange(len(self))
+
+    def select_file_order(self):
+        """ row indices of every galaxy, in the order of the text catalog """
+        return np.argsort(self.table['file_rows'], kind='mergesort')
+
+    def shard(self, selection, n_shards, shard_index):
+        """ contiguous piece shard_index of n_shards of a selection, for batch jobs """
+        return np.array_split(selection, n_shards)[shard_index]
+
+    def urls(self, selection, base=dl_base):
+        """ download urls for every galaxy in a selection """
+        return np.char.add( np.char.add( np.char.add(
+                        base+'illustris_images/subdir_', self.subdirs[selection].astype(str)),
+                        '/broadband_'), np.char.mod('%d.fits', self.galaxy_numbers[selection]) )
+
+    def filenames(self, selection, directory='.'):
+        """ local file names for every galaxy in a selection """
+        return np.char.add( directory+'/broadband_', np.char.mod('%d.fits', self.galaxy_numbers[selection]) )
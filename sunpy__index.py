@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+""" SQLite index of the header metadata for a directory of SUNRISE fits files.
+
+Questions like "which files are at redshift X" or "what is the linear_fov" otherwise need a
+fits open per file.  metadata_index scans a directory of broadband_*.fits files once
+(optionally in parallel), stores the redshift, linear_fov, cameradist, per camera theta/phi,
+image size and filter list in a local SQLite file, and refreshes only the files whose mtime
+has changed.  Once registered with sunpy__load.use_metadata_index the metadata loaders
+(load_redshift, load_fov, load_camera_angles, load_broadband_names, ...) answer from the index.
+
+Example usage:
+    index = sunpy__index.metadata_index('./metadata.sqlite')
+    index.update('./images/', n_proc=8)
+    sunpy__load.use_metadata_index(index)
+    print index.files_at_redshift(0.5)
+"""
+import numpy as np
+import os
+import sys
+import glob
+import json
+import sqlite3
+import threading
+import multiprocessing
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS files (
+            filename    TEXT PRIMARY KEY,
+            mtime       REAL,
+            redshift    REAL,
+            linear_fov  REAL,
+            cameradist  REAL,
+            n_pixels    INTEGER,
+            n_cameras   INTEGER,
+            filters     TEXT,
+            lambda_eff  TEXT )""",
+    """CREATE TABLE IF NOT EXISTS cameras (
+            filename    TEXT,
+            camera      INTEGER,
+            theta       REAL,
+            phi         REAL,
+            cameradist  REAL,
+            linear_fov  REAL,
+            PRIMARY KEY (filename, camera) )""",
+    """CREATE INDEX IF NOT EXISTS files_redshift ON files (redshift)""",
+    ]
+
+
+def extract_metadata(filename):
+    """ read the header metadata of one SUNRISE file; returns (file_record, camera_records) """
+    hdulist = fits.open(filename, memmap=True)
+    redshift = hdulist[1].header.get('REDSHIFT')
+
+    camera_records = []
+    camera = 0
+    while 'CAMERA'+str(camera)+'-PARAMETERS' in hdulist:
+        param_header = hdulist['CAMERA'+str(camera)+'-PARAMETERS'].header
+        camera_records.append( (filename, camera, param_header.get('theta'), param_header.get('phi'),
+                                param_header.get('cameradist'), param_header.get('linear_fov')) )
+        camera += 1
+
+    if 'CAMERA0-BROADBAND-NONSCATTER' in hdulist:
+        n_pixels = hdulist['CAMERA0-BROADBAND-NONSCATTER'].header.get('NAXIS1')
+    else:
+        n_pixels = None
+
+    filter_data = hdulist['FILTERS'].data
+    filters     = [ str(name) for name in filter_data.field(0) ]
+    lambda_eff  = [ float(lam) for lam in filter_data['lambda_eff'] ]
+    hdulist.close()
+
+    linear_fov = camera_records[0][5] if len(camera_records) > 0 else None
+    cameradist = camera_records[0][4] if len(camera_records) > 0 else None
+    file_record = (filename, os.path.getmtime(filename), redshift, linear_fov, cameradist,
+                   n_pixels, len(camera_records), json.dumps(filters), json.dumps(lambda_eff))
+    return file_record, camera_records
+
+
+class metadata_index:
+    """ SQLite backed index of SUNRISE header metadata """
+    def __init__(self, db_filename='./sunrise_metadata.sqlite'):
+        self.db_filename = db_filename
+        self.connection  = sqlite3.connect(db_filename, check_same_thread=False)
+        self.lock        = threading.Lock()
+        for statement in schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def update(self, directory, pattern='broadband_*.fits', n_proc=1, verbose=True):
+        """ (re)index every file in directory whose mtime differs from the index; drop deleted files """
+        filenames = sorted( [ os.path.abspath(f) for f in glob.glob(os.path.join(directory, pattern)) ] )
+
+        with self.lock:
+            indexed = dict( self.connection.execute('SELECT filename, mtime FROM files').fetchall() )
+        present = set(filenames)
+        stale = [ f for f in filenames if indexed.get(f) != os.path.getmtime(f) ]
+        gone  = [ f for f in indexed if f.startswith(os.path.abspath(directory)+os.sep) and f not in present ]
+
+        if n_proc > 1 and len(stale) > 1:
+            pool = multiprocessing.Pool(n_proc)
+            records = pool.map(extract_metadata, stale)
+            pool.close()
+            pool.join()
+        else:
+            records = map(extract_metadata, stale)
+
+        with self.lock:
+            for filename in gone:
+                self.connection.execute('DELETE FROM files WHERE filename=?', (filename,))
+                self.connection.execute('DELETE FROM cameras WHERE filename=?', (filename,))
+            for file_record, camera_records in records:
+                self.connection.execute('DELETE FROM cameras WHERE filename=?', (file_record[0],))
+                self.connection.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?)', file_record)
+                self.connection.executemany('INSERT INTO cameras VALUES (?,?,?,?,?,?)', camera_records)
+            self.connection.commit()
+
+        if verbose:
+            print "indexed "+str(len(stale))+" new/changed files, removed "+str(len(gone))+", "+str(len(filenames))+" files in "+directory
+        return len(stale)
+
+    def lookup(self, filename):
+        """ metadata dict for filename, or None if it is not indexed (or changed since indexing) """
+        filename = os.path.abspath(filename)
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM files WHERE filename=?', (filename,)).fetchone()
+            if row is None:
+                return None
+            cameras = self.connection.execute('SELECT camera, theta, phi, cameradist, linear_fov FROM cameras '
+                                              'WHERE filename=? ORDER BY camera', (filename,)).fetchall()
+        if (not os.path.exists(filename)) or row[1] != os.path.getmtime(filename):
+            return None
+
+        return { 'filename':   row[0],
+                 'redshift':   row[2],
+                 'linear_fov': row[3],
+                 'cameradist': row[4],
+                 'n_pixels':   row[5],
+                 'n_cameras':  row[6],
+                 'filters':    np.array( [ str(name) for name in json.loads(row[7]) ] ),
+                 'lambda_eff': np.array( json.loads(row[8]) ),
+                 'theta':      np.array( [ c[1] for c in cameras ] ),
+                 'phi':        np.array( [ c[2] for c in cameras ] ) }
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def files_at_redshift(self, redshift, tolerance=1e-4):
+        return [ row[0] for row in self.query('SELECT filename FROM files WHERE redshift BETWEEN ? AND ? ORDER BY filename',
+                                              (redshift - tolerance, redshift + tolerance)) ]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Deferred imports for the heavy dependencies of the sunpy modules.
+
+astropy.io.fits, pyfits, scipy and matplotlib take most of the time spent importing sunpy__load,
+sunpy__synthetic_image or sunpy__plot, which process-pool workers and short scripts pay even
+when they only read a header.  lazy_import returns a module stand-in that performs the real
+import on first attribute access, so a dependency is only loaded by the code paths that use it.
+After loading, the stand-in takes over the module's attributes, so later lookups cost the same
+as on the module itself.
+
+Example usage:
+    fits = sunpy__lazy.lazy_import('astropy.io.fits')
+    sp   = sunpy__lazy.lazy_import('scipy', submodules=['scipy.ndimage'])
+    hdulist = fits.open(filename)           # astropy.io.fits is imported here
+"""
+import sys
+import types
+import importlib
+import threading
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+_lock = threading.RLock()
+
+
+class lazy_module(types.ModuleType):
+    """ stand-in for module name that imports it (and submodules) on first attribute access;
+        before_import is called once, just before the import                          """
+    def __init__(self, name, submodules=[], before_import=None):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lazy_submodules']    = list(submodules)
+        self.__dict__['_lazy_before_import'] = before_import
+        self.__dict__['_lazy_loaded']        = None
+
+    def _lazy_load(self):
+        with _lock:
+            if self.__dict__['_lazy_loaded'] is None:
+                if self.__dict__['_lazy_before_import'] is not None:
+                    self.__dict__['_lazy_before_import']()
+                module = importlib.import_module(self.__name__)
+                for name in self.__dict__['_lazy_submodules']:
+                    importlib.import_module(name)
+                self.__dict__.update(module.__dict__)
+                self.__dict__['_lazy_loaded'] = module
+            return self.__dict__['_lazy_loaded']
+
+    def __getattr__(self, attribute):
+        return getattr(self._lazy_load(), attribute)
+
+    def __repr__(self):
+        if self.__dict__['_lazy_loaded'] is None:
+            return "<lazy module '"+self.__name__+"' (not loaded)>"
+        return repr(self.__dict__['_lazy_loaded'])
+
+
+def lazy_import(name, submodules=[], before_import=None):
+    """ name as a lazy_module, or the module itself if it has already been imported """
+    if name in sys.modules and all( [ s in sys.modules for s in submodules ] ):
+        return sys.modules[name]
+    return lazy_module(name, submodules=submodules, before_import=before_import)
+
+
+def is_loaded(module):
+    """ False for a lazy_module whose import has not happened yet """
+    if isinstance(module, lazy_module):
+        return module.__dict__['_lazy_loaded'] is not None
+    return True
@@ -11,12 +11,10 @@ For usage examples, see the plotting routines in sunpy__plot.
 import numpy as np
 import os
 import sys
-import astropy.io.fits as fits
 import cosmocalc			# http://cxc.harvard.edu/contrib/cosmocalc/
-import scipy as sp
-import scipy.ndimage
-import matplotlib.pyplot as plt
-import sunpy.sunpy__synthetic_image
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
 
 
 __author__ = "Paul Torrey and Greg Snyder"
@@ -38,6 +36,20 @@ speedoflight_m  = 2.99e8
 #n_arcsec_per_str = 4.255e10             # (radian per arc second)^2
 #n_pixels_galaxy_zoo = 424
 
+metadata_index  = None          # optional sunpy__index.metadata_index; see use_metadata_index
+
+
+def use_metadata_index(index):
+    """ answer the header metadata loaders from a sunpy__index.metadata_index (None to disable) """
+    global metadata_index
+    metadata_index = index
+
+
+def _indexed_metadata(filename):
+    if metadata_index is None:
+        return None
+    return metadata_index.lookup(filename)
+
 
 def my_fits_open(filename):
     if (not os.path.exists(filename)):
@@ -46,6 +58,21 @@ def my_fits_open(filename):
     return fits.open(filename)
 
 
+def load_synthetic_image(filename):
+  """ (image, header) of a synthetic image written by save_bgimage_fits: the primary image, or
+      the SYNTHETIC_IMAGE extension of a tile-compressed file (decompressed on reading)	"""
+  hdulist = my_fits_open(filename)
+  for hdu in hdulist:
+    if hdu.data is not None:
+      image, header = np.array(hdu.data), hdu.header.copy()
+      break
+  else:
+    print "no image data in:", filename
+    sys.exit()
+  hdulist.close()
+  return image, header
+
+
 def load_broadband_image(filename,band=0, **kwargs):
   """ Loads an idealized sunrise broadband image for a specified fits file, band, and camera.
       The band can be specified as a number or a string (must match the "band_names")		"""
@@ -63,12 +90,18 @@ def load_broadband_image(filename,band=0, **kwargs):
 
 
 def load_fov(filename):
+    record = _indexed_metadata(filename)
+    if record is not None:
+        return record['linear_fov']
     hdulist = my_fits_open(filename)
     data = hdulist['CAMERA0-PARAMETERS'].header['linear_fov']
     hdulist.close()
     return data
 
 def load_camera_angles(filename,camera=0):
+    record = _indexed_metadata(filename)
+    if record is not None:
+        return record['theta'][camera], record['phi'][camera]
     hdulist = my_fits_open(filename)
     theta = hdulist['CAMERA'+str(camera)+'-PARAMETERS'].header['theta']
     phi   = hdulist['CAMERA'+str(camera)+'-PARAMETERS'].header['phi']
@@ -77,6 +110,9 @@ def load_camera_angles(filename,camera=0):
 
 
 def load_broadband_names(filename):
+    record = _indexed_metadata(filename)
+    if record is not None:
+        return record['filters']
     hdulist = my_fits_open(filename)
     name_array = hdulist['FILTERS'].data.field(0)
     hdulist.close()
@@ -109,9 +145,13 @@ def load_broadband_effective_wavelengths(filename,band=None):
     print "file not found:", filename
     sys.exit()
 
-  hdulist = fits.open(filename)
-  name_array = hdulist['FILTERS'].data['lambda_eff']
-  hdulist.close()
+  record = _indexed_metadata(filename)
+  if record is not None:
+    name_array = record['lambda_eff']
+  else:
+    hdulist = fits.open(filename)
+    name_array = hdulist['FILTERS'].data['lambda_eff']
+    hdulist.close()
   if band != None:
     if type(band) is int:
       name_array = name_array[band]
@@ -213,6 +253,10 @@ def load_redshift(filename):
     print "file not found:", filename
     sys.exit()
 
+  record = _indexed_metadata(filename)
+  if record is not None:
+    return record['redshift']
+
   hdulist = fits.open(filename)
   redshift = hdulist[1].header['REDSHIFT']
   hdulist.close()
@@ -260,23 +304,96 @@ def load_sed_l_lambda_ir(filename, camera=0):
 
 
 #===============================================================================#
+# planes of the CAMERAn-AUX cube used here
+aux_stellar_mass_plane       = 4        # stellar mass in each pixel
+aux_stellar_metals_plane     = 5        # stellar metal mass in each pixel
+aux_mass_weighted_age_plane  = 7        # mass-weighted stellar age
+
+aux_derived_maps = ['metallicity', 'age', 'mass_surface_density']
+
+
+class aux_maps:
+    """ memory-mapped CAMERAn-AUX cube of one file, opened once.  Planes are returned as views
+        (valid until close); derived maps are computed from them with zero / NaN pixels set to 0.
+        Use as a context manager (or call close) so the file handle is released.  An already
+        open hdulist can be passed in; it is then left open by close:
+
+            with sunpy__load.aux_maps(filename, camera=0) as aux:
+                maps = aux.derived()                                                    """
+    def __init__(self, filename, camera=0, hdulist=None):
+        self.filename = filename
+        self.camera   = camera
+        self.owns_hdulist = hdulist is None
+        if hdulist is None:
+            hdulist = my_fits_open(filename)
+        self.hdulist  = hdulist
+        self.cube     = self.hdulist['CAMERA'+str(camera)+'-AUX'].data
+        self.n_pixels = self.cube.shape[1]
+        self.linear_fov = None
+
+    def plane(self, index):
+        return self.cube[index,:,:]
+
+    def planes(self, indices):
+        """ list of plane views, in the order of indices """
+        return [ self.cube[index,:,:] for index in indices ]
+
+    def stellar_mass(self):
+        return self.plane(aux_stellar_mass_plane)
+
+    def stellar_metals(self):
+        return self.plane(aux_stellar_metals_plane)
+
+    def mass_weighted_age(self):
+        return self.plane(aux_mass_weighted_age_plane)
+
+    def pixel_area_kpc2(self):
+        if self.linear_fov is None:
+            self.linear_fov = self.hdulist['CAMERA'+str(self.camera)+'-PARAMETERS'].header['linear_fov']
+        return (self.linear_fov / float(self.n_pixels))**2
+
+    def derived(self, names=aux_derived_maps):
+        """ dict of derived maps (see aux_derived_maps): stellar metallicity (metal mass / mass),
+            mass-weighted age, and stellar mass surface density in Msun / kpc^2.  Each input plane
+            is read once; pixels that come out negative, NaN or inf are set to 0.          """
+        maps = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'metallicity' in names:
+                maps['metallicity'] = self.stellar_metals() / self.stellar_mass()
+            if 'age' in names:
+                maps['age'] = np.array(self.mass_weighted_age())
+            if 'mass_surface_density' in names:
+                maps['mass_surface_density'] = self.stellar_mass() / self.pixel_area_kpc2()
+            for name in maps:
+                maps[name][ ~(maps[name] >= 0) ] = 0            # also catches NaN
+                maps[name][ maps[name]*0 != 0 ] = 0             # inf
+        return maps
+
+    def close(self):
+        self.cube = None
+        if self.hdulist is not None and self.owns_hdulist:
+            self.hdulist.close()
+        self.hdulist = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return False
+
+
 def load_stellar_mass_map(filename,camera=0):
-  hdulist = fits.open(filename)
-  camera_string = 'CAMERA'+str(camera)+'-AUX'
-  aux_image = hdulist[camera_string].data
-  map = aux_image[4,:,:]
+  with aux_maps(filename, camera=camera) as aux:
+    map = np.array(aux.stellar_mass())
   return map
 
 def load_mass_weighted_stellar_age_map(filename,camera=0):
-  hdulist = fits.open(filename)
-  camera_string = 'CAMERA'+str(camera)+'-AUX'
-  aux_image = hdulist[camera_string].data
-  map = aux_image[7,:,:]
+  with aux_maps(filename, camera=camera) as aux:
+    map = np.array(aux.mass_weighted_age())
   return map
 
 def load_stellar_metal_map(filename,camera=0):
-  hdulist = fits.open(filename)
-  camera_string = 'CAMERA'+str(camera)+'-AUX'
-  aux_image = hdulist[camera_string].data
-  map = aux_image[5,:,:]
+  with aux_maps(filename, camera=camera) as aux:
+    map = np.array(aux.stellar_metals())
   return map
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+""" Writes SUNRISE-shaped mock fits files (and fake background mosaics) for offline use.
+
+Real inputs must be downloaded from the Illustris host.  The routines here write files with the
+same HDU layout that the sunpy__load and sunpy__synthetic_image routines expect:
+CAMERAn-PARAMETERS, CAMERAn-BROADBAND-NONSCATTER cubes, CAMERAn-AUX cubes, a FILTERS table and
+an INTEGRATED_QUANTITIES table, with a configurable image size and number of bands.  The images
+are a smooth exponential disk plus bulge, so Petrosian radii and backgrounds behave sensibly.
+They are meant for benchmarks and tests, not for science.
+
+Example usage:
+    sunpy__mock.write_mock_sunrise_file('./broadband_12345.fits', n_pixels=256)
+    sunpy__mock.write_mock_backgrounds()        # into sunpy__synthetic_image.bg_base
+"""
+import numpy as np
+import os
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+# band order follows the Illustris broadband files (see the backgrounds table in sunpy__synthetic_image)
+mock_band_names = [ 'GALEX_FUV.res', 'GALEX_NUV.res',
+                    'u_SDSS.res', 'g_SDSS.res', 'r_SDSS.res', 'i_SDSS.res', 'z_SDSS.res',
+                    'irac_ch1_SIRTF.res', 'irac_ch2_SIRTF.res', 'irac_ch3_SIRTF.res', 'irac_ch4_SIRTF.res',
+                    'U_Johnson.res', 'B_Johnson.res', 'V_Johnson.res', 'R_Cousins.res', 'I_Cousins.res',
+                    'J_Johnson.res', 'H_Johnson.res', 'K_Johnson.res', 'J_2mass.res', 'Ks_2mass.res',
+                    'ACS_F435_WFC.res', 'ACS_F606_WFC.res', 'ACS_F775_WFC.res', 'ACS_F850_WFC.res',
+                    'f105w.IR.res', 'f125w.IR.res', 'f160w.IR.res',
+                    'F070W_NIRCam.res', 'F090W_NIRCam.res', 'F115W_NIRCam.res', 'F150W_NIRCam.res',
+                    'F200W_NIRCam.res', 'F277W_NIRCam.res', 'F356W_NIRCam.res', 'F444W_NIRCam.res' ]
+
+mock_lambda_eff = np.array( [ 0.154, 0.230, 0.355, 0.469, 0.617, 0.748, 0.893,
+                              3.56, 4.50, 5.74, 7.92,
+                              0.365, 0.445, 0.551, 0.658, 0.806, 1.22, 1.63, 2.19, 1.24, 2.16,
+                              0.433, 0.592, 0.769, 0.905, 1.06, 1.25, 1.54,
+                              0.704, 0.902, 1.15, 1.50, 1.99, 2.76, 3.57, 4.40 ] ) * 1e-6        # in m
+
+n_aux_planes = 10       # 4 = stellar mass, 5 = stellar metals, 7 = mass weighted age
+
+
+def mock_galaxy_image(n_pixels, linear_fov, r_disk_kpc=3.0, r_bulge_kpc=1.0, bulge_fraction=0.3, inclination=0.5):
+    """ unit-normalized exponential disk + bulge surface brightness profile on an n x n grid """
+    x = (np.arange(n_pixels) - (n_pixels - 1) / 2.0) * linear_fov / n_pixels
+    xx, yy = np.meshgrid(x, x)
+    r_disk  = np.sqrt( xx**2 + (yy / np.cos(inclination))**2 )
+    r_bulge = np.sqrt( xx**2 + yy**2 )
+    image = (1.0 - bulge_fraction) * np.exp( -r_disk / r_disk_kpc ) + \
+            bulge_fraction * np.exp( -7.67 * (r_bulge / r_bulge_kpc)**0.25 ) * 2000.0
+    return image / image.max()
+
+
+def write_mock_sunrise_file(filename, n_pixels=256, n_bands=36, n_cameras=1, n_lambda=1000,
+                            redshift=0.05, linear_fov=100.0, cameradist=1.0e4, peak_sb=100.0, seed=0):
+    """ write a SUNRISE-shaped broadband fits file with n_cameras cameras and n_bands bands """
+    random_state = np.random.RandomState(seed)
+    band_names = (mock_band_names * (n_bands / len(mock_band_names) + 1))[:n_bands]
+    lambda_eff = np.resize(mock_lambda_eff, n_bands)
+
+    hdus = [ fits.PrimaryHDU() ]
+
+    makegrid = fits.ImageHDU(name='MAKEGRID')
+    makegrid.header['REDSHIFT'] = redshift
+    hdus.append(makegrid)
+
+    # SED: a smooth spectrum with a 4000A break, in W/m
+    sed_lambda = np.logspace(-7.0, -4.0, n_lambda)
+    l_lambda   = 1e33 * (sed_lambda / 5e-7)**-1.5 * np.exp( -(sed_lambda / 3e-5)**2 )
+    l_lambda[ sed_lambda < 4e-7 ] *= 0.5
+
+    columns = [ fits.Column(name='filter',        format='30A', array=np.array(band_names)),
+                fits.Column(name='lambda_eff',    format='D',   array=lambda_eff),
+                fits.Column(name='ewidth_lambda', format='D',   array=0.2 * lambda_eff) ]
+    for camera in range(n_cameras):
+        columns.append( fits.Column(name='AB_mag_nonscatter'+str(camera), format='D',
+                                    array=-20.0 - 2.5 * np.log10(lambda_eff / 5e-7) + 0.1 * random_state.randn(n_bands)) )
+    hdus.append( fits.BinTableHDU.from_columns(columns, name='FILTERS') )
+
+    columns = [ fits.Column(name='lambda',   format='D', array=sed_lambda),
+                fits.Column(name='L_lambda', format='D', array=l_lambda) ]
+    for camera in range(n_cameras):
+        attenuation = np.exp( -0.3 * (sed_lambda / 5e-7)**-1 * random_state.rand() )
+        for prefix, values in [ ('L_lambda_nonscatter', l_lambda * attenuation),
+                                ('L_lambda_scatter',    l_lambda * attenuation * 0.9),
+                                ('L_lambda_out',        l_lambda * attenuation * 0.95),
+                                ('L_lambda_ir',         l_lambda * (1.0 - attenuation)) ]:
+            columns.append( fits.Column(name=prefix+str(camera), format='D', array=values) )
+    hdus.append( fits.BinTableHDU.from_columns(columns, name='INTEGRATED_QUANTITIES') )
+
+    broadband = fits.ImageHDU(name='BROADBAND')
+    broadband.header['NBANDS'] = n_bands
+    hdus.append(broadband)
+
+    for camera in range(n_cameras):
+        params = fits.ImageHDU(name='CAMERA'+str(camera)+'-PARAMETERS')
+        params.header['cameradist'] = cameradist
+        params.header['linear_fov'] = linear_fov
+        params.header['theta']      = np.arccos( 1.0 - 2.0 * random_state.rand() )
+        params.header['phi']        = 2.0 * np.pi * random_state.rand()
+        hdus.append(params)
+
+        galaxy = mock_galaxy_image(n_pixels, linear_fov, inclination=params.header['theta'] % (np.pi / 2) * 0.9)
+        colors = peak_sb * (lambda_eff / 5e-7)**-1.0
+        cube = np.empty( (n_bands, n_pixels, n_pixels), dtype=np.float32 )
+        for band in range(n_bands):
+            cube[band] = galaxy * colors[band] * (1.0 + 0.05 * random_state.randn(n_pixels, n_pixels))
+        hdus.append( fits.ImageHDU(cube, name='CAMERA'+str(camera)+'-BROADBAND-NONSCATTER') )
+
+        aux = np.empty( (n_aux_planes, n_pixels, n_pixels), dtype=np.float32 )
+        for plane in range(n_aux_planes):
+            aux[plane] = galaxy * 1e7 * (1.0 + random_state.rand())
+        aux[5] = aux[4] * 0.02 * (1.0 + 0.1 * random_state.randn(n_pixels, n_pixels))        # metals
+        aux[7] = 5e9 * (0.5 + galaxy)                                                           # age
+        hdus.append( fits.ImageHDU(aux, name='CAMERA'+str(camera)+'-AUX') )
+
+    fits.HDUList(hdus).writeto(filename, overwrite=True, output_verify='silentfix')
+    return filename
+
+
+def write_mock_background(filename, n_pixels=2000, pixelsize_arcsec=0.24, sky_sigma=0.005, n_stars=200, seed=0):
+    """ write a fake background mosaic (gaussian sky noise plus point sources) with a CD matrix """
+    random_state = np.random.RandomState(seed)
+    image = sky_sigma * random_state.randn(n_pixels, n_pixels)
+    rows = random_state.randint(0, n_pixels, n_stars)
+    cols = random_state.randint(0, n_pixels, n_stars)
+    image[rows, cols] += 100.0 * sky_sigma * random_state.pareto(1.5, n_stars)
+
+    hdu = fits.PrimaryHDU(image.astype(np.float32))
+    hdu.header['CD1_1'] = -pixelsize_arcsec / 3600.0
+    hdu.header['CD1_2'] = 0.0
+    hdu.header['CD2_1'] = 0.0
+    hdu.header['CD2_2'] = pixelsize_arcsec / 3600.0
+    directory = os.path.dirname(filename)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    hdu.writeto(filename, overwrite=True)
+    return filename
+
+
+def write_mock_backgrounds(n_pixels=2000, overwrite=False):
+    """ write fake versions of every background mosaic listed in sunpy__synthetic_image.backgrounds """
+    import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+    written = []
+    for index, this_background in enumerate(sunpy__synthetic_image.backgrounds):
+        if len(this_background) == 0 or this_background[0] in written:
+            continue
+        if overwrite or not os.path.isfile(this_background[0]):
+            pixelsize = 0.24 if 'SDSS' in this_background[0] else 0.06
+            write_mock_background(this_background[0], n_pixels=n_pixels, pixelsize_arcsec=pixelsize, seed=index)
+        written.append(this_background[0])
+    return written
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+""" Non-parametric morphology (concentration, asymmetry, Gini, M20, smoothness) of synthetic images.
+
+All statistics are computed for a whole stack of images (... x N x N) at once, given the
+Petrosian radius of each image in pixels (e.g. r_petro_kpc / bg_image.pixel_in_kpc from
+calc_r_petro).  Radii come from the sorted-pixel cumulative sums of sunpy__photometry, Gini
+and M20 from per-image pixel sorts, and smoothness from a summed-area (integral image) boxcar,
+so no step loops over pixels.  Definitions follow Conselice (2003) and Lotz et al. (2004):
+
+    C   = 5 log10(r80 / r20), light fractions of the flux within 1.5 r_p
+    A   = sum|I - I_180| / sum|I| within 1.5 r_p, minimized over rotation centres near the
+          image centre, minus the same statistic expected from the sky noise
+    S   = sum(I - I_S) / sum(I), I_S boxcar smoothed over 0.25 r_p, for 0.25 r_p < r < 1.5 r_p
+          (negative residuals count as 0)
+    G   = Gini coefficient of the pixels brighter than the mean surface brightness at r_p
+    M20 = log10 of the second moment of the brightest 20% of that light over the total
+
+batch_morphology renders and measures many galaxies / bands in parallel and writes one table.
+
+Example usage:
+    obj   = sunpy__synthetic_image.synthetic_image(filename, band='r_SDSS.res', seed=1)
+    stats = sunpy__morphology.measure_synthetic_image(obj)
+    table = sunpy__morphology.batch_morphology(filenames, ['g_SDSS.res', 'r_SDSS.res'], 'morph.txt',
+                                               n_processes=8, seed=1)
+"""
+import numpy as np
+import os
+import sys
+import traceback
+import multiprocessing
+
+import sunpy.sunpy__photometry as sunpy__photometry
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+statistics = ['concentration', 'asymmetry', 'smoothness', 'gini', 'm20', 'r20', 'r80', 'sky_sigma']
+
+morphology_dtype = np.dtype( [ ('filename', 'S256'), ('band', 'S32'), ('camera', 'i4'), ('r_petro_kpc', 'f8'),
+                               ('r_petro_pixels', 'f8') ] + [ (name, 'f8') for name in statistics ] + [ ('failed', 'i1') ] )
+
+
+def _per_image(values, n_images):
+    return np.reshape( np.asarray(values, dtype=np.float64) * np.ones(n_images), -1 )
+
+
+def _radii(n_pixels):
+    return sunpy__photometry.radius_map(n_pixels).ravel()
+
+
+def concentration(stack, r_petro):
+    """ (C, r20, r80) with light fractions of the flux within 1.5 r_p """
+    flat, lead_shape, n_pixels = sunpy__photometry._flat_stack(stack)
+    r_petro = _per_image(r_petro, flat.shape[0])
+    sorted_r, fluxes = sunpy__photometry.cumulative_fluxes(flat.reshape(-1, n_pixels, n_pixels))
+    total = fluxes[ np.arange(flat.shape[0]), np.searchsorted(sorted_r, 1.5 * r_petro, side='left') ]
+    r20 = sunpy__photometry.light_fraction_radius(flat.reshape(-1, n_pixels, n_pixels), 0.2, total=total)
+    r80 = sunpy__photometry.light_fraction_radius(flat.reshape(-1, n_pixels, n_pixels), 0.8, total=total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = 5.0 * np.log10(r80 / r20)
+    return c.reshape(lead_shape), r20.reshape(lead_shape), r80.reshape(lead_shape)
+
+
+def asymmetry(stack, r_petro, sigma=None, max_shift=2):
+    """ rotational asymmetry within 1.5 r_p, minimized over rotation centres offset from the image
+        centre by up to max_shift pixels in steps of half a pixel, with the expected noise term
+        (2 sigma / sqrt(pi) per pixel) subtracted                                      """
+    flat, lead_shape, n_pixels = sunpy__photometry._flat_stack(stack)
+    images  = flat.reshape(-1, n_pixels, n_pixels)
+    r_petro = _per_image(r_petro, flat.shape[0])
+    radii   = _radii(n_pixels)
+    if sigma is None:
+        sigma = sunpy__photometry.sky_sigma(images, r_petro)
+    sigma = _per_image(sigma, flat.shape[0])
+    aperture = radii[np.newaxis,:] < 1.5 * r_petro[:,np.newaxis]
+    n_aperture = aperture.sum(axis=1)
+    total = np.sum( np.abs(flat) * aperture, axis=1 )
+
+    best = np.ones(flat.shape[0]) * np.inf
+    rotated = images[:, ::-1, ::-1]
+    for dy in range(-2 * max_shift, 2 * max_shift + 1):             # rotating about centre + (dy, dx)/2
+        for dx in range(-2 * max_shift, 2 * max_shift + 1):         # shifts the rotated image by (dy, dx)
+            shifted = np.zeros_like(images)
+            shifted[:, max(dy,0):n_pixels+min(dy,0), max(dx,0):n_pixels+min(dx,0)] = \
+                rotated[:, max(-dy,0):n_pixels+min(-dy,0), max(-dx,0):n_pixels+min(-dx,0)]
+            difference = np.sum( np.abs(images - shifted).reshape(flat.shape) * aperture, axis=1 )
+            best = np.minimum(best, difference)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (best - n_aperture * 2.0 * sigma / np.pi**0.5) / total
+    return a.reshape(lead_shape)
+
+
+def boxcar(images, half_width):
+    """ mean over (2 h + 1)^2 boxes of each image (edges use the pixels that exist), by summed-area table """
+    n_images, n_pixels = images.shape[0], images.shape[-1]
+    table = np.zeros( (n_images, n_pixels + 1, n_pixels + 1) )
+    table[:, 1:, 1:] = np.cumsum( np.cumsum(images, axis=1), axis=2 )
+    index = np.arange(n_pixels)
+    lo = np.clip(index - half_width, 0, n_pixels)
+    hi = np.clip(index + half_width + 1, 0, n_pixels)
+    sums = table[:, hi[:,None], hi[None,:]] - table[:, lo[:,None], hi[None,:]] \
+         - table[:, hi[:,None], lo[None,:]] + table[:, lo[:,None], lo[None,:]]
+    counts = (hi - lo)[:,None] * (hi - lo)[None,:]
+    return sums / counts
+
+
+def smoothness(stack, r_petro):
+    """ clumpiness between 0.25 r_p and 1.5 r_p, boxcar width 0.25 r_p; images that share a
+        boxcar width are smoothed together                                              """
+    flat, lead_shape, n_pixels = sunpy__photometry._flat_stack(stack)
+    images  = flat.reshape(-1, n_pixels, n_pixels)
+    r_petro = _per_image(r_petro, flat.shape[0])
+    radii   = _radii(n_pixels)
+    half_widths = np.maximum( (0.25 * r_petro / 2.0).astype(int), 1 )
+    s = np.zeros(flat.shape[0])
+    for half_width in np.unique(half_widths):
+        group = half_widths == half_width
+        smoothed = boxcar(images[group], half_width).reshape(group.sum(), -1)
+        region = (radii[np.newaxis,:] > 0.25 * r_petro[group,np.newaxis]) & (radii[np.newaxis,:] < 1.5 * r_petro[group,np.newaxis])
+        residual = np.clip(flat[group] - smoothed, 0.0, None)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s[group] = np.sum(residual * region, axis=1) / np.sum(flat[group] * region, axis=1)
+    return s.reshape(lead_shape)
+
+
+def segmentation(flat, r_petro, radii):
+    """ pixels within 1.5 r_p brighter than the mean surface brightness in the Petrosian annulus """
+    images = flat.reshape( (flat.shape[0],) + (int(flat.shape[1]**0.5),) * 2 )
+    sorted_r, fluxes = sunpy__photometry.cumulative_fluxes(images)
+    n_outer = np.searchsorted(sorted_r, 1.25 * r_petro, side='left')
+    n_inner = np.minimum( np.searchsorted(sorted_r, 0.8 * r_petro, side='right'), n_outer )
+    rows = np.arange(flat.shape[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu_petro = (fluxes[rows, n_outer] - fluxes[rows, n_inner]) / (n_outer - n_inner)
+    return (flat >= mu_petro[:,np.newaxis]) & (radii[np.newaxis,:] < 1.5 * r_petro[:,np.newaxis])
+
+
+def gini_m20(stack, r_petro):
+    """ (G, M20) over the segmentation pixels of each image """
+    flat, lead_shape, n_pixels = sunpy__photometry._flat_stack(stack)
+    r_petro = _per_image(r_petro, flat.shape[0])
+    radii   = _radii(n_pixels)
+    segment = segmentation(flat, r_petro, radii)
+    n = segment.sum(axis=1)
+    rows = np.arange(flat.shape[0])[:,np.newaxis]
+
+    # Gini: sort |I| ascending with pixels outside the segment first, so the segment's ranks are i - (P - n)
+    values = np.where(segment, np.abs(flat), -np.inf)
+    values = np.sort(values, axis=1)
+    ranks  = np.arange(1, flat.shape[1] + 1)[np.newaxis,:] - (flat.shape[1] - n)[:,np.newaxis]
+    values = np.where(np.isfinite(values), values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = values.sum(axis=1) / n
+        g = np.sum( (2.0 * ranks - n[:,np.newaxis] - 1.0) * values, axis=1 ) / (mean * n * (n - 1.0))
+
+    # M20: second moments about the flux-weighted centre, brightest pixels first
+    x, y = sunpy__photometry.pixel_offsets(n_pixels)
+    xx = np.tile(x, n_pixels)[np.newaxis,:]
+    yy = np.repeat(y, n_pixels)[np.newaxis,:]
+    weights = np.where(segment, flat, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xc = np.sum(weights * xx, axis=1) / np.sum(weights, axis=1)
+        yc = np.sum(weights * yy, axis=1) / np.sum(weights, axis=1)
+    moments = weights * ( (xx - xc[:,np.newaxis])**2 + (yy - yc[:,np.newaxis])**2 )
+    order = np.argsort(-weights, axis=1, kind='mergesort')
+    sorted_flux    = weights[rows, order]
+    sorted_moments = moments[rows, order]
+    brightest = np.cumsum(sorted_flux, axis=1) - sorted_flux < 0.2 * sorted_flux.sum(axis=1)[:,np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m20 = np.log10( np.sum(sorted_moments * brightest, axis=1) / moments.sum(axis=1) )
+    return g.reshape(lead_shape), m20.reshape(lead_shape)
+
+
+def measure(stack, r_petro, sigma=None):
+    """ dict of statistics (see the module docstring) for every image of the stack; r_petro
+        is in pixels (a scalar or one value per image), sigma the sky noise (default: MAD
+        of the pixels outside 2 r_p)                                                   """
+    flat, lead_shape, n_pixels = sunpy__photometry._flat_stack(stack)
+    r_petro = _per_image(r_petro, flat.shape[0])
+    images = flat.reshape(-1, n_pixels, n_pixels)
+    if sigma is None:
+        sigma = sunpy__photometry.sky_sigma(images, r_petro)
+    sigma = _per_image(sigma, flat.shape[0])
+
+    results = {}
+    results['concentration'], results['r20'], results['r80'] = concentration(images, r_petro)
+    results['asymmetry']  = asymmetry(images, r_petro, sigma=sigma)
+    results['smoothness'] = smoothness(images, r_petro)
+    results['gini'], results['m20'] = gini_m20(images, r_petro)
+    results['sky_sigma']  = sigma
+    for name in results:
+        results[name] = np.reshape(results[name], lead_shape)
+    return results
+
+
+def measure_synthetic_image(obj):
+    """ statistics of the final image of a synthetic_image, with its Petrosian radius """
+    r_petro_pixels = obj.r_petro_kpc / obj.bg_image.pixel_in_kpc
+    results = measure(obj.bg_image.return_image(), r_petro_pixels)
+    results['r_petro_pixels'] = r_petro_pixels
+    return results
+
+
+def file_seed(seed, filename):
+    """ seed of one galaxy in a batch: drawn from a stream of (seed, file name), so galaxies do not
+        share a background cutout or noise realization, and fresh each run for seed=None   """
+    import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+    return int( sunpy__synthetic_image.random_stream(seed, 'batch_morphology', os.path.basename(filename)).randint(0, 2**31 - 1) )
+
+
+def _measure_file(args):
+    """ render and measure every band of one file (worker function for batch_morphology) """
+    filename, bands, camera, kwargs = args
+    import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+    kwargs = dict(kwargs)
+    kwargs['seed'] = file_seed(kwargs.get('seed'), filename)
+    rows = []
+    try:
+        inputs = sunpy__synthetic_image.sunrise_inputs(filename, camera=camera)
+    except (Exception, SystemExit):
+        print "[batch_morphology] failed to read", filename
+        print traceback.format_exc()
+        return [ (filename, band, camera, None, None) for band in bands ]
+    for band in bands:
+        try:
+            obj = sunpy__synthetic_image.synthetic_image(filename, band=band, camera=camera, inputs=inputs,
+                                                         verbose=False, **kwargs)
+            results = measure_synthetic_image(obj)
+            rows.append( (filename, band, camera, obj.r_petro_kpc, results) )
+        except (Exception, SystemExit):
+            print "[batch_morphology] failed:", filename, band
+            print traceback.format_exc()
+            rows.append( (filename, band, camera, None, None) )
+    return rows
+
+
+def batch_morphology(filenames, bands, output, camera=0, n_processes=1, **kwargs):
+    """ render (synthetic_image with kwargs) and measure every band of every file, one file per
+        worker process, and write the results table to output (.npy: structured array with
+        morphology_dtype; otherwise a whitespace-separated text table).  Returns the table;
+        failed rows have failed = 1 and NaN statistics.  A seed in kwargs is the base of the
+        batch: every file gets its own seed from it (see file_seed), used for all its bands. """
+    tasks = [ (str(filename), list(bands), camera, kwargs) for filename in filenames ]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes)
+        file_rows = pool.map(_measure_file, tasks, 1)
+        pool.close()
+        pool.join()
+    else:
+        file_rows = map(_measure_file, tasks)
+
+    rows = [ row for this_file in file_rows for row in this_file ]
+    table = np.zeros(len(rows), dtype=morphology_dtype)
+    for index, (filename, band, this_camera, r_petro_kpc, results) in enumerate(rows):
+        table[index]['filename'] = filename
+        table[index]['band']     = str(band)
+        table[index]['camera']   = this_camera
+        if results is None:
+            table[index]['failed'] = 1
+            for name in ['r_petro_kpc', 'r_petro_pixels'] + statistics:
+                table[index][name] = np.nan
+            continue
+        table[index]['r_petro_kpc']    = r_petro_kpc
+        table[index]['r_petro_pixels'] = results['r_petro_pixels']
+        for name in statistics:
+            table[index][name] = float(results[name])
+
+    if output.endswith('.npy'):
+        np.save(output, table)
+    else:
+        f = open(output, 'w')
+        f.write( '# ' + ' '.join(morphology_dtype.names) + '\n' )
+        for row in table:
+            f.write( ' '.join( [ str(row[name]) for name in morphology_dtype.names ] ) + '\n' )
+        f.close()
+    return table
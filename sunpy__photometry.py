@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+""" Aperture photometry for stacks of images: aperture fluxes, curves of growth, half-light and
+Petrosian radii.
+
+calc_r_petro finds the Petrosian radius with RadialInfo, which builds np.where masks for 400
+radii and sums the image under each of them.  Here the pixels of an N x N grid are sorted by
+their (circular or elliptical) radius once per geometry, and kept in a small cache.  A single
+cumulative sum of each image in that order then gives the flux inside any radius by one
+lookup, for every image of a stack (shape ... x N x N, e.g. n_gal x n_band x N x N) at once.
+Pixels count as inside an aperture when their centre is, as in RadialInfo; with exact=True
+circular apertures instead weight each pixel by its exact overlap area with the circle.
+
+Example usage:
+    fluxes = sunpy__photometry.aperture_fluxes(images, [5.0, 10.0, 20.0], exact=True)
+    r_half = sunpy__photometry.half_light_radius(images)
+    r_p    = sunpy__photometry.petrosian_radius(images)          # as calc_r_petro, in pixels
+"""
+import numpy as np
+import threading
+from collections import OrderedDict
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+max_cached_geometries = 16
+_geometry_cache = OrderedDict()
+_geometry_lock  = threading.Lock()
+
+
+def pixel_offsets(n_pixels, center=None):
+    """ (x, y) offsets of the pixel centres from center = (row, col); the default centre is the
+        middle of the grid, with the same offsets as RadialInfo                        """
+    if center is None:
+        x = np.linspace(float(-n_pixels)/2.0 + 0.5, float(n_pixels)/2.0 - 0.5, num=n_pixels)
+        y = x
+    else:
+        x = np.arange(n_pixels) - float(center[1])
+        y = np.arange(n_pixels) - float(center[0])
+    return x, y
+
+
+def radius_map(n_pixels, center=None, axis_ratio=1.0, position_angle=0.0):
+    """ N x N map of the pixel centre radii; for axis_ratio < 1 the elliptical radius (semi-major
+        axis of the ellipse through the pixel), position_angle in radians from the x (column)
+        axis towards y                                                                   """
+    x, y = pixel_offsets(n_pixels, center)
+    xsquare = np.zeros((n_pixels, n_pixels))
+    ysquare = np.zeros_like(xsquare)
+    xsquare[:,:] = x[np.newaxis,:]
+    ysquare[:,:] = y[:,np.newaxis]
+    if axis_ratio == 1.0:
+        return (xsquare**2 + ysquare**2)**0.5
+    major =  xsquare * np.cos(position_angle) + ysquare * np.sin(position_angle)
+    minor = -xsquare * np.sin(position_angle) + ysquare * np.cos(position_angle)
+    return (major**2 + (minor / axis_ratio)**2)**0.5
+
+
+def sorted_radii(n_pixels, center=None, axis_ratio=1.0, position_angle=0.0):
+    """ (order, radii): flat pixel indices sorted by radius and the sorted radii; cached """
+    key = (n_pixels, None if center is None else tuple(center), float(axis_ratio), float(position_angle))
+    with _geometry_lock:
+        if key in _geometry_cache:
+            geometry = _geometry_cache.pop(key)
+            _geometry_cache[key] = geometry
+            return geometry
+    radii = radius_map(n_pixels, center, axis_ratio, position_angle).ravel()
+    order = np.argsort(radii, kind='mergesort')
+    geometry = (order, radii[order])
+    with _geometry_lock:
+        _geometry_cache[key] = geometry
+        while len(_geometry_cache) > max_cached_geometries:
+            _geometry_cache.popitem(last=False)
+    return geometry
+
+
+def _flat_stack(stack):
+    stack = np.asarray(stack, dtype=np.float64)
+    return stack.reshape( (-1, stack.shape[-2] * stack.shape[-1]) ), stack.shape[:-2], stack.shape[-1]
+
+
+def cumulative_fluxes(stack, center=None, axis_ratio=1.0, position_angle=0.0):
+    """ (radii, fluxes): the sorted pixel radii and, for each image, the flux of the first k
+        pixels in that order for k = 0..N^2 (so fluxes has N^2 + 1 columns)             """
+    flat, lead_shape, n_pixels = _flat_stack(stack)
+    order, radii = sorted_radii(n_pixels, center, axis_ratio, position_angle)
+    fluxes = np.zeros( (flat.shape[0], flat.shape[1] + 1) )
+    np.cumsum(flat[:, order], axis=1, out=fluxes[:,1:])
+    return radii, fluxes
+
+
+def circle_pixel_overlap(x0, x1, y0, y1, radius):
+    """ exact area of the pixels [x0,x1] x [y0,y1] (arrays) inside a circle about the origin """
+    def integral_s(x):                  # antiderivative of sqrt(radius^2 - x^2)
+        x = np.clip(x, -radius, radius)
+        return 0.5 * ( x * np.sqrt(radius**2 - x**2) + radius**2 * np.arcsin(x / radius) )
+
+    breaks = [x0, x1, np.ones_like(x0) * -radius, np.ones_like(x0) * radius]
+    for y in [y0, y1]:
+        crossing = np.sqrt( np.clip(radius**2 - y**2, 0.0, None) )
+        breaks += [crossing, -crossing]
+    breaks = np.sort( np.clip( np.array(breaks), x0, x1 ), axis=0 )
+
+    area = np.zeros_like(x0)
+    for a, b in zip(breaks[:-1], breaks[1:]):
+        mid = 0.5 * (a + b)
+        s   = np.sqrt( np.clip(radius**2 - mid**2, 0.0, None) )
+        upper_is_s = s < y1
+        lower_is_s = -s > y0
+        inside = (np.abs(mid) < radius) & (np.minimum(y1, s) > np.maximum(y0, -s)) & (b > a)
+        s_integral = integral_s(b) - integral_s(a)
+        upper = np.where(upper_is_s, s_integral, y1 * (b - a))
+        lower = np.where(lower_is_s, -s_integral, y0 * (b - a))
+        area += np.where(inside, upper - lower, 0.0)
+    return area
+
+
+def exact_aperture_weights(n_pixels, radius, center=None):
+    """ N x N map of the fraction of each pixel inside a circle of radius pixels """
+    x, y = pixel_offsets(n_pixels, center)
+    xx, yy = np.meshgrid(x, y)
+    weights = np.zeros((n_pixels, n_pixels))
+    r = (xx**2 + yy**2)**0.5
+    weights[ r <= radius - 0.5 * 2**0.5 ] = 1.0
+    edge = (r > radius - 0.5 * 2**0.5) & (r < radius + 0.5 * 2**0.5)
+    weights[edge] = circle_pixel_overlap(xx[edge] - 0.5, xx[edge] + 0.5, yy[edge] - 0.5, yy[edge] + 0.5, float(radius))
+    return weights
+
+
+def aperture_fluxes(stack, radii, center=None, axis_ratio=1.0, position_angle=0.0, exact=False):
+    """ fluxes inside apertures of the given radii (semi-major axes for elliptical apertures),
+        shape stack.shape[:-2] + (len(radii),).  exact=True (circular apertures only) uses
+        exact pixel overlap areas instead of pixel centres.                             """
+    radii = np.atleast_1d( np.asarray(radii, dtype=np.float64) )
+    if exact:
+        if axis_ratio != 1.0:
+            raise ValueError("exact aperture weights are only available for circular apertures")
+        flat, lead_shape, n_pixels = _flat_stack(stack)
+        weights = np.array( [ exact_aperture_weights(n_pixels, radius, center).ravel() for radius in radii ] )
+        return np.dot(flat, weights.T).reshape( lead_shape + (len(radii),) )
+
+    lead_shape = np.shape(stack)[:-2]
+    sorted_r, fluxes = cumulative_fluxes(stack, center, axis_ratio, position_angle)
+    counts = np.searchsorted(sorted_r, radii, side='left')         # pixels with r < radius
+    return fluxes[:, counts].reshape( lead_shape + (len(radii),) )
+
+
+def curve_of_growth(stack, radii=None, **kwargs):
+    """ (radii, fluxes) of aperture_fluxes, by default at every integer radius out to N/2 """
+    if radii is None:
+        radii = np.arange(1, np.shape(stack)[-1] // 2 + 1, dtype=np.float64)
+    return radii, aperture_fluxes(stack, radii, **kwargs)
+
+
+def light_fraction_radius(stack, fraction, total=None, center=None, axis_ratio=1.0, position_angle=0.0):
+    """ radius (pixels) containing fraction of the total flux (default: the whole image), linearly
+        interpolated between pixel radii; the first crossing is used for noisy profiles   """
+    lead_shape = np.shape(stack)[:-2]
+    sorted_r, fluxes = cumulative_fluxes(stack, center, axis_ratio, position_angle)
+    if total is None:
+        target = fraction * fluxes[:,-1]
+    else:
+        target = fraction * np.reshape( np.broadcast_to(np.asarray(total, dtype=np.float64), lead_shape), -1 )
+
+    crossed = fluxes[:,1:] >= target[:,np.newaxis]
+    k = np.argmax(crossed, axis=1)                          # first pixel that reaches the target
+    rows = np.arange(fluxes.shape[0])
+    before, after = fluxes[rows, k], fluxes[rows, k + 1]
+    r_before = sorted_r[ np.maximum(k - 1, 0) ]
+    r_after  = sorted_r[k]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(after > before, (target - before) / (after - before), 1.0)
+    radius = r_before + np.clip(t, 0.0, 1.0) * (r_after - r_before)
+    radius[ ~crossed.any(axis=1) ] = np.nan
+    return radius.reshape(lead_shape)
+
+
+def half_light_radius(stack, total=None, **kwargs):
+    return light_fraction_radius(stack, 0.5, total=total, **kwargs)
+
+
+def sky_sigma(stack, r_petro, min_sky_pixels=50):
+    """ robust sky noise (1.4826 x the median absolute deviation) of each image from its pixels
+        outside 2 r_p (in pixels; a scalar or one value per image), leaving out exact zeros
+        (zero padding); 0 where fewer than min_sky_pixels are left.  Shape stack.shape[:-2]. """
+    flat, lead_shape, n_pixels = _flat_stack(stack)
+    r_petro = np.reshape( np.broadcast_to(np.asarray(r_petro, dtype=np.float64), lead_shape), -1 )
+    radii   = radius_map(n_pixels).ravel()
+    is_sky  = (radii[np.newaxis,:] > 2.0 * r_petro[:,np.newaxis]) & (flat != 0)
+    enough  = is_sky.sum(axis=1) >= min_sky_pixels
+    sigma   = np.zeros(flat.shape[0])
+    if enough.any():
+        sky = np.where(is_sky[enough], flat[enough], np.nan)
+        median = np.nanmedian(sky, axis=1)
+        sigma[enough] = 1.4826 * np.nanmedian( np.abs(sky - median[:,np.newaxis]), axis=1 )
+    return sigma.reshape(lead_shape)
+
+
+def petrosian_radius_grid(n_pixels):
+    """ the radii searched by calc_r_petro (RadialInfo.RadiusGrid) """
+    return np.linspace(0.0001, 1.5 * n_pixels, num=400)
+
+
+def petrosian_ratios(stack, radius_grid=None, center=None, axis_ratio=1.0, position_angle=0.0):
+    """ mean surface brightness in the annulus 0.8 r < R < 1.25 r over the mean inside r, for
+        each r of radius_grid (default as calc_r_petro); 1 where either region is empty  """
+    n_pixels = np.shape(stack)[-1]
+    lead_shape = np.shape(stack)[:-2]
+    if radius_grid is None:
+        radius_grid = petrosian_radius_grid(n_pixels)
+    sorted_r, fluxes = cumulative_fluxes(stack, center, axis_ratio, position_angle)
+
+    n_interior = np.searchsorted(sorted_r, radius_grid, side='left')                 # R < r
+    n_outer    = np.searchsorted(sorted_r, 1.25 * radius_grid, side='left')          # R < 1.25 r
+    n_inner    = np.searchsorted(sorted_r, 0.8 * radius_grid, side='right')          # R <= 0.8 r
+    n_annulus  = np.maximum(n_outer - n_inner, 0)
+    n_inner    = np.minimum(n_inner, n_outer)
+
+    ratios = np.ones( (fluxes.shape[0], len(radius_grid)) )
+    valid  = (n_annulus * n_interior) != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annulus_sb  = (fluxes[:, n_outer] - fluxes[:, n_inner]) / n_annulus
+        interior_sb = fluxes[:, n_interior] / n_interior
+        ratios[:, valid] = (annulus_sb / interior_sb)[:, valid]
+    return ratios.reshape( lead_shape + (len(radius_grid),) )
+
+
+def petrosian_radius(stack, petro_ratio=0.2, radius_grid=None, **kwargs):
+    """ Petrosian radius in pixels as defined in calc_r_petro: the grid radius whose ratio is
+        closest to petro_ratio, searching from the outside in                           """
+    n_pixels = np.shape(stack)[-1]
+    if radius_grid is None:
+        radius_grid = petrosian_radius_grid(n_pixels)
+    ratios = petrosian_ratios(stack, radius_grid, **kwargs)
+    index = np.argmin( np.absolute( ratios[..., ::-1] - petro_ratio ), axis=-1 )
+    return radius_grid[::-1][index]
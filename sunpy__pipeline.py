@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+""" Streaming galaxy pipeline that overlaps file I/O with image processing.
+
+Processing a list of galaxies one at a time (download, open, load, compute, write, delete)
+leaves the cpu idle while files are fetched and decoded.  stream_galaxies is a generator that
+hands out one galaxy at a time while a background thread downloads (if needed) and decodes the
+next K SUNRISE files into sunpy__synthetic_image.sunrise_inputs objects.  The prefetch is
+bounded, so at most K decoded files are held besides the one being processed.
+
+Example usage:
+    catalog   = sunpy__catalog.load_catalog('directory_catalog_135.txt')
+    selection = catalog.select_mass(10.0, 11.0)
+    for filename, inputs in sunpy__pipeline.catalog_stream(catalog, selection, prefetch=2, delete=True):
+        rp, img = sunpy__plot.return_synthetic_sdss_gri_img(filename, inputs=inputs)
+        ...
+"""
+import os
+import sys
+import Queue
+import threading
+import traceback
+
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+_end_of_stream = object()
+
+
+def fetch_file(filename, url=None):
+    """ download url to filename unless it is already there; returns True if it was downloaded """
+    if os.path.isfile(filename):
+        return False
+    if url is None:
+        print "file not found:", filename
+        sys.exit()
+    import wget
+    directory = os.path.dirname(filename)
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    this_file = wget.download(url, out=filename)
+    if this_file != filename:
+        os.rename(this_file, filename)
+    return True
+
+
+class _prefetcher(threading.Thread):
+    """ background thread that fetches and decodes files into a queue.  A file is only started
+        once one of the prefetch slots is free, and get() frees the slot of the file it hands
+        out, so at most prefetch files are held (queued or being decoded) ahead of the consumer """
+    def __init__(self, filenames, urls, camera, prefetch, delete=False):
+        threading.Thread.__init__(self)
+        self.daemon    = True
+        self.filenames = filenames
+        self.urls      = urls
+        self.camera    = camera
+        self.delete    = delete
+        self.queue     = Queue.Queue()
+        self.slots     = threading.Semaphore(prefetch)
+        self.stopped   = threading.Event()
+        self.lock      = threading.Lock()          # orders queueing against stop(), see there
+
+    def wait_for_slot(self):
+        """ block until a prefetch slot is free or the stream is stopped """
+        while not self.stopped.is_set():
+            if self.slots.acquire(False):
+                return True
+            self.stopped.wait(0.05)
+        return False
+
+    def get(self):
+        item = self.queue.get()
+        if item is not _end_of_stream:
+            self.slots.release()
+        return item
+
+    def discard(self, item):
+        """ remove the file of an item the consumer will never see, if the stream downloaded it """
+        filename, inputs, downloaded, exc_info = item
+        if self.delete and downloaded and os.path.isfile(filename):
+            os.remove(filename)
+
+    def run(self):
+        for index, filename in enumerate(self.filenames):
+            if not self.wait_for_slot():
+                return
+            url = self.urls[index] if self.urls is not None else None
+            downloaded = False
+            try:
+                downloaded = fetch_file(filename, url)
+                inputs = sunpy__synthetic_image.sunrise_inputs(filename, camera=self.camera)
+                item = (filename, inputs, downloaded, None)
+            except (Exception, SystemExit):
+                item = (filename, None, downloaded, sys.exc_info())
+            with self.lock:
+                if self.stopped.is_set():
+                    self.discard(item)
+                    return
+                self.queue.put(item)
+        self.queue.put(_end_of_stream)
+
+    def stop(self):
+        """ stop fetching and discard everything still queued; items finished after this are
+            discarded by run itself                                                      """
+        with self.lock:
+            self.stopped.set()
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is not _end_of_stream:
+                    self.discard(item)
+
+
+def stream_galaxies(filenames, urls=None, camera=0, prefetch=2, delete=False, process=None):
+    """ generator over the galaxies in filenames, yielding (filename, inputs) with the
+        SUNRISE file decoded into a sunrise_inputs object, or (filename, process(filename, inputs))
+        if a process function is given.  Files that cannot be fetched or read are skipped with
+        a message.
+
+        Files are downloaded from urls when missing.  The next prefetch files are fetched and
+        decoded on a background thread while the current one is processed, so at most
+        prefetch + 1 decoded files are in memory at once.  With delete=True files that were
+        downloaded by the stream are removed once the consumer moves on, including files that
+        were skipped or still prefetched when the stream is closed early.                 """
+    filenames = [ str(f) for f in filenames ]
+    if urls is not None:
+        urls = [ str(u) for u in urls ]
+    prefetcher = _prefetcher(filenames, urls, camera, max(int(prefetch), 1), delete=delete)
+    prefetcher.start()
+
+    try:
+        while True:
+            item = prefetcher.get()
+            if item is _end_of_stream:
+                break
+            filename, inputs, downloaded, exc_info = item
+            if exc_info is not None:
+                print "[stream_galaxies] failed:", filename+":", traceback.format_exception_only(exc_info[0], exc_info[1])[-1].strip()
+                prefetcher.discard(item)
+                continue
+
+            try:
+                if process is None:
+                    yield filename, inputs
+                else:
+                    yield filename, process(filename, inputs)
+            finally:
+                del inputs, item
+                if delete and downloaded and os.path.isfile(filename):
+                    os.remove(filename)
+    finally:
+        prefetcher.stop()
+
+
+def catalog_stream(catalog, selection, directory='.', base=None, **kwargs):
+    """ stream_galaxies over a sunpy__catalog selection, downloading missing files into directory """
+    if base is None:
+        urls = catalog.urls(selection)
+    else:
+        urls = catalog.urls(selection, base=base)
+    return stream_galaxies(catalog.filenames(selection, directory=directory), urls=urls, **kwargs)
@@ -14,13 +14,14 @@ import os
 import sys
 import sunpy__load			# used for noiseless images, for which we can return the image input directly
 import sunpy__synthetic_image		# used for images with noise, pixel scaling, etc.
+import gc
 
-import matplotlib
-matplotlib.use('Agg')
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
 
 
-import matplotlib.pyplot as plt
-import gc
+mpl_figure      = sunpy__lazy.lazy_import('matplotlib.figure')
+mpl_backend_agg = sunpy__lazy.lazy_import('matplotlib.backends.backend_agg')
 
 
 
@@ -39,20 +40,20 @@ if __name__ == '__main__':    #code to execute if called from command-line
 
 
 
-def plot_synthetic_sdss_gri(filename, savefile='syn_sdss_gri.png', **kwargs):
+def plot_synthetic_sdss_gri(filename, savefile='syn_sdss_gri.png', writer=None, **kwargs):
     """ routine for plotting synthetic sdss gri images from Illustris idealized images including appropriate pixel scaling, noise, etc.  """
 
     rp, img = return_synthetic_sdss_gri_img(filename, **kwargs)
-    my_save_image(img, savefile)
+    save_image(img, savefile, writer=writer)
     del img
     gc.collect()
 
 
-def plot_sdss_gri(filename, savefile='./sdss_gri.png', **kwargs):
+def plot_sdss_gri(filename, savefile='./sdss_gri.png', writer=None, **kwargs):
     """ routine for plotting synthetic sdss gri images from Illustris idealized images *without* additional image effects """
 
     img = return_sdss_gri_img(filename, **kwargs)
-    my_save_image(img, savefile)
+    save_image(img, savefile, writer=writer)
     del img
     gc.collect()
 
@@ -60,7 +61,7 @@ def plot_sdss_gri(filename, savefile='./sdss_gri.png', **kwargs):
 def return_synthetic_sdss_gri_img(filename, 
 				lupton_alpha=0.5, lupton_Q=0.5, scale_min=1e-4, 
                                 b_fac=0.7, g_fac=1.0, r_fac=1.3,
-				seed_boost=1.0,
+				seed_boost=1.0, n_threads=1,
 				**kwargs):
 
 
@@ -71,140 +72,83 @@ def return_synthetic_sdss_gri_img(filename,
         seed=int(filename[filename.index('broadband_')+10:filename.index('.fits')])*(n_iter)*seed_boost
         n_iter+=1
 
-        b_image, rp, the_used_seed,this_fail_flag    = sunpy__synthetic_image.build_synthetic_image(filename, 'g_SDSS.res', 
+        # g sets rp and the seed; r and i are then built concurrently when n_threads > 1
+        images = sunpy__synthetic_image.build_synthetic_images(filename, ['g_SDSS.res', 'r_SDSS.res', 'i_SDSS.res'],
 				seed=seed,
 				r_petro_kpc=None, 
 				fix_seed=False,
+				n_threads=n_threads,
 				**kwargs)
+        b_image, rp, the_used_seed, this_fail_flag = images[0]
+        g_image = images[1][0]
+        r_image = images[2][0]
 
-
-	print " "
 	print " "
-	print " The blue image has been set"
+	print " The gri images have been set"
 	print " The stored value for rp = "+str(rp)
 	print " "
-	print " "
-        if(this_fail_flag):
-	  fail_flag=True
-
-        g_image, dummy, the_used_seed,this_fail_flag = sunpy__synthetic_image.build_synthetic_image(filename, 'r_SDSS.res', 
-				seed=the_used_seed,
-				r_petro_kpc=rp,
-				fix_seed=True, 
-				**kwargs)
-        if(this_fail_flag):
-          fail_flag=True
-
+        for image in images:
+            if(image[3]):
+                fail_flag=True
 
-        print " "
-        print " "
-        print " The green image has been set"
-        print " The stored value for rp = "+str(rp)
-        print " "
-        print " "
-
-
-        r_image, dummy, the_used_seed, this_fail_flag = sunpy__synthetic_image.build_synthetic_image(filename, 'i_SDSS.res', 
-                                seed=the_used_seed,
-				r_petro_kpc=rp,
-				fix_seed=True, 
-				**kwargs)
-        if(this_fail_flag):
-            fail_flag=True
-
-    n_pixels = r_image.shape[0]
-    img = np.zeros((n_pixels, n_pixels, 3), dtype=float)
- 
-    b_image *= b_fac
-    g_image *= g_fac
-    r_image *= r_fac
- 
-    I = (r_image + g_image + b_image)/3
-    val = np.arcsinh( lupton_alpha * lupton_Q * (I - scale_min))/lupton_Q
-    I[ I < 1e-6 ] = 1e100		# from below, this effectively sets the pixel to 0
-
-    img[:,:,0] = r_image * val / I
-    img[:,:,1] = g_image * val / I
-    img[:,:,2] = b_image * val / I
-
-    maxrgbval = np.amax(img, axis=2)
- 
-    changeind = maxrgbval > 1.0
-    img[changeind,0] = img[changeind,0]/maxrgbval[changeind]
-    img[changeind,1] = img[changeind,1]/maxrgbval[changeind]
-    img[changeind,2] = img[changeind,2]/maxrgbval[changeind]
-
-    minrgbval = np.amin(img, axis=2)
-    changeind = minrgbval < 0.0
-    img[changeind,0] = 0
-    img[changeind,1] = 0
-    img[changeind,2] = 0
-
-    changind = I < 0
-    img[changind,0] = 0
-    img[changind,1] = 0
-    img[changind,2] = 0
-    img[img<0] = 0
+    img = lupton_rgb(r_image, g_image, b_image, lupton_alpha=lupton_alpha, lupton_Q=lupton_Q, scale_min=scale_min,
+                     b_fac=b_fac, g_fac=g_fac, r_fac=r_fac, min_intensity=1e-6, fill_intensity=1e100)
 
     print "img min/max/mean "+str(img.min())+"  "+str(img.max())+"  "+str(img.mean())
     print " "
 
-    del b_image, g_image, r_image, I, val
+    del b_image, g_image, r_image, images
     gc.collect()
 
-    img[img<0] = 0
     return rp, img
 
 
 def return_synthetic_hst_img(filename,
                                 lupton_alpha=0.5, lupton_Q=0.5, scale_min=1e-4,
-                                b_fac=1.0, g_fac=1.0, r_fac=1.0,
+                                b_fac=1.0, g_fac=1.0, r_fac=1.0, n_threads=1,
                                 **kwargs):
 
     seed=int(filename[filename.index('broadband_')+10:filename.index('.fits')])
-    b_image, rp, dummy, dummy    = sunpy__synthetic_image.build_synthetic_image(filename, 22,		#25,
+    # band 22 sets rp; band 25 is built (as before) but not used in the composite
+    images = sunpy__synthetic_image.build_synthetic_images(filename, [22, 25, 26, 27],		#25,
                                 seed=seed, fix_seed=True,
                                 r_petro_kpc=None,
+                                n_threads=n_threads,
                                 **kwargs)
-    dummy, dummy, dummy, dummy  = sunpy__synthetic_image.build_synthetic_image(filename, 25,
-                                seed=seed, fix_seed=True,
-                                r_petro_kpc=rp,
-                                **kwargs)
+    b_image, rp, dummy, dummy = images[0]
+    g_image = images[2][0]
+    r_image = images[3][0]
 
-    g_image, dummy, dummy, dummy = sunpy__synthetic_image.build_synthetic_image(filename, 26,
-                                seed=seed, fix_seed=True,
-                                r_petro_kpc=rp,
-                                **kwargs)
-    r_image, dummy, dummy, dummy = sunpy__synthetic_image.build_synthetic_image(filename, 27,
-                                seed=seed, fix_seed=True,
-                                r_petro_kpc=rp,
-                                **kwargs)
+    img = lupton_rgb(r_image, g_image, b_image, lupton_alpha=lupton_alpha, lupton_Q=lupton_Q, scale_min=scale_min,
+                     b_fac=b_fac, g_fac=g_fac, r_fac=r_fac, min_intensity=1e-8, fill_intensity=1e20)
+
+    print "img min/max/mean "+str(img.min())+"  "+str(img.max())+"  "+str(img.mean())
+    print " "
+
+    del b_image, g_image, r_image, images
+    gc.collect()
 
+    return rp, img
+
+
+def lupton_rgb(r_image, g_image, b_image, lupton_alpha=0.5, lupton_Q=0.5, scale_min=1e-4,
+                b_fac=1.0, g_fac=1.0, r_fac=1.0, min_intensity=1e-6, fill_intensity=1e100):
+    """ Lupton et al. (2004) asinh composite of three band images into an n x n x 3 rgb image """
     n_pixels = r_image.shape[0]
     img = np.zeros((n_pixels, n_pixels, 3), dtype=float)
 
-    b_image *= b_fac
-    g_image *= g_fac
-    r_image *= r_fac
+    b_image = b_image * b_fac
+    g_image = g_image * g_fac
+    r_image = r_image * r_fac
 
     I = (r_image + g_image + b_image)/3
     val = np.arcsinh( lupton_alpha * lupton_Q * (I - scale_min))/lupton_Q
-    I[ I < 1e-8 ] = 1e20               # from below, this effectively sets the pixel to 0
-
-    print val.min(), val.max()
-    print I.min(), I.max()
+    I[ I < min_intensity ] = fill_intensity		# from below, this effectively sets the pixel to 0
 
     img[:,:,0] = r_image * val / I
     img[:,:,1] = g_image * val / I
     img[:,:,2] = b_image * val / I
 
-    print " "
-    print " "
-    print img.min(), img.max()
-
-    print " "
-    print " "
-
     maxrgbval = np.amax(img, axis=2)
 
     changeind = maxrgbval > 1.0
@@ -224,24 +168,40 @@ def return_synthetic_hst_img(filename,
     img[changind,2] = 0
     img[img<0] = 0
 
-    print "img min/max/mean "+str(img.min())+"  "+str(img.max())+"  "+str(img.mean())
-    print " "
+    del I, val
+    return img
 
-    del b_image, g_image, r_image, I, val
-    gc.collect()
 
-    img[img<0] = 0
-    return rp, img
+def return_sdss_gri_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0, non_linear=0.5):
+    return render_products(filename, camera=camera, products=['sdss_gri'],
+                           sdss_gri={'scale_min': scale_min, 'scale_max': scale_max, 'non_linear': non_linear})['sdss_gri']
 
 
-def return_sdss_gri_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0, non_linear=0.5):
-    if (not os.path.exists(filename)):
-        print "file not found:", filename
-        sys.exit()
+def return_h_band_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0):
+    return render_products(filename, camera=camera, products=['h_band'],
+                           h_band={'scale_min': scale_min, 'scale_max': scale_max})['h_band']
 
-    b_image = sunpy__load.load_broadband_image(filename,band='g_SDSS.res',camera=camera) * 0.7
-    g_image = sunpy__load.load_broadband_image(filename,band='r_SDSS.res',camera=camera) * 1.0
-    r_image = sunpy__load.load_broadband_image(filename,band='i_SDSS.res',camera=camera) * 1.4
+
+def return_johnson_uvk_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0):
+    return render_products(filename, camera=camera, products=['johnson_uvk'],
+                           johnson_uvk={'scale_min': scale_min, 'scale_max': scale_max})['johnson_uvk']
+
+
+def return_stellar_mass_img(filename, camera=0, scale_min=1e8, scale_max=1e10, size_scale=1.0, non_linear=1e8):
+    return render_products(filename, camera=camera, products=['stellar_mass'],
+                           stellar_mass={'scale_min': scale_min, 'scale_max': scale_max, 'non_linear': non_linear})['stellar_mass']
+
+def return_mass_weighted_age_img(filename, camera=0, scale_min=None, scale_max=None, size_scale=1.0):
+    return render_products(filename, camera=camera, products=['mass_weighted_age'])['mass_weighted_age']
+
+def return_stellar_metal_img(filename, camera=0, scale_min=None, scale_max=None, size_scale=1.0, non_linear=None):
+    return render_products(filename, camera=camera, products=['stellar_metal'])['stellar_metal']
+
+
+def _render_sdss_gri(bands, lambda_eff, aux, scale_min=0.1, scale_max=50, non_linear=0.5):
+    b_image = bands['g_SDSS.res'] * 0.7
+    g_image = bands['r_SDSS.res'] * 1.0
+    r_image = bands['i_SDSS.res'] * 1.4
     n_pixels = r_image.shape[0]
     img = np.zeros((n_pixels, n_pixels, 3), dtype=float)
 
@@ -249,19 +209,11 @@ def return_sdss_gri_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=
     img[:,:,1] = asinh(g_image, scale_min=scale_min, scale_max=scale_max,non_linear=non_linear)
     img[:,:,2] = asinh(b_image, scale_min=scale_min, scale_max=scale_max,non_linear=non_linear)
     img[img<0] = 0
-
-    del b_image, g_image, r_image
-    gc.collect()
-
     return img
 
 
-def return_h_band_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0):
-    if (not os.path.exists(filename)):
-        print "file not found:", filename
-        sys.exit()
-
-    image = sunpy__load.load_broadband_image(filename,band='H_Johnson.res', camera=camera) 
+def _render_h_band(bands, lambda_eff, aux, scale_min=0.1, scale_max=50):
+    image = bands['H_Johnson.res']
     n_pixels = image.shape[0]
     img = np.zeros((n_pixels, n_pixels), dtype=float)
     img[:,:] = asinh(image, scale_min=scale_min, scale_max=scale_max,non_linear=0.5)
@@ -269,20 +221,16 @@ def return_h_band_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.
     return img
 
 
-def return_johnson_uvk_img(filename,camera=0,scale_min=0.1,scale_max=50,size_scale=1.0):
-    if (not os.path.exists(filename)):
-        print "file not found:", filename
-        sys.exit()
-
-    b_effective_wavelength = sunpy__load.load_broadband_effective_wavelengths(filename,band="U_Johnson.res")
-    g_effective_wavelength = sunpy__load.load_broadband_effective_wavelengths(filename,band="V_Johnson.res")
-    r_effective_wavelength = sunpy__load.load_broadband_effective_wavelengths(filename,band="K_Johnson.res")
+def _render_johnson_uvk(bands, lambda_eff, aux, scale_min=0.1, scale_max=50):
+    b_effective_wavelength = lambda_eff['U_Johnson.res']
+    g_effective_wavelength = lambda_eff['V_Johnson.res']
+    r_effective_wavelength = lambda_eff['K_Johnson.res']
 
-    b_image = sunpy__load.load_broadband_image(filename,band='U_Johnson.res',camera=camera) * b_effective_wavelength / g_effective_wavelength * 2.5
-    g_image = sunpy__load.load_broadband_image(filename,band='V_Johnson.res',camera=camera) * g_effective_wavelength / g_effective_wavelength 
-    r_image = sunpy__load.load_broadband_image(filename,band='K_Johnson.res',camera=camera) * r_effective_wavelength / g_effective_wavelength * 1.5 
+    b_image = bands['U_Johnson.res'] * b_effective_wavelength / g_effective_wavelength * 2.5
+    g_image = bands['V_Johnson.res'] * g_effective_wavelength / g_effective_wavelength 
+    r_image = bands['K_Johnson.res'] * r_effective_wavelength / g_effective_wavelength * 1.5 
 
-    n_pixels
+    n_pixels = r_image.shape[0]
     img = np.zeros((n_pixels, n_pixels, 3), dtype=float)
     img[:,:,0] = asinh(r_image, scale_min=scale_min, scale_max=scale_max,non_linear=0.5)
     img[:,:,1] = asinh(g_image, scale_min=scale_min, scale_max=scale_max,non_linear=0.5)
@@ -291,33 +239,99 @@ def return_johnson_uvk_img(filename,camera=0,scale_min=0.1,scale_max=50,size_sca
     return img
 
 
-def return_stellar_mass_img(filename, camera=0, scale_min=1e8, scale_max=1e10, size_scale=1.0, non_linear=1e8):
-    image = sunpy__load.load_stellar_mass_map(filename, camera=camera)
+def _render_stellar_mass(bands, lambda_eff, aux, scale_min=1e8, scale_max=1e10, non_linear=1e8):
+    image = aux[4]
     n_pixels = image.shape[0]
     img = np.zeros((n_pixels, n_pixels), dtype=float)
     img[:,:] = asinh(image, scale_min=scale_min, scale_max=scale_max, non_linear=non_linear)
     img[img<0] = 0
     return img
 
-def return_mass_weighted_age_img(filename, camera=0, scale_min=None, scale_max=None, size_scale=1.0):
-    image = sunpy__load.load_mass_weighted_stellar_age_map(filename, camera=camera)
-    image += 1e5
-    return image
 
-def return_stellar_metal_img(filename, camera=0, scale_min=None, scale_max=None, size_scale=1.0, non_linear=None):
-    image1 = sunpy__load.load_stellar_mass_map(filename, camera=camera)
-    image2 = sunpy__load.load_stellar_metal_map(filename, camera=camera)
-    image = image2/image1
-    image[image<0]      = 0     #image.min()
-    image[image*0 != 0] = 0     #image.min()
-    return image
+def _render_mass_weighted_age(bands, lambda_eff, aux):
+    return aux[7] + 1e5
+
+
+def _render_stellar_metal(bands, lambda_eff, aux):
+    return aux['metallicity']
+
+
+# product name -> (broadband filters it needs, AUX planes / derived AUX maps it needs, renderer)
+image_products = { 'sdss_gri':          (['g_SDSS.res', 'r_SDSS.res', 'i_SDSS.res'],          [],              _render_sdss_gri),
+                   'h_band':            (['H_Johnson.res'],                                   [],              _render_h_band),
+                   'johnson_uvk':       (['U_Johnson.res', 'V_Johnson.res', 'K_Johnson.res'], [],              _render_johnson_uvk),
+                   'stellar_mass':      ([],                                                  [4],             _render_stellar_mass),
+                   'mass_weighted_age': ([],                                                  [7],             _render_mass_weighted_age),
+                   'stellar_metal':     ([],                                                  ['metallicity'], _render_stellar_metal) }
+
+
+def read_product_inputs(filename, camera=0, band_names=[], aux_planes=[]):
+    """ read the named broadband images (clipped at 1e-20, as load_all_broadband_images), their
+        effective wavelengths and the listed AUX planes (indices, or names of
+        sunpy__load.aux_derived_maps) with one open of the file; only the requested planes of
+        the cubes are read                                                               """
+    if (not os.path.exists(filename)):
+        print "file not found:", filename
+        sys.exit()
+
+    hdulist = fits.open(filename, memmap=True)
+    bands, lambda_eff, aux = {}, {}, {}
+    if len(band_names) > 0:
+        all_names  = hdulist['FILTERS'].data.field(0)
+        all_lambda = hdulist['FILTERS'].data['lambda_eff']
+        indices = [ (((all_names == name).nonzero())[0])[0] for name in band_names ]
+        planes  = np.array( hdulist['CAMERA'+str(camera)+'-BROADBAND-NONSCATTER'].data[ sorted(set(indices)) ] )
+        planes[ planes < 1e-20 ] = 1e-20
+        for name, index in zip(band_names, indices):
+            bands[name]      = planes[ sorted(set(indices)).index(index) ]
+            lambda_eff[name] = all_lambda[index]
+    if len(aux_planes) > 0:
+        maps = sunpy__load.aux_maps(filename, camera=camera, hdulist=hdulist)
+        derived = maps.derived( [ name for name in aux_planes if name in sunpy__load.aux_derived_maps ] )
+        for plane in aux_planes:
+            if plane in derived:
+                aux[plane] = derived[plane]
+            else:
+                aux[plane] = np.array( maps.plane(plane) )
+        maps.close()
+    hdulist.close()
+    return bands, lambda_eff, aux
+
+
+def render_products(filename, camera=0, products=None, savefiles={}, writer=None, **product_options):
+    """ render several image products (see image_products; default all) of one camera from a single
+        read of the file.  Returns a dict of product name -> image.  savefiles maps product names
+        to png files to write (through writer, if given); product_options are per-product keyword
+        dicts, e.g. sdss_gri={'scale_max': 30}                                           """
+    if products is None:
+        products = sorted(image_products.keys())
+    band_names, aux_planes = [], []
+    for product in products:
+        band_names += [ name  for name  in image_products[product][0] if name  not in band_names ]
+        aux_planes += [ plane for plane in image_products[product][1] if plane not in aux_planes ]
+
+    bands, lambda_eff, aux = read_product_inputs(filename, camera=camera, band_names=band_names, aux_planes=aux_planes)
+
+    images = {}
+    for product in products:
+        images[product] = image_products[product][2](bands, lambda_eff, aux, **product_options.get(product, {}))
+        if product in savefiles:
+            save_image(images[product], savefiles[product], writer=writer)
+
+    del bands, aux
+    gc.collect()
+    return images
+
 
 def my_save_image(img, savefile, opt_text=None):
+    """ save an n x n x 3 image as a png with one image pixel per output pixel.  Draws on its own
+        Agg canvas rather than through pyplot, so it is safe to call from writer threads  """
     if img.shape[0] >1:
-        fig = plt.figure(figsize=(1,1))
+        fig = mpl_figure.Figure(figsize=(1,1))
+        canvas = mpl_backend_agg.FigureCanvasAgg(fig)
         ax = fig.add_subplot(111)
         imgplot = ax.imshow(img,origin='lower')
-        plt.axis('off')
+        ax.axis('off')
 
         if not opt_text==None:
             ax.text(img.shape[0]/2.0, img.shape[0]/2.0, opt_text, ha='center',va='center', color='white', fontsize=4)
@@ -325,11 +339,18 @@ def my_save_image(img, savefile, opt_text=None):
         fig.subplots_adjust(left=0.0, right=1.0, top=1.0, bottom=0.0)
         fig.savefig(savefile, dpi=img.shape[0]-1)
         fig.clf()
-        plt.close()
-        del img
+        del img, fig, canvas
         gc.collect()
 
 
+def save_image(img, savefile, opt_text=None, writer=None):
+    """ my_save_image, or hand the image to a sunpy__writer.output_writer to be saved in the background """
+    if writer is None:
+        my_save_image(img, savefile, opt_text=opt_text)
+    else:
+        writer.save_image(img, savefile, opt_text=opt_text)
+
+
 def asinh(inputArray, scale_min=None, scale_max=None, non_linear=2.0):
         imageData=np.array(inputArray, copy=True)
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+""" Per-stage timing and memory instrumentation for the synthetic_image pipeline.
+
+Profiling is off by default; in that case synthetic_image gets the shared null_profiler whose
+methods do nothing.  When enabled, every synthetic_image run records the wall time, process cpu
+time, growth of the peak resident memory and output array size of each stage (load,
+add_gaussian_psf, ...), plus counters such as the number of background retries.  At the end of
+the run the report (a plain dict) is stored in collected_reports and handed to every registered
+callback, which is the hook for batch systems to export it.
+
+Both the cpu clock (os.times) and the memory high-water mark (ru_maxrss) are process-wide:
+    process_cpu_time         cpu used by the whole process during the stage's wall interval,
+                             including other threads (the n_threads pool, writer threads, ...)
+    peak_memory_increase_mb  how far the process high-water mark rose during the stage; 0 for
+                             a stage that stayed below an earlier peak
+The report's process_cpu_time is the process cpu from the start to the end of the run (not a
+sum over stages, which would count concurrent stages more than once), and its peak_memory_mb the
+high-water mark of the process at the end of the run.
+
+Example usage:
+    sunpy__profile.enable_profiling(callback=my_exporter)
+    img = sunpy__synthetic_image.build_synthetic_image(filename, 'g_SDSS.res')
+    sunpy__profile.write_reports('./profile.json')
+"""
+import os
+import time
+import json
+import resource
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+profiling_enabled = False
+report_callbacks  = []
+collected_reports = []
+
+
+def enable_profiling(callback=None):
+    """ turn on profiling for all new synthetic_image runs; optionally register a report callback """
+    global profiling_enabled
+    profiling_enabled = True
+    if callback is not None:
+        report_callbacks.append(callback)
+
+
+def disable_profiling():
+    global profiling_enabled
+    profiling_enabled = False
+    del report_callbacks[:]
+
+
+def clear_reports():
+    del collected_reports[:]
+
+
+def write_reports(filename, reports=None):
+    """ write reports (default: all collected so far) to filename as json """
+    if reports is None:
+        reports = collected_reports
+    f = open(filename, 'w')
+    json.dump(reports, f, indent=1)
+    f.close()
+
+
+def new_run(**labels):
+    """ a run_profiler if profiling is enabled, otherwise the shared null_profiler """
+    if profiling_enabled:
+        return run_profiler(**labels)
+    return null_profiler
+
+
+def _peak_memory_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0       # ru_maxrss is in kB on linux
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class run_profiler:
+    """ collects stage timings and counters for one synthetic_image run """
+    def __init__(self, **labels):
+        self.labels   = labels
+        self.stages   = []
+        self.counters = {}
+        self.current  = None
+        self.start_wall = time.time()
+        self.start_cpu  = _cpu_time()
+
+    def start_stage(self, name):
+        if self.current is not None:
+            self.end_stage()
+        self.current = { 'stage': name, 'wall_start': time.time(), 'cpu_start': _cpu_time(),
+                         'peak_memory_start': _peak_memory_mb() }
+
+    def end_stage(self, array=None):
+        if self.current is None:
+            return
+        stage = self.current
+        self.current = None
+        stage['wall_time']      = time.time()  - stage.pop('wall_start')
+        stage['process_cpu_time'] = _cpu_time() - stage.pop('cpu_start')
+        stage['peak_memory_increase_mb'] = _peak_memory_mb() - stage.pop('peak_memory_start')
+        if array is not None:
+            stage['array_shape']  = list(array.shape)
+            stage['array_nbytes'] = int(array.nbytes)
+        self.stages.append(stage)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return { 'labels':          self.labels,
+                 'stages':          list(self.stages),
+                 'counters':        dict(self.counters),
+                 'total_wall_time': sum( [ stage['wall_time'] for stage in self.stages ] ),
+                 'process_cpu_time': _cpu_time() - self.start_cpu,
+                 'peak_memory_mb':  _peak_memory_mb() }
+
+    def finish(self):
+        self.end_stage()
+        this_report = self.report()
+        collected_reports.append(this_report)
+        for callback in report_callbacks:
+            callback(this_report)
+        return this_report
+
+
+class _null_profiler:
+    """ stands in for run_profiler when profiling is disabled; every call is a no-op """
+    def start_stage(self, name):
+        pass
+
+    def end_stage(self, array=None):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def finish(self):
+        return None
+
+
+null_profiler = _null_profiler()
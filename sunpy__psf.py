@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+""" PSF kernel library: gaussian and empirical (fits) kernels with cached FFT convolution.
+
+add_gaussian_psf only knows a circular gaussian of psf_fwhm_arcsec.  A psf_library holds named
+kernels -- gaussians or empirical PSF images loaded from fits files (e.g. for the HST bands
+21-27) -- and a mapping from bands to kernels.  Kernels are resampled to the working pixel scale
+(centred, unit sum) and their zero-padded FFTs are cached by (kernel, pixel scale, shape), so
+convolving many images of the same size costs one forward and one inverse FFT each.  Whole
+band stacks can be convolved in one batched FFT.  Convolution treats the image as zero outside
+its edges, like gaussian_filter(mode='constant') in add_gaussian_psf.
+
+Example usage:
+    library = sunpy__psf.psf_library()
+    library.add_fits('f160w', './psfs/f160w_psf.fits')
+    library.add_gaussian('sdss', 1.0)
+    library.set_band('f160w.IR.res', 'f160w')
+    img = sunpy__synthetic_image.build_synthetic_image(filename, 'f160w.IR.res', psf_library=library, ...)
+"""
+import numpy as np
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits  = sunpy__lazy.lazy_import('astropy.io.fits')
+scipy = sunpy__lazy.lazy_import('scipy', submodules=['scipy.ndimage', 'scipy.fftpack'])
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+def gaussian_kernel(sigma_pixels, truncate=4.0):
+    """ unit-sum circular gaussian sampled on a (2r+1) x (2r+1) grid, r = truncate sigma (as scipy.ndimage) """
+    radius = int(truncate * float(sigma_pixels) + 0.5)
+    x = np.arange(-radius, radius + 1)
+    profile = np.exp( -0.5 * (x / float(sigma_pixels))**2 )
+    profile = profile / profile.sum()
+    return np.outer(profile, profile)
+
+
+def kernel_pixel_arcsec(header):
+    """ pixel scale of a psf image from its header (PIXSCALE / PIXSCL keywords or the CD matrix) """
+    for key in ['PIXSCALE', 'PIXSCL', 'PIXELSCL']:
+        if header.get(key) is not None:
+            return float(header.get(key))
+    if header.get('CD1_1') is not None:
+        cd1_2 = header.get('CD1_2')
+        if cd1_2 is None:
+            cd1_2 = 0.0
+        return 3600.0 * (header.get('CD1_1')**2 + cd1_2**2)**0.5
+    return None
+
+
+def load_kernel_fits(filename, ext=0, pixel_arcsec=None):
+    """ (kernel image, pixel scale in arcsec) of a psf fits file """
+    if (not os.path.exists(filename)):
+        print "file not found:", filename
+        sys.exit()
+    hdulist = fits.open(filename)
+    image = np.array(hdulist[ext].data, dtype=np.float64)
+    if pixel_arcsec is None:
+        pixel_arcsec = kernel_pixel_arcsec(hdulist[ext].header)
+    hdulist.close()
+    if pixel_arcsec is None:
+        print "no pixel scale in the header of", filename, "-- pass pixel_arcsec"
+        sys.exit()
+    return image, pixel_arcsec
+
+
+def overlap_weights(centres, width, n_in):
+    """ (len(centres) x n_in) overlap lengths of pixels [c - width/2, c + width/2] with the
+        unit input pixels [i - 1/2, i + 1/2]                                           """
+    pixels = np.arange(n_in)
+    overlap = np.minimum(centres[:,np.newaxis] + 0.5 * width, pixels[np.newaxis,:] + 0.5) - \
+              np.maximum(centres[:,np.newaxis] - 0.5 * width, pixels[np.newaxis,:] - 0.5)
+    return np.clip(overlap, 0.0, None)
+
+
+def resample_kernel(kernel, kernel_pixel_arcsec, pixel_arcsec):
+    """ resample a psf image to pixel_arcsec pixels about its centre, on an odd-sized grid,
+        normalized to unit sum.  Coarser pixels integrate the kernel over their area (point
+        sampling would alias); finer pixels interpolate it linearly.                  """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    scale  = float(pixel_arcsec) / kernel_pixel_arcsec
+    half   = [ int(np.ceil( ((n - 1) / 2.0) / scale )) for n in kernel.shape ]
+    rows   = (kernel.shape[0] - 1) / 2.0 + scale * np.arange(-half[0], half[0] + 1)
+    cols   = (kernel.shape[1] - 1) / 2.0 + scale * np.arange(-half[1], half[1] + 1)
+    if scale > 1:
+        new_kernel = np.dot( np.dot( overlap_weights(rows, scale, kernel.shape[0]), kernel ),
+                             overlap_weights(cols, scale, kernel.shape[1]).T )
+    else:
+        new_kernel = scipy.ndimage.map_coordinates(kernel, np.meshgrid(rows, cols, indexing='ij'),
+                                                   order=1, mode='constant', cval=0.0)
+    new_kernel[new_kernel < 0] = 0.0
+    return new_kernel / new_kernel.sum()
+
+
+class psf_kernel:
+    """ a named psf: a gaussian of fwhm_arcsec, or an empirical image with its pixel scale """
+    def __init__(self, name, fwhm_arcsec=None, image=None, pixel_arcsec=None, truncate=4.0):
+        self.name         = name
+        self.fwhm_arcsec  = fwhm_arcsec
+        self.image        = image
+        self.pixel_arcsec = pixel_arcsec
+        self.truncate     = truncate
+        if image is None:
+            self.kind = 'gaussian'
+        else:
+            self.kind = 'empirical'
+
+    def sampled(self, pixel_arcsec):
+        """ the kernel sampled at pixel_arcsec pixels """
+        if self.kind == 'gaussian':
+            return gaussian_kernel(self.fwhm_arcsec * (1.0/2.355) / pixel_arcsec, truncate=self.truncate)
+        return resample_kernel(self.image, self.pixel_arcsec, pixel_arcsec)
+
+
+class psf_library:
+    """ named psf kernels, a band -> kernel map, and bounded (LRU) caches of sampled kernels and
+        kernel FFTs                                                                     """
+    def __init__(self, max_cached_ffts=32, max_cached_kernels=64):
+        self.kernels = {}
+        self.bands   = {}
+        self.sampled_cache = OrderedDict()
+        self.fft_cache     = OrderedDict()
+        self.max_cached_ffts    = max_cached_ffts
+        self.max_cached_kernels = max_cached_kernels
+        self.lock = threading.RLock()
+
+    def add_gaussian(self, name, fwhm_arcsec):
+        self.kernels[name] = psf_kernel(name, fwhm_arcsec=fwhm_arcsec)
+        return self.kernels[name]
+
+    def add_image(self, name, image, pixel_arcsec):
+        self.kernels[name] = psf_kernel(name, image=np.array(image, dtype=np.float64), pixel_arcsec=pixel_arcsec)
+        return self.kernels[name]
+
+    def add_fits(self, name, filename, ext=0, pixel_arcsec=None):
+        image, pixel_arcsec = load_kernel_fits(filename, ext=ext, pixel_arcsec=pixel_arcsec)
+        return self.add_image(name, image, pixel_arcsec)
+
+    def set_band(self, band, name):
+        """ use kernel name for band (a band index or a filter name such as 'f160w.IR.res') """
+        if name not in self.kernels:
+            print "[psf_library] unknown kernel:", name
+            sys.exit()
+        self.bands[band] = name
+
+    def kernel_for_band(self, band, band_name=None):
+        """ kernel name for a band (looked up by index, then by filter name), or None """
+        if band in self.bands:
+            return self.bands[band]
+        if band_name is not None and band_name in self.bands:
+            return self.bands[band_name]
+        return None
+
+    def kernel_image(self, name, pixel_arcsec):
+        """ kernel name sampled at pixel_arcsec; cached (LRU) """
+        key = (name, float(pixel_arcsec))
+        with self.lock:
+            if key in self.sampled_cache:
+                kernel = self.sampled_cache.pop(key)
+            else:
+                kernel = self.kernels[name].sampled(pixel_arcsec)
+            self.sampled_cache[key] = kernel
+            while len(self.sampled_cache) > self.max_cached_kernels:
+                self.sampled_cache.popitem(last=False)
+            return kernel
+
+    def fft_shape(self, shape, name, pixel_arcsec):
+        """ padded transform size for linear (non-wrapping) convolution of shape with the kernel """
+        kernel = self.kernel_image(name, pixel_arcsec)
+        return tuple( [ scipy.fftpack.next_fast_len(int(n + k)) for n, k in zip(shape[-2:], kernel.shape) ] )
+
+    def kernel_fft(self, name, pixel_arcsec, fft_shape):
+        """ rfft2 of the kernel zero-padded to fft_shape with its centre at [0,0]; cached (LRU) """
+        key = (name, float(pixel_arcsec), tuple(fft_shape))
+        with self.lock:
+            if key in self.fft_cache:
+                kernel_fft = self.fft_cache.pop(key)
+            else:
+                kernel = self.kernel_image(name, pixel_arcsec)
+                padded = np.zeros(fft_shape)
+                padded[:kernel.shape[0], :kernel.shape[1]] = kernel
+                padded = np.roll( np.roll(padded, -(kernel.shape[0] // 2), axis=0), -(kernel.shape[1] // 2), axis=1 )
+                kernel_fft = np.fft.rfft2(padded)
+            self.fft_cache[key] = kernel_fft
+            while len(self.fft_cache) > self.max_cached_ffts:
+                self.fft_cache.popitem(last=False)
+            return kernel_fft
+
+    def convolve_stack(self, stack, name, pixel_arcsec):
+        """ convolve every image of a (K x n x m) stack (or a single n x m image) with kernel name,
+            sampled at pixel_arcsec, in one batched FFT.  Output has the input shape.     """
+        stack = np.asarray(stack, dtype=np.float64)
+        n, m  = stack.shape[-2:]
+        fft_shape  = self.fft_shape(stack.shape, name, pixel_arcsec)
+        kernel_fft = self.kernel_fft(name, pixel_arcsec, fft_shape)
+        product = np.fft.rfft2(stack, s=fft_shape, axes=(-2,-1)) * kernel_fft
+        return np.fft.irfft2(product, s=fft_shape, axes=(-2,-1))[..., :n, :m]
+
+    def convolve(self, image, name, pixel_arcsec):
+        return self.convolve_stack(image, name, pixel_arcsec)
+
+    def convolve_tiled(self, image, name, pixel_arcsec, tile_size, out=None):
+        """ overlap-save convolution of a (possibly memory-mapped) image tile by tile; every tile is
+            read with a halo of the kernel radius and zero padded to the same shape, so a single
+            cached kernel FFT serves all tiles                                              """
+        kernel = self.kernel_image(name, pixel_arcsec)
+        halo = [ k // 2 for k in kernel.shape ]
+        tile_size = int(tile_size)
+        if out is None:
+            out = np.zeros(image.shape)
+        n_rows, n_cols = image.shape
+        window = np.zeros( (tile_size + 2 * halo[0], tile_size + 2 * halo[1]) )
+        for i in range(0, n_rows, tile_size):
+            for j in range(0, n_cols, tile_size):
+                i0, i1 = max(i - halo[0], 0), min(i + tile_size + halo[0], n_rows)
+                j0, j1 = max(j - halo[1], 0), min(j + tile_size + halo[1], n_cols)
+                window[:,:] = 0.0
+                window[i0-i+halo[0]:i1-i+halo[0], j0-j+halo[1]:j1-j+halo[1]] = image[i0:i1, j0:j1]
+                tile = self.convolve_stack(window, name, pixel_arcsec)
+                size = ( min(tile_size, n_rows - i), min(tile_size, n_cols - j) )
+                out[i:i+size[0], j:j+size[1]] = tile[halo[0]:halo[0]+size[0], halo[1]:halo[1]+size[1]]
+        return out
+
+    def clear_cache(self):
+        with self.lock:
+            self.sampled_cache.clear()
+            self.fft_cache.clear()
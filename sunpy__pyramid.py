@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+""" Multi-resolution tile pyramids and fixed-size thumbnails of final images, for web viewers.
+
+my_save_image ties the png size to the array shape, so every thumbnail size or zoom level
+meant another call of the plotting functions.  write_pyramid takes one final RGB (n x n x 3) or
+single-band image and builds every level from the one above it by 2x2 block averaging, so the
+whole pyramid costs about 1/3 of a pass over the full image beyond the first level.  The image
+is padded to tile_size x 2^max_zoom pixels; padded pixels carry no weight in the averages (edge
+pixels are not darkened) and tiles that are entirely padding are not written.
+
+Tiles follow the usual z/x/y layout of web map viewers ({z}/{x}/{y}.png, z = 0 one tile for
+the whole image, x the column and y the row counted from the top), and pyramid.json records
+the geometry.  Thumbnails (thumb_<size>.png) are area averages of the smallest level that is
+at least that large, size pixels on the long side with the image's aspect ratio kept.  With a sunpy__writer.output_writer the png files are encoded and written in the background.
+
+Example usage:
+    img = sunpy__plot.return_synthetic_sdss_gri_img(filename)[0]
+    sunpy__pyramid.write_pyramid(img, './viewer/777_gri', tile_size=256, thumbnail_sizes=[64, 128])
+"""
+import numpy as np
+import os
+import sys
+import json
+
+import sunpy.sunpy__atlas as sunpy__atlas
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+def block_sum(img):
+    """ sums over 2 x 2 blocks of an image with even sides (extra axes, e.g. colour, are kept) """
+    return img.reshape( (img.shape[0] // 2, 2, img.shape[1] // 2, 2) + img.shape[2:] ).sum(axis=3).sum(axis=1)
+
+
+def max_zoom(n_pixels, tile_size=256):
+    """ zoom level at which one image pixel is one tile pixel """
+    return int( max( np.ceil( np.log2( n_pixels / float(tile_size) ) ), 0 ) )
+
+
+def pyramid_levels(img, tile_size=256):
+    """ yield (zoom, image, coverage) from the full resolution level (zoom = max_zoom) down to
+        zoom 0.  image is padded to tile_size 2^zoom on a side, coverage is the fraction of each
+        pixel covered by the original image (0 in the padding)                         """
+    img = np.asarray(img, dtype=np.float64)
+    zoom = max_zoom( max(img.shape[0], img.shape[1]), tile_size )
+    side = tile_size * 2**zoom
+    weighted = np.zeros( (side, side) + img.shape[2:] )
+    weighted[:img.shape[0], :img.shape[1]] = img
+    coverage = np.zeros( (side, side) )
+    coverage[:img.shape[0], :img.shape[1]] = 1.0
+    while True:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            norm = np.where(coverage > 0, 1.0 / coverage, 0.0)
+        yield zoom, weighted * norm.reshape( norm.shape + (1,) * (img.ndim - 2) ), coverage
+        if zoom == 0:
+            return
+        weighted = block_sum(weighted)          # sums of image x coverage ...
+        coverage = 0.25 * block_sum(coverage)   # ... and the mean coverage of each 2 x 2 block
+        weighted *= 0.25
+        zoom -= 1
+
+
+def area_weights(n_in, n_out):
+    """ (n_out x n_in) matrix averaging n_in pixels into n_out by their overlap lengths """
+    edges = np.linspace(0.0, n_in, n_out + 1)
+    pixels = np.arange(n_in)
+    overlap = np.minimum(edges[1:,np.newaxis], pixels[np.newaxis,:] + 1.0) - np.maximum(edges[:-1,np.newaxis], pixels[np.newaxis,:])
+    return np.clip(overlap, 0.0, None) / np.diff(edges)[:,np.newaxis]
+
+
+def _save_png(img, savefile, writer=None):
+    if writer is None:
+        sunpy__atlas.write_png(savefile, img)
+    else:
+        writer.save_png(img, savefile)
+
+
+def write_pyramid(img, directory, tile_size=256, thumbnail_sizes=[64, 128, 256], display_range=None,
+                  origin='lower', writer=None):
+    """ write the tile pyramid and thumbnails of img into directory; returns the pyramid.json
+        metadata.  Floats are scaled to 8 bits from display_range (default [0, 1] for RGB
+        images, as the sunpy__plot composites, and the image's min / max for single bands).
+        origin='lower' shows the image as my_save_image does (row 0 at the bottom).     """
+    img = np.asarray(img)
+    if img.ndim not in [2, 3] or (img.ndim == 3 and img.shape[2] != 3):
+        print "write_pyramid: image must be n x m or n x m x 3, not", img.shape
+        sys.exit()
+    if origin == 'lower':
+        img = img[::-1]
+    if img.dtype == np.uint8:
+        display_range = (0.0, 255.0)
+    elif display_range is None:
+        if img.ndim == 3:
+            display_range = (0.0, 1.0)
+        else:
+            finite = img[ np.isfinite(img) ]
+            display_range = (finite.min(), finite.max()) if len(finite) > 0 else (0.0, 1.0)
+    height, width = img.shape[0], img.shape[1]
+
+    thumbnails = sorted(thumbnail_sizes, reverse=True)
+    zoom_levels = {}
+    for zoom, level, coverage in pyramid_levels(img, tile_size):
+        scale = 2**( max_zoom( max(height, width), tile_size ) - zoom )         # image pixels per level pixel
+        level_height, level_width = int( np.ceil( height / float(scale) ) ), int( np.ceil( width / float(scale) ) )
+        n_tiles = 2**zoom
+        n_written = 0
+        for x in range(n_tiles):
+            for y in range(n_tiles):
+                if x * tile_size >= level_width or y * tile_size >= level_height:
+                    continue                            # padding only
+                tile = level[y*tile_size:(y+1)*tile_size, x*tile_size:(x+1)*tile_size]
+                tile_directory = os.path.join(directory, str(zoom), str(x))
+                if not os.path.exists(tile_directory):
+                    os.makedirs(tile_directory)
+                _save_png( sunpy__atlas.scale_to_uint8(tile, display_range), os.path.join(tile_directory, str(y)+'.png'), writer=writer )
+                n_written += 1
+        zoom_levels[zoom] = n_written
+
+        # a thumbnail comes from the last (smallest) level that still covers it at full size
+        while len(thumbnails) > 0 and ( zoom == 0 or max(level_height, level_width) // 2 < thumbnails[0] ):
+            size = thumbnails.pop(0)
+            scale = size / float( max(level_height, level_width) )
+            row_weights = area_weights( level_height, max( int(round(level_height * scale)), 1 ) )
+            col_weights = area_weights( level_width,  max( int(round(level_width  * scale)), 1 ) )
+            thumbnail = np.tensordot( row_weights, np.tensordot(col_weights, level[:level_height, :level_width], axes=(1, 1)), axes=(1, 1) )
+            _save_png( sunpy__atlas.scale_to_uint8(thumbnail, display_range), os.path.join(directory, 'thumb_'+str(size)+'.png'), writer=writer )
+
+    metadata = { 'width': width, 'height': height, 'tile_size': tile_size,
+                 'min_zoom': 0, 'max_zoom': max_zoom( max(height, width), tile_size ),
+                 'tiles': '{z}/{x}/{y}.png', 'n_tiles': [ zoom_levels[zoom] for zoom in sorted(zoom_levels) ],
+                 'thumbnails': [ 'thumb_'+str(size)+'.png' for size in sorted(thumbnail_sizes) ] }
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    f = open( os.path.join(directory, 'pyramid.json'), 'w' )
+    json.dump(metadata, f, indent=1, sort_keys=True)
+    f.close()
+    return metadata
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+""" Remote access to SUNRISE fits files using HTTP range requests.
+
+The broadband_<id>.fits files on the Illustris host contain every camera, the AUX maps
+and the INTEGRATED_QUANTITIES table.  For most image jobs only one camera's
+BROADBAND-NONSCATTER HDU plus the FILTERS and PARAMETERS HDUs are needed.  The
+remote_sunrise_file class defined here walks the fits header structure with small range
+requests, then fetches only the HDUs (or single band planes) that are asked for.  Every
+fetched byte range is cached locally, so repeat access never touches the network.
+
+Example usage:
+    rfile = sunpy__remote.remote_sunrise_file(dl_base+'illustris_images/subdir_543/broadband_12345.fits')
+    image = rfile.load_broadband_image(band='g_SDSS.res', camera=0)
+
+For testing, start_range_server can serve a local directory with range request support.
+"""
+import numpy as np
+import os
+import sys
+import io
+import hashlib
+import threading
+import urllib
+import urllib2
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+fits_block      = 2880          # all fits headers and data segments are padded to this size
+fits_card       = 80
+n_header_blocks = 4             # number of header blocks requested at once while walking the file
+
+bitpix_dtypes = { 8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8' }
+
+
+def _padded(n_bytes):
+    return int( np.ceil( 1.0 * n_bytes / fits_block ) ) * fits_block
+
+
+class byte_range_cache:
+    """ Local on-disk cache of byte ranges fetched from a single url """
+    def __init__(self, url, cache_dir='./remote_cache'):
+        self.url = url
+        self.cache_dir = os.path.join(cache_dir, hashlib.md5(url).hexdigest())
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.ranges = []
+        self.file_size = None
+        for name in os.listdir(self.cache_dir):
+            if name == 'size':          # total file size, from the Content-Range of an earlier fetch
+                f = open(os.path.join(self.cache_dir, name), 'r')
+                self.file_size = int(f.read())
+                f.close()
+                continue
+            start, end = name.split('-')
+            self.ranges.append( (int(start), int(end)) )
+        self.n_requests = 0
+        self.n_bytes_fetched = 0
+
+    def read(self, start, length):
+        """ return bytes [start, start+length) from the cache, fetching them if needed.
+            Fewer bytes are returned if the range runs past the end of the file.        """
+        end = start + length
+        if self.file_size is not None and start >= self.file_size:
+            return ''
+        for (c_start, c_end) in self.ranges:
+            if c_start <= start and (end <= c_end or c_end == self.file_size):
+                f = open(os.path.join(self.cache_dir, str(c_start)+'-'+str(c_end)), 'rb')
+                f.seek(start - c_start)
+                data = f.read(length)
+                f.close()
+                return data
+
+        data = self.fetch(start, length)
+        if len(data) > 0:
+            f = open(os.path.join(self.cache_dir, str(start)+'-'+str(start+len(data))), 'wb')
+            f.write(data)
+            f.close()
+            self.ranges.append( (start, start+len(data)) )
+        return data
+
+    def fetch(self, start, length):
+        request = urllib2.Request(self.url)
+        request.add_header('Range', 'bytes='+str(start)+'-'+str(start+length-1))
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, error:
+            if error.code == 416:       # requested range starts past the end of the file
+                return ''
+            raise
+
+        if response.getcode() == 206:
+            data = response.read()
+            content_range = response.info().getheader('Content-Range')
+            if content_range is not None and self.file_size is None:
+                self.file_size = int(content_range.split('/')[-1])
+                f = open(os.path.join(self.cache_dir, 'size'), 'w')
+                f.write(str(self.file_size))
+                f.close()
+        else:                           # server ignored the range; skip ahead to what we want
+            print "WARNING: server does not support range requests:", self.url
+            data = response.read(start + length)[start:]
+        response.close()
+
+        self.n_requests += 1
+        self.n_bytes_fetched += len(data)
+        return data
+
+
+class remote_sunrise_file:
+    """ SUNRISE fits file read over http, one HDU (or band plane) at a time """
+    def __init__(self, url, cache_dir='./remote_cache'):
+        self.url   = url
+        self.cache = byte_range_cache(url, cache_dir=cache_dir)
+        self.hdu_info = []              # list of (name, header, header_bytes, data_start, data_size)
+        self._scan_headers()
+
+    def _read_header(self, start):
+        """ read header blocks starting at byte start until the END card is found """
+        raw = ''
+        while True:
+            new_bytes = self.cache.read(start + len(raw), n_header_blocks * fits_block)
+            if len(new_bytes) == 0:     # end of file; no more HDUs
+                return None
+            raw += new_bytes
+            for index in range(0, len(raw), fits_card):
+                if raw[index:index+fits_card].startswith('END' + ' '*5):
+                    n_bytes = _padded(index + fits_card)
+                    return raw[:n_bytes]
+
+    def _scan_headers(self):
+        position = 0
+        while True:
+            header_bytes = self._read_header(position)
+            if header_bytes is None:
+                break
+            header = fits.Header.fromstring(header_bytes)
+
+            if header.get('NAXIS', 0) > 0:
+                n_elements = 1
+                for axis in range(header['NAXIS']):
+                    n_elements *= header['NAXIS'+str(axis+1)]
+                data_size = abs(header['BITPIX'])/8 * header.get('GCOUNT', 1) * (header.get('PCOUNT', 0) + n_elements)
+            else:
+                data_size = 0
+
+            if len(self.hdu_info) == 0:
+                name = 'PRIMARY'
+            else:
+                name = header.get('EXTNAME', str(len(self.hdu_info))).strip()
+
+            data_start = position + len(header_bytes)
+            self.hdu_info.append( (name, header, header_bytes, data_start, data_size) )
+            position = data_start + _padded(data_size)
+
+    def _info(self, ext):
+        if type(ext) is int:
+            return self.hdu_info[ext]
+        for info in self.hdu_info:
+            if info[0].upper() == ext.upper():
+                return info
+        print "HDU not found:", ext, "in", self.url
+        sys.exit()
+
+    def hdu_names(self):
+        return [info[0] for info in self.hdu_info]
+
+    def header(self, ext):
+        return self._info(ext)[1]
+
+    def hdu(self, ext):
+        """ fetch a full HDU and return it as an astropy HDU object """
+        name, header, header_bytes, data_start, data_size = self._info(ext)
+        data_bytes = self.cache.read(data_start, _padded(data_size)) if data_size > 0 else ''
+        if name == 'PRIMARY':
+            buffer = header_bytes + data_bytes
+            index  = 0
+        else:
+            buffer = fits.PrimaryHDU().header.tostring() + header_bytes + data_bytes
+            index  = 1
+        hdulist = fits.open(io.BytesIO(buffer))
+        this_hdu = hdulist[index]
+        this_hdu.data                   # force the read while the buffer is open
+        return this_hdu
+
+    def data(self, ext):
+        return self.hdu(ext).data
+
+    def image_plane(self, ext, plane):
+        """ fetch a single plane of a 3D image HDU (e.g., one band of the broadband cube) """
+        name, header, header_bytes, data_start, data_size = self._info(ext)
+        n1, n2 = header['NAXIS1'], header['NAXIS2']
+        dtype  = np.dtype( bitpix_dtypes[header['BITPIX']] )
+        plane_bytes = n1 * n2 * dtype.itemsize
+        raw = self.cache.read(data_start + plane * plane_bytes, plane_bytes)
+        image = np.frombuffer(raw, dtype=dtype).reshape(n2, n1).astype(float)
+        if 'BSCALE' in header or 'BZERO' in header:
+            image = image * header.get('BSCALE', 1.0) + header.get('BZERO', 0.0)
+        return image
+
+#===============================================================================#
+# The routines below mirror the loaders in sunpy__load, but only fetch what they need.
+#===============================================================================#
+    def load_broadband_names(self):
+        return self.data('FILTERS').field(0)
+
+    def load_broadband_effective_wavelengths(self):
+        return self.data('FILTERS')['lambda_eff']
+
+    def load_fov(self):
+        return self.header('CAMERA0-PARAMETERS')['linear_fov']
+
+    def load_camera_angles(self, camera=0):
+        param_header = self.header('CAMERA'+str(camera)+'-PARAMETERS')
+        return param_header['theta'], param_header['phi']
+
+    def load_redshift(self):
+        return self.header(1)['REDSHIFT']
+
+    def load_broadband_image(self, band=0, camera=0):
+        if type(band) is not int:
+            band_names = self.load_broadband_names()
+            band = (((band_names == band).nonzero())[0])[0]
+        image = self.image_plane('CAMERA'+str(camera)+'-BROADBAND-NONSCATTER', band)
+        image[ image < 1e-20 ] = 1e-20
+        return image
+
+    def load_all_broadband_images(self, camera=0):
+        data = np.array( self.data('CAMERA'+str(camera)+'-BROADBAND-NONSCATTER'), dtype=float )
+        data[ data < 1e-20 ] = 1e-20
+        return data
+
+
+#===============================================================================#
+# A small range capable http server, for serving local files in tests.
+#===============================================================================#
+class range_request_handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """ SimpleHTTPRequestHandler with support for single "Range: bytes=a-b" requests """
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if path is None:                # translate_path refused a path outside the served directory
+            self.send_error(403, "Forbidden")
+            return None
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+        size = os.path.getsize(path)
+        start, end = range_header.strip().split('=')[1].split('-')
+        start = int(start)
+        end   = size - 1 if end == '' else min(int(end), size - 1)
+        if start >= size:
+            self.send_error(416, "Requested range not satisfiable")
+            return None
+
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-type", "application/octet-stream")
+        self.send_header("Content-Range", "bytes "+str(start)+"-"+str(end)+"/"+str(size))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class threaded_http_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_range_server(directory, port=0):
+    """ serve directory over http with range support on a background thread; returns (server, base_url) """
+    directory = os.path.abspath(directory)
+
+    class handler(range_request_handler):
+        def translate_path(self, path):
+            path = urllib.unquote( path.split('?')[0].split('#')[0] )
+            path = os.path.normpath( os.path.join(directory, path.lstrip('/')) )
+            if path != directory and not path.startswith(directory + os.sep):
+                return None
+            return path
+
+    server = threaded_http_server(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:'+str(server.server_address[1])+'/'
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+""" Bulk SED extraction and vectorized synthetic photometry over many galaxies.
+
+The load_sed_* routines in sunpy__load open a file to get one INTEGRATED_QUANTITIES column of
+one galaxy.  extract_seds reads lambda, L_lambda and the per-camera L_lambda_* columns of a
+whole list of files (in parallel worker processes) into a columnar on-disk table: one .npy
+array of shape (n_galaxies, n_lambda) per column, which sed_table opens memory-mapped.
+
+A filter_set integrates an SED matrix against all of its filter curves with one matrix product:
+the curves are turned into a (n_filters x n_lambda) weight matrix on the SED wavelength grid
+once, and L_nu (or AB magnitudes) for every galaxy and filter follow from seds . weights^T.
+
+Example usage:
+    table = sunpy__sed.extract_seds(filenames, './seds', n_processes=8)
+    filters = sunpy__sed.load_filter_curves(['u_SDSS.res', 'g_SDSS.res', 'r_SDSS.res'])
+    mags = filters.ab_magnitudes(table.column('L_lambda_nonscatter0'), table.sed_lambda)
+"""
+import numpy as np
+import os
+import sys
+import itertools
+import traceback
+import multiprocessing
+
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+speedoflight_m  = 2.99792458e8
+parsec_in_m     = 3.0857e16
+ab_zeropoint    = 3631.0e-26        # 3631 Jy in W/m^2/Hz
+
+lambda_column   = 'lambda'
+
+
+def read_sed_columns(filename, columns=None):
+    """ (lambda, {column: L_lambda array}) from the INTEGRATED_QUANTITIES table of one file, with
+        a single open.  columns=None reads every column except lambda.                 """
+    if (not os.path.exists(filename)):
+        print "file not found:", filename
+        sys.exit()
+    hdulist = fits.open(filename)
+    data = hdulist['INTEGRATED_QUANTITIES'].data
+    if columns is None:
+        columns = [ name for name in data.columns.names if name.strip() != lambda_column ]
+    sed_lambda = np.array(data[lambda_column], dtype=np.float64)
+    seds = dict( [ (name, np.array(data[name], dtype=np.float64)) for name in columns ] )
+    hdulist.close()
+    return sed_lambda, seds
+
+
+def _read_sed_worker(args):
+    index, filename, columns = args
+    if (not os.path.exists(filename)):
+        return index, None, None, "file not found"
+    try:
+        sed_lambda, seds = read_sed_columns(filename, columns)
+        return index, sed_lambda, seds, None
+    except (Exception, SystemExit):
+        return index, None, None, traceback.format_exc()
+
+
+class sed_table:
+    """ columnar SED table written by extract_seds: sed_lambda, one (n_galaxies x n_lambda)
+        array per column (memory-mapped), the source filenames and a valid flag per galaxy """
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory  = directory
+        self.mmap_mode  = mmap_mode
+        self.sed_lambda = np.load( os.path.join(directory, 'lambda.npy') )
+        self.valid      = np.load( os.path.join(directory, 'valid.npy') )
+        self.filenames  = [ line.rstrip('\n') for line in open( os.path.join(directory, 'filenames.txt') ) ]
+        self.columns    = [ line.rstrip('\n') for line in open( os.path.join(directory, 'columns.txt') ) ]
+
+    def column(self, name):
+        """ the (n_galaxies x n_lambda) array of column name """
+        if name not in self.columns:
+            print "[sed_table] unknown column:", name
+            sys.exit()
+        return np.load( os.path.join(self.directory, name+'.npy'), mmap_mode=self.mmap_mode )
+
+    def __len__(self):
+        return len(self.filenames)
+
+
+def extract_seds(filenames, directory, columns=None, n_processes=1, chunksize=8, verbose=True):
+    """ read the SEDs of every file in filenames into a columnar table in directory (see
+        sed_table) using n_processes worker processes.  All files must share the wavelength
+        grid of the first one; files that are missing, unreadable or on another grid get NaN
+        rows and valid = False.  Returns the sed_table.                                   """
+    filenames = [ str(f) for f in filenames ]
+    sed_lambda, seds = read_sed_columns(filenames[0], columns)
+    if columns is None:
+        columns = sorted(seds.keys())
+    n_galaxies, n_lambda = len(filenames), len(sed_lambda)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    np.save( os.path.join(directory, 'lambda.npy'), sed_lambda )
+    outputs = {}
+    for name in columns:
+        outputs[name] = np.lib.format.open_memmap( os.path.join(directory, name+'.npy'), mode='w+',
+                                                   dtype=np.float64, shape=(n_galaxies, n_lambda) )
+    valid = np.zeros(n_galaxies, dtype=bool)
+
+    tasks = [ (index, filename, columns) for index, filename in enumerate(filenames) ]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes)
+        results = pool.imap_unordered(_read_sed_worker, tasks, chunksize)
+    else:
+        pool = None
+        results = itertools.imap(_read_sed_worker, tasks)
+
+    try:
+        for index, this_lambda, this_seds, error in results:
+            if error is None and (len(this_lambda) != n_lambda or np.any(this_lambda != sed_lambda)):
+                error = "wavelength grid differs from "+filenames[0]
+            if error is not None:
+                if verbose:
+                    print "[extract_seds] skipping", filenames[index]+":", error.strip().split('\n')[-1]
+                for name in columns:
+                    outputs[name][index,:] = np.nan
+                continue
+            for name in columns:
+                outputs[name][index,:] = this_seds[name]
+            valid[index] = True
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for name in columns:
+        outputs[name].flush()
+    del outputs
+    np.save( os.path.join(directory, 'valid.npy'), valid )
+    f = open( os.path.join(directory, 'filenames.txt'), 'w' )
+    f.write( ''.join( [ filename+'\n' for filename in filenames ] ) )
+    f.close()
+    f = open( os.path.join(directory, 'columns.txt'), 'w' )
+    f.write( ''.join( [ name+'\n' for name in columns ] ) )
+    f.close()
+    if verbose:
+        print "[extract_seds] "+str(valid.sum())+" of "+str(n_galaxies)+" SEDs written to "+directory
+    return sed_table(directory)
+
+
+class filter_set:
+    """ filter transmission curves (wavelengths in m) for synthetic photometry of SED matrices """
+    def __init__(self, names, wavelengths, transmissions):
+        self.names         = list(names)
+        self.wavelengths   = [ np.asarray(w, dtype=np.float64) for w in wavelengths ]
+        self.transmissions = [ np.asarray(t, dtype=np.float64) for t in transmissions ]
+        self.weight_cache  = {}
+
+    def weights(self, sed_lambda):
+        """ (n_filters x n_lambda) matrix W with L_nu = L_lambda . W^T: the photon-weighted mean
+            L_nu over each curve, integral(L_lambda lambda T dlambda) / integral(c/lambda T dlambda),
+            trapezoid-integrated on the curve's own grid with the SED linearly interpolated.
+            Cached per wavelength grid.                                                     """
+        sed_lambda = np.asarray(sed_lambda, dtype=np.float64)
+        key = (len(sed_lambda), sed_lambda.tostring())
+        if key in self.weight_cache:
+            return self.weight_cache[key]
+
+        n_lambda = len(sed_lambda)
+        matrix = np.zeros( (len(self.names), n_lambda) )
+        for row, (wavelength, transmission) in enumerate(zip(self.wavelengths, self.transmissions)):
+            dlambda = np.zeros(len(wavelength))                     # trapezoid weights on the curve grid
+            dlambda[1:]  += 0.5 * np.diff(wavelength)
+            dlambda[:-1] += 0.5 * np.diff(wavelength)
+            norm = np.sum( transmission * speedoflight_m / wavelength * dlambda )
+            if norm <= 0:
+                print "[filter_set] filter has no transmission:", self.names[row]
+                matrix[row,:] = np.nan
+                continue
+            point_weights = transmission * wavelength * dlambda / norm
+
+            inside = (wavelength >= sed_lambda[0]) & (wavelength <= sed_lambda[-1])     # SED is 0 outside its grid
+            hi = np.clip( np.searchsorted(sed_lambda, wavelength[inside]), 1, n_lambda - 1 )
+            lo = hi - 1
+            t  = (wavelength[inside] - sed_lambda[lo]) / (sed_lambda[hi] - sed_lambda[lo])
+            np.add.at(matrix[row], lo, point_weights[inside] * (1.0 - t))
+            np.add.at(matrix[row], hi, point_weights[inside] * t)
+
+        self.weight_cache[key] = matrix
+        return matrix
+
+    def l_nu(self, seds, sed_lambda, chunk_rows=4096):
+        """ (n_galaxies x n_filters) mean L_nu in W/Hz for an (n_galaxies x n_lambda) L_lambda matrix
+            in W/m (or a single SED), in chunks of chunk_rows rows so memory-mapped tables stream """
+        weights = self.weights(sed_lambda).T
+        if np.ndim(seds) == 1:
+            return np.dot(np.asarray(seds, dtype=np.float64), weights)
+        result = np.empty( (seds.shape[0], weights.shape[1]) )
+        for start in range(0, seds.shape[0], chunk_rows):
+            result[start:start+chunk_rows] = np.dot( np.asarray(seds[start:start+chunk_rows], dtype=np.float64), weights )
+        return result
+
+    def ab_magnitudes(self, seds, sed_lambda, dist_pc=10.0, chunk_rows=4096):
+        """ AB magnitudes at dist_pc parsecs (absolute magnitudes by default); no k-correction """
+        f_nu = self.l_nu(seds, sed_lambda, chunk_rows=chunk_rows) / (4.0 * np.pi * (dist_pc * parsec_in_m)**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return -2.5 * np.log10( f_nu / ab_zeropoint )
+
+
+def load_filter_curves(filenames, wavelength_unit=1e-10, names=None):
+    """ filter_set from two-column (wavelength, transmission) text files such as the SUNRISE .res
+        curves; wavelength_unit converts the first column to m (default Angstrom)       """
+    wavelengths, transmissions = [], []
+    for filename in filenames:
+        if (not os.path.exists(filename)):
+            print "file not found:", filename
+            sys.exit()
+        curve = np.loadtxt(filename)
+        order = np.argsort(curve[:,0])
+        wavelengths.append( curve[order,0] * wavelength_unit )
+        transmissions.append( curve[order,1] )
+    if names is None:
+        names = [ os.path.basename(filename) for filename in filenames ]
+    return filter_set(names, wavelengths, transmissions)
+
+
+def tophat_filters(names, lambda_eff, ewidth_lambda, n_points=101):
+    """ filter_set of top-hat curves of width ewidth_lambda centred on lambda_eff (in m) """
+    wavelengths = [ np.linspace(l - 0.5 * w, l + 0.5 * w, n_points) for l, w in zip(lambda_eff, ewidth_lambda) ]
+    return filter_set(names, wavelengths, [ np.ones(n_points) for name in names ])
+
+
+def file_tophat_filters(filename):
+    """ top-hat approximations of the bands in the FILTERS table of a SUNRISE file """
+    if (not os.path.exists(filename)):
+        print "file not found:", filename
+        sys.exit()
+    hdulist = fits.open(filename)
+    data = hdulist['FILTERS'].data
+    filters = tophat_filters(data.field(0), data['lambda_eff'], data['ewidth_lambda'])
+    hdulist.close()
+    return filters
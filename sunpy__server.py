@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+""" Local HTTP render server around sunpy__plot and sunpy__synthetic_image with warm caches.
+
+Rendering one thumbnail from a script pays for the imports, opening the SUNRISE file, the
+cosmology, the Petrosian radius and loading a background mosaic, every time.  A render_server
+stays up and keeps all of that warm: decoded SUNRISE inputs of recently used files (LRU),
+background mosaics (sunpy__synthetic_image.background_cache, found relative to the working
+directory as usual), cosmologies, PSF kernel FFTs (one sunpy__psf.psf_library per PSF width,
+with use_psf_library=True), the Petrosian radius and seed of every galaxy / realism setting, and recently rendered band
+images.  Identical requests that arrive while one
+is being rendered wait for that render instead of starting their own.
+
+Requests are GET /render?file=...&... with
+    file        path of the SUNRISE file, relative to the server's data directory
+    product     'synthetic' (default) or a sunpy__plot.image_products name (idealized image);
+                for the physical-value maps (mass_weighted_age, stellar_metal) the png is
+                stretched linearly from scale_min / scale_max (default the map's min / max),
+                or with asinh if non_linear is given
+    bands       comma separated band names or indices; three bands (blue to red) give a
+                Lupton rgb composite, one band an asinh greyscale image
+    camera      camera number (default 0)
+    format      'png' (default) or 'npy' (the unstretched band images, n_bands x n x n)
+plus any synthetic_image realism parameter (psf_fwhm_arcsec, pixelsize_arcsec, sn_limit,
+add_psf, add_noise, add_background, rebin_phys, resize_rp, rebin_gz, seed, redshift, ...) and
+stretch parameters (lupton_alpha, lupton_Q, scale_min, scale_max, non_linear, b_fac, g_fac, r_fac).
+Without a seed the galaxy number in the file name (broadband_<number>.fits) is used, as sunpy__plot does.
+GET /stats returns the cache statistics as json.
+
+Example usage:
+    python sunpy__server.py ./illustris_images 8642
+    curl 'http://127.0.0.1:8642/render?file=broadband_12345.fits&bands=g_SDSS.res,r_SDSS.res,i_SDSS.res&seed=1' > gri.png
+"""
+import numpy as np
+import os
+import sys
+import io
+import json
+import time
+import urlparse
+import threading
+import traceback
+import BaseHTTPServer
+from collections import OrderedDict
+
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__plot as sunpy__plot
+import sunpy.sunpy__atlas as sunpy__atlas
+import sunpy.sunpy__psf as sunpy__psf
+import sunpy.sunpy__remote as sunpy__remote
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+
+
+# request parameters and how to parse them; realism parameters are passed on to synthetic_image
+realism_parameters = { 'add_psf':          'bool',
+                       'psf_fwhm_arcsec':  'float',
+                       'psf_tile_size':    'int',
+                       'rebin_phys':       'bool',
+                       'pixelsize_arcsec': 'float',
+                       'add_noise':        'bool',
+                       'sn_limit':         'float',
+                       'sky_sig':          'float',
+                       'seed':             'int',
+                       'r_petro_kpc':      'float',
+                       'resize_rp':        'bool',
+                       'add_background':   'bool',
+                       'fix_seed':         'bool',
+                       'rebin_gz':         'bool',
+                       'n_target_pixels':  'int',
+                       'redshift':         'float',
+                       'resample_mode':    'str' }
+
+stretch_parameters = { 'lupton_alpha': 'float',
+                       'lupton_Q':     'float',
+                       'scale_min':    'float',
+                       'scale_max':    'float',
+                       'non_linear':   'float',
+                       'b_fac':        'float',
+                       'g_fac':        'float',
+                       'r_fac':        'float' }
+
+default_bands   = 'g_SDSS.res,r_SDSS.res,i_SDSS.res'
+default_warm_bands = [3, 4, 5]          # g, r, i in the Illustris band order
+default_stretch = { 'lupton_alpha': 0.5, 'lupton_Q': 0.5, 'scale_min': 1e-4, 'b_fac': 0.7, 'g_fac': 1.0, 'r_fac': 1.3,
+                    'scale_max': None, 'non_linear': 0.5 }
+
+
+class request_error(Exception):
+    """ a bad render request; code is the http status to answer with """
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def parse_value(name, value, kind):
+    try:
+        if value.lower() == 'none':
+            return None
+        if kind == 'bool':
+            if value.lower() not in ['1', '0', 'true', 'false', 'yes', 'no']:
+                raise ValueError(value)
+            return value.lower() in ['1', 'true', 'yes']
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+        return str(value)
+    except ValueError:
+        raise request_error(400, "bad value for "+name+": "+value)
+
+
+def galaxy_seed(filename):
+    """ default seed of a request: the galaxy number of a broadband_<number>.fits file, as sunpy__plot uses """
+    name = os.path.basename(filename)
+    try:
+        return int(name[name.index('broadband_')+10:name.index('.fits')])
+    except ValueError:
+        raise request_error(400, "no seed given and none can be taken from the file name: "+filename)
+
+
+def display_scaled(img, scale_min=None, scale_max=None, non_linear=None):
+    """ img stretched to [0, 1] for display: linearly from [scale_min, scale_max] (default the finite
+        min / max of img), or with sunpy__plot.asinh if non_linear is given                  """
+    img = np.asarray(img, dtype=np.float64)
+    finite = img[ np.isfinite(img) ]
+    if scale_min is None:
+        scale_min = finite.min() if len(finite) > 0 else 0.0
+    if scale_max is None:
+        scale_max = finite.max() if len(finite) > 0 else 1.0
+    img = np.where( np.isfinite(img), img, scale_min )
+    if non_linear is not None:
+        return sunpy__plot.asinh(img, scale_min=scale_min, scale_max=scale_max, non_linear=non_linear)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.clip( np.nan_to_num( (img - scale_min) / (scale_max - scale_min) ), 0.0, 1.0 )
+
+
+class _pending:
+    """ a render in progress that identical requests can wait for """
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+class lru_cache:
+    """ thread-safe bounded mapping; least recently used entries are dropped first """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock    = threading.Lock()
+        self.hits    = 0
+        self.misses  = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses }
+
+
+class render_server:
+    """ renders synthetic and idealized images for http requests, keeping inputs warm.  By default
+        it renders exactly as build_synthetic_images does.  With use_psf_library=True the
+        gaussian PSF is instead applied by cached FFT at the exact supersampled pixel scale,
+        which differs from add_gaussian_psf's rounded sigma at the 1e-4 level.           """
+    def __init__(self, data_dir, max_open_files=8, max_cached_images=64, max_cached_outputs=256, use_psf_library=False):
+        self.data_dir        = os.path.abspath(data_dir)
+        self.inputs_cache    = lru_cache(max_open_files)        # (file, camera) -> sunrise_inputs
+        self.image_cache     = lru_cache(max_cached_images)     # (file, camera, band, realism) -> band image
+        self.petro_cache     = lru_cache(1024)                  # (file, camera, first band, realism) -> (rp, seed)
+        self.names_cache     = lru_cache(1024)                  # file -> band names
+        self.output_cache    = lru_cache(max_cached_outputs)    # canonical request -> (content type, bytes)
+        self.use_psf_library = use_psf_library
+        self.psf_libraries   = {}
+        self.lock            = threading.Lock()
+        self.in_flight       = {}
+        self.n_coalesced     = 0
+        self.n_renders       = 0
+        self.render_time     = 0.0
+
+    def warm(self, bands=[], redshifts=[0.05]):
+        """ load the background mosaics of bands (indices in the Illustris band order) and the
+            cosmology of redshifts ahead of the first request                             """
+        for band in bands:
+            if len(sunpy__synthetic_image.backgrounds[band]) > 0 and os.path.isfile(sunpy__synthetic_image.backgrounds[band][0]):
+                sunpy__synthetic_image.load_background(band)
+        for redshift in redshifts:
+            sunpy__synthetic_image.get_cosmology(redshift)
+
+    def path(self, filename):
+        path = os.path.normpath( os.path.join(self.data_dir, filename) )
+        if not path.startswith(self.data_dir + os.sep):
+            raise request_error(403, "file outside the data directory: "+filename)
+        if not os.path.isfile(path):
+            raise request_error(404, "file not found: "+filename)
+        return path
+
+    def band_names(self, path):
+        names = self.names_cache.get(path)
+        if names is None:
+            names = [ str(name) for name in sunpy__load.load_broadband_names(path) ]
+            self.names_cache.put(path, names)
+        return names
+
+    def inputs(self, path, camera):
+        key = (path, camera)
+        inputs = self.inputs_cache.get(key)
+        if inputs is None:
+            inputs = sunpy__synthetic_image.sunrise_inputs(path, camera=camera)
+            self.inputs_cache.put(key, inputs)
+        return inputs
+
+    def psf_library(self, fwhm_arcsec, bands):
+        """ a psf_library holding a gaussian of fwhm_arcsec for bands; its FFTs stay cached """
+        with self.lock:
+            if fwhm_arcsec not in self.psf_libraries:
+                library = sunpy__psf.psf_library()
+                library.add_gaussian('gaussian', fwhm_arcsec)
+                self.psf_libraries[fwhm_arcsec] = library
+            library = self.psf_libraries[fwhm_arcsec]
+            for band in bands:
+                if library.kernel_for_band(band) is None:
+                    library.set_band(band, 'gaussian')
+        return library
+
+    def parse(self, query):
+        """ canonical request (a hashable tuple of sorted items) from a parsed query string """
+        request = { 'product': 'synthetic', 'bands': default_bands, 'camera': '0', 'format': 'png' }
+        for name in query:
+            if name not in request and name != 'file' and name not in realism_parameters and name not in stretch_parameters:
+                raise request_error(400, "unknown parameter: "+name)
+            request[name] = query[name][-1]
+        if 'file' not in request:
+            raise request_error(400, "no file given")
+        request['camera'] = parse_value('camera', request['camera'], 'int')
+        if request['format'] not in ['png', 'npy']:
+            raise request_error(400, "unknown format: "+request['format'])
+        if request['product'] != 'synthetic' and request['product'] not in sunpy__plot.image_products:
+            raise request_error(400, "unknown product: "+request['product'])
+        bands = []
+        for band in request['bands'].split(','):
+            bands.append( int(band) if band.isdigit() else band )
+        if len(bands) not in [1, 3]:
+            raise request_error(400, "give one or three bands")
+        if request['product'] == 'synthetic':
+            names = self.band_names( self.path(request['file']) )
+            for band in bands:
+                if (type(band) is int and band >= len(names)) or (type(band) is not int and band not in names):
+                    raise request_error(400, "unknown band: "+str(band))
+        request['bands'] = tuple(bands)
+        for name, kind in realism_parameters.items() + stretch_parameters.items():
+            if name in request:
+                request[name] = parse_value(name, request[name], kind)
+        if request.get('resample_mode') not in [None] + sunpy__synthetic_image.resample_modes:
+            raise request_error(400, "unknown resample_mode: "+request['resample_mode'])
+        if request['product'] == 'synthetic' and request.get('seed') is None:
+            request['seed'] = galaxy_seed(request['file'])
+        return tuple( sorted(request.items()) )
+
+    def render(self, request):
+        """ (content type, bytes) for a canonical request; identical concurrent requests share one render """
+        output = self.output_cache.get(request)
+        if output is not None:
+            return output
+        with self.lock:
+            pending = self.in_flight.get(request)
+            owner = pending is None
+            if owner:
+                pending = _pending()
+                self.in_flight[request] = pending
+            else:
+                self.n_coalesced += 1
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error[0], pending.error[1], pending.error[2]
+            return pending.result
+
+        try:
+            start_time = time.time()
+            pending.result = self._render(dict(request))
+            self.output_cache.put(request, pending.result)
+            with self.lock:
+                self.n_renders   += 1
+                self.render_time += time.time() - start_time
+            return pending.result
+        except:
+            pending.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[request]
+            pending.done.set()
+
+    def band_images(self, path, camera, bands, realism):
+        """ synthetic images of bands (the first sets rp and the seed), from the image cache where possible """
+        realism_key = tuple( sorted(realism.items()) )
+        images = [ self.image_cache.get( (path, camera, band, bands[0], realism_key) ) for band in bands ]
+        if all( [ image is not None for image in images ] ):
+            return images
+
+        kwargs = dict(realism)
+        kwargs['verbose'] = False
+        if self.use_psf_library and kwargs.get('add_psf', True) and kwargs.get('psf_tile_size') is None:
+            kwargs['psf_library'] = self.psf_library(kwargs.get('psf_fwhm_arcsec', 1.0), bands)
+        petro = self.petro_cache.get( (path, camera, bands[0], realism_key) )
+        if petro is not None and kwargs.get('r_petro_kpc') is None:
+            kwargs['r_petro_kpc'], kwargs['seed'], kwargs['fix_seed'] = petro[0], petro[1], True
+
+        results = sunpy__synthetic_image.build_synthetic_images(path, list(bands), camera=camera,
+                                        inputs=self.inputs(path, camera), **kwargs)
+        if petro is None:
+            self.petro_cache.put( (path, camera, bands[0], realism_key), (results[0][1], results[0][2]) )
+        images = [ result[0] for result in results ]
+        for band, image in zip(bands, images):
+            self.image_cache.put( (path, camera, band, bands[0], realism_key), image )
+        return images
+
+    def _render(self, request):
+        path   = self.path(request['file'])
+        camera = request['camera']
+        stretch = dict(default_stretch)
+        stretch.update( dict( [ (name, request[name]) for name in stretch_parameters if name in request ] ) )
+
+        if request['product'] != 'synthetic':
+            options = dict( [ (name, request[name]) for name in ['scale_min', 'scale_max', 'non_linear'] if name in request ] )
+            if request['product'] in sunpy__atlas.unit_range_products:
+                try:
+                    img = sunpy__plot.render_products(path, camera=camera, products=[request['product']],
+                                                      **{ request['product']: options })[request['product']]
+                except TypeError:
+                    raise request_error(400, "unsupported stretch parameter for "+request['product'])
+                data = img
+            else:                       # physical values (ages, metallicities): stretched here for the png
+                data = sunpy__plot.render_products(path, camera=camera, products=[request['product']])[request['product']]
+                img  = display_scaled(data, **options)
+        else:
+            realism = dict( [ (name, request[name]) for name in realism_parameters if name in request ] )
+            images  = self.band_images(path, camera, request['bands'], realism)
+            data    = np.array(images)
+            if len(images) == 3:
+                img = sunpy__plot.lupton_rgb(images[2], images[1], images[0], lupton_alpha=stretch['lupton_alpha'],
+                                             lupton_Q=stretch['lupton_Q'], scale_min=stretch['scale_min'],
+                                             b_fac=stretch['b_fac'], g_fac=stretch['g_fac'], r_fac=stretch['r_fac'],
+                                             min_intensity=1e-6, fill_intensity=1e100)
+            else:
+                img = sunpy__plot.asinh(images[0], scale_min=stretch['scale_min'], scale_max=stretch['scale_max'],
+                                        non_linear=stretch['non_linear'])
+                img[img<0] = 0
+
+        buffer = io.BytesIO()
+        if request['format'] == 'npy':
+            np.save(buffer, data)
+            return 'application/octet-stream', buffer.getvalue()
+        if img.ndim == 2:
+            img = np.dstack( [img, img, img] )
+        sunpy__plot.my_save_image(img, buffer)
+        return 'image/png', buffer.getvalue()
+
+    def stats(self):
+        with self.lock:
+            stats = { 'renders': self.n_renders, 'render_time': self.render_time, 'coalesced': self.n_coalesced,
+                      'in_flight': len(self.in_flight) }
+        for name in ['inputs_cache', 'image_cache', 'petro_cache', 'names_cache', 'output_cache']:
+            stats[name] = getattr(self, name).stats()
+        stats['backgrounds'] = len(sunpy__synthetic_image.background_cache)
+        stats['psf_ffts'] = sum( [ len(library.fft_cache) for library in self.psf_libraries.values() ] )
+        return stats
+
+
+class render_request_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ GET /render and /stats for the render_server in self.server.renderer """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        try:
+            if url.path == '/stats':
+                self.reply(200, 'application/json', json.dumps(self.server.renderer.stats(), indent=1))
+            elif url.path == '/render':
+                renderer = self.server.renderer
+                content_type, body = renderer.render( renderer.parse( urlparse.parse_qs(url.query) ) )
+                self.reply(200, content_type, body)
+            else:
+                self.reply(404, 'text/plain', "unknown path: "+url.path+"\n")
+        except request_error, error:
+            self.reply(error.code, 'text/plain', str(error)+"\n")
+        except (Exception, SystemExit):
+            self.reply(500, 'text/plain', traceback.format_exc())
+
+    def reply(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_render_server(data_dir, port=0, host='127.0.0.1', warm_bands=[], **kwargs):
+    """ serve renders of the files in data_dir on a background thread; returns (server, base_url).
+        The render_server is server.renderer.                                           """
+    server = sunpy__remote.threaded_http_server((host, port), render_request_handler)
+    server.renderer = render_server(data_dir, **kwargs)
+    server.renderer.warm(bands=warm_bands)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://'+host+':'+str(server.server_address[1])+'/'
+
+
+if __name__ == '__main__':    #code to execute if called from command-line
+    if len(sys.argv) < 2:
+        print "usage: python sunpy__server.py data_dir [port]"
+        sys.exit()
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8642
+    server = sunpy__remote.threaded_http_server(('127.0.0.1', port), render_request_handler)
+    server.renderer = render_server(sys.argv[1])
+    server.renderer.warm(bands=default_warm_bands)
+    print "serving renders of "+server.renderer.data_dir+" on http://127.0.0.1:"+str(port)+"/"
+    server.serve_forever()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+""" Memoized stage graph of the synthetic_image pipeline, for parameter sweeps.
+
+Tuning the realism settings means rendering every combination of psf_fwhm_arcsec,
+pixelsize_arcsec, sn_limit, the add_psf/rebin_phys/add_noise/resize_rp flags, etc.  Running
+synthetic_image for each combination repeats every stage.  Here the pipeline is a chain of
+stages (psf -> rebin -> noise -> petro -> resize -> background); the output of each stage is
+cached under a key made of its own parameters plus the key of the stage before it.  A new
+combination therefore recomputes only the stages downstream of the first parameter that
+changed.  The cache holds at most max_cache_entries stage outputs (least recently used are
+dropped first).
+
+Example usage:
+    results = sunpy__sweep.sweep(filename, 'r_SDSS.res',
+                                 { 'psf_fwhm_arcsec': [0.5, 1.0, 1.5], 'sn_limit': [10.0, 25.0] },
+                                 seed=1, rebin_gz=True)
+    for params, result in results:
+        print params['psf_fwhm_arcsec'], params['sn_limit'], result['r_petro_kpc']
+"""
+import numpy as np
+import itertools
+from collections import OrderedDict
+
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+# synthetic_image defaults for every parameter the stages depend on
+default_parameters = { 'add_psf':          True,
+                       'psf_fwhm_arcsec':  1.0,
+                       'psf_tile_size':    None,
+                       'rebin_phys':       True,
+                       'pixelsize_arcsec': 0.24,
+                       'add_noise':        True,
+                       'sn_limit':         25.0,
+                       'sky_sig':          None,
+                       'seed':             None,
+                       'r_petro_kpc':      None,
+                       'resize_rp':        True,
+                       'add_background':   True,
+                       'fix_seed':         True,
+                       'rebin_gz':         False,
+                       'n_target_pixels':  sunpy__synthetic_image.n_pixels_galaxy_zoo }
+
+
+def _run_psf(obj, p):
+    obj.telescope = sunpy__synthetic_image.telescope(p['psf_fwhm_arcsec'], p['pixelsize_arcsec'])
+    obj.add_gaussian_psf(add_psf=p['add_psf'], tile_size=p['psf_tile_size'])
+
+def _run_rebin(obj, p):
+    obj.telescope = sunpy__synthetic_image.telescope(p['psf_fwhm_arcsec'], p['pixelsize_arcsec'])
+    obj.rebin_to_physical_scale(rebin_phys=p['rebin_phys'], tile_size=p['psf_tile_size'])
+
+def _run_noise(obj, p):
+    obj.seed = p['seed']
+    obj.add_noise(add_noise=p['add_noise'], sn_limit=p['sn_limit'], sky_sig=p['sky_sig'])
+
+def _run_petro(obj, p):
+    obj.calc_r_petro(r_petro_kpc=p['r_petro_kpc'], resize_rp=p['resize_rp'])
+
+def _run_resize(obj, p):
+    obj.resize_image_from_rp(resize_rp=p['resize_rp'])
+
+def _run_background(obj, p):
+    obj.bg_failed  = False
+    obj.bg_retries = 0
+    obj.seed = obj.add_background(seed=p['seed'], add_background=p['add_background'], rebin_gz=p['rebin_gz'],
+                                  n_target_pixels=p['n_target_pixels'], fix_seed=p['fix_seed'])
+
+
+# (name, parameters the stage depends on, function, synthetic_image attributes it produces)
+stages = [ ('psf',        ['add_psf', 'psf_fwhm_arcsec', 'psf_tile_size'],
+                          _run_psf,        ['psf_image']),
+           ('rebin',      ['rebin_phys', 'pixelsize_arcsec'],
+                          _run_rebin,      ['rebinned_image']),
+           ('noise',      ['add_noise', 'sn_limit', 'sky_sig', 'seed'],
+                          _run_noise,      ['noisy_image', 'sky_sig']),
+           ('petro',      ['r_petro_kpc', 'resize_rp'],
+                          _run_petro,      ['r_petro_kpc', 'r_petro_pixels']),
+           ('resize',     [],
+                          _run_resize,     ['rp_image']),
+           ('background', ['add_background', 'fix_seed', 'rebin_gz', 'n_target_pixels'],
+                          _run_background, ['bg_image', 'seed', 'bg_failed', 'bg_retries']) ]
+
+image_attributes = [ 'psf_image', 'rebinned_image', 'noisy_image', 'rp_image', 'bg_image' ]
+
+
+class stage_graph:
+    """ memoized synthetic_image pipeline for one galaxy, band and camera """
+    def __init__(self, filename, band, camera=0, redshift=0.05, max_cache_entries=32, inputs=None, verbose=False):
+        self.filename = filename
+        self.band     = band
+        self.camera   = camera
+        self.verbose  = verbose
+        self.max_cache_entries = max_cache_entries
+        self.cache    = OrderedDict()
+        self.hits     = dict( [ (stage[0], 0) for stage in stages ] )
+        self.misses   = dict( [ (stage[0], 0) for stage in stages ] )
+        self.obj      = sunpy__synthetic_image.synthetic_image(filename, band=band, camera=camera, redshift=redshift,
+                                        inputs=inputs, verbose=verbose, run_pipeline=False)
+
+    def _cache_get(self, key):
+        snapshot = self.cache.pop(key)
+        self.cache[key] = snapshot          # most recently used goes to the end
+        return snapshot
+
+    def _cache_put(self, key, snapshot):
+        self.cache[key] = snapshot
+        while len(self.cache) > self.max_cache_entries:
+            self.cache.popitem(last=False)
+
+    def run(self, **parameters):
+        """ run the pipeline for one parameter set (unset ones take the synthetic_image defaults);
+            returns a dict with the final image, r_petro_kpc, seed and bg_failed             """
+        p = dict(default_parameters)
+        for name in parameters:
+            if name not in p:
+                print "[stage_graph] unknown parameter:", name
+                return None
+            p[name] = parameters[name]
+        if p['seed'] is None and p['add_noise'] and self.verbose:
+            print "[stage_graph] seed=None: noise realizations are reused from the cache for equal parameters"
+
+        key = ()
+        for name, stage_parameters, function, attributes in stages:
+            key = ( key, tuple( [ p[par] for par in stage_parameters ] ) )
+            if key in self.cache:
+                self.hits[name] += 1
+                snapshot = self._cache_get(key)
+                for attribute in attributes:
+                    setattr(self.obj, attribute, snapshot[attribute])
+            else:
+                self.misses[name] += 1
+                for attribute in attributes:
+                    if attribute in image_attributes:
+                        setattr(self.obj, attribute, sunpy__synthetic_image.single_image())    # never modify a cached image
+                function(self.obj, p)
+                self._cache_put(key, dict( [ (attribute, getattr(self.obj, attribute)) for attribute in attributes ] ))
+
+        return { 'image':       self.obj.bg_image.return_image(),
+                 'r_petro_kpc': self.obj.r_petro_kpc,
+                 'seed':        self.obj.seed,
+                 'bg_failed':   self.obj.bg_failed }
+
+    def stats(self):
+        return { 'hits': dict(self.hits), 'misses': dict(self.misses), 'cache_entries': len(self.cache) }
+
+
+def sweep_order(names):
+    """ parameter names sorted by the stage that uses them, upstream first """
+    order = {}
+    for index, stage in enumerate(stages):
+        for name in stage[1]:
+            order.setdefault(name, index)
+    return sorted(names, key=lambda name: (order.get(name, len(stages)), name))
+
+
+def sweep(filename, band, grid, camera=0, redshift=0.05, max_cache_entries=32, verbose=False, **fixed):
+    """ run every combination of the parameter values in grid (a dict of name -> list of values),
+        with the remaining parameters set by fixed.  Combinations are visited with upstream
+        parameters varying slowest, so each stage output is reused as often as possible.
+        Returns a list of (parameters, result) pairs (see stage_graph.run).              """
+    graph = stage_graph(filename, band, camera=camera, redshift=redshift,
+                        max_cache_entries=max_cache_entries, verbose=verbose)
+    names = sweep_order(grid.keys())
+    results = []
+    for values in itertools.product( *[ grid[name] for name in names ] ):
+        parameters = dict(fixed)
+        parameters.update( dict( zip(names, values) ) )
+        results.append( (parameters, graph.run(**parameters)) )
+    if verbose:
+        print "stage_graph cache stats:", graph.stats()
+    return results
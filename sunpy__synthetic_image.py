@@ -16,19 +16,22 @@ import numpy as np
 import os
 import sys
 import math
-import astropy.io.fits as fits
 import cosmocalc
-import pyfits
-import scipy as sp
-import scipy.ndimage
-import scipy.signal
-import scipy.interpolate
 
 import sunpy.sunpy__load
+import sunpy.sunpy__profile
+import sunpy.sunpy__photometry
 import time
-import cosmocalc
+import zlib
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
 
-import wget
+import sunpy.sunpy__lazy as sunpy__lazy
+fits   = sunpy__lazy.lazy_import('astropy.io.fits')
+pyfits = sunpy__lazy.lazy_import('pyfits')
+sp     = sunpy__lazy.lazy_import('scipy', submodules=['scipy.ndimage', 'scipy.interpolate'])
+scipy  = sp
 
 __author__ = "Paul Torrey and Greg Snyder"
 __copyright__ = "Copyright 2014, The Authors"
@@ -50,6 +53,7 @@ speedoflight_m  = 2.99e8
 m2_to_cm2       = 1.0e-4
 n_arcsec_per_str = 4.255e10             # (radian per arc second)^2
 n_pixels_galaxy_zoo = 424 
+scratch_dir     = None			# where tiled psf convolution keeps its memory-mapped scratch files
 
 
 ###########################################################
@@ -103,12 +107,227 @@ bg_zpt = [ [], [],                 # GALEX
                 [], [], [], [], [], [], [], []          # NIRCAM
                 ]
 
+resample_modes = ['legacy', 'composed']		# see synthetic_image.composed_resample
+
+
+def random_stream(seed, *labels):
+    """ independent random stream for a seed and labels such as (name, galaxy, band, camera).
+        Streams never share state, so results do not depend on how work is split over threads
+        or processes.  With seed=None the stream is seeded from fresh entropy.            """
+    if seed is None:
+        return np.random.RandomState()
+    key = [ int(seed) % 2**32 ]
+    for label in labels:
+        if isinstance(label, basestring):
+            if isinstance(label, unicode):
+                label = label.encode('utf-8')
+            key.append( zlib.crc32(label) & 0xffffffff )
+        else:
+            key.append( int(label) % 2**32 )
+    return np.random.RandomState(key)
+
 
 def build_synthetic_image(filename, band, r_petro_kpc=None, **kwargs):
     """ build a synthetic image from a SUNRISE fits file and return the image to the user """
     obj     	 = synthetic_image(filename, band=band, r_petro_kpc=r_petro_kpc, **kwargs)
     return obj.bg_image.return_image(), obj.r_petro_kpc, obj.seed, obj.bg_failed
 
+def build_synthetic_images(filename, bands, r_petro_kpc=None, seed=None, fix_seed=True, camera=0, n_threads=1, inputs=None, **kwargs):
+    """ build synthetic images for several bands of one galaxy, returning a list of
+        build_synthetic_image results (one per band).
+
+        The first band sets the Petrosian radius and background seed used by the others (as in
+        sunpy__plot).  With n_threads > 1 the remaining bands are rendered concurrently on a
+        thread pool; all bands share one copy of the input cube.                        """
+    if inputs is None:
+        inputs = sunrise_inputs(filename, camera=camera)
+
+    results = [ build_synthetic_image(filename, bands[0], r_petro_kpc=r_petro_kpc, seed=seed, fix_seed=fix_seed,
+                                      camera=camera, inputs=inputs, **kwargs) ]
+    rp, the_used_seed = results[0][1], results[0][2]
+
+    def build_band(band):
+        return build_synthetic_image(filename, band, r_petro_kpc=rp, seed=the_used_seed, fix_seed=True,
+                                     camera=camera, inputs=inputs, **kwargs)
+
+    if n_threads > 1 and len(bands) > 2:
+        pool = ThreadPool( min(n_threads, len(bands) - 1) )
+        results += pool.map(build_band, bands[1:])
+        pool.close()
+        pool.join()
+    else:
+        results += map(build_band, bands[1:])
+    return results
+
+
+
+background_cache = {}
+background_lock  = threading.Lock()
+
+def load_background(band):
+    """ (image, pixel size in arcsec) of the background mosaic for a band; each mosaic is read
+        once per process and then served from background_cache                          """
+    bg_filename = (backgrounds[band])[0]
+    with background_lock:
+        if bg_filename not in background_cache:
+            file = pyfits.open(bg_filename)
+            background_cache[bg_filename] = ( np.array(file[0].data), get_pixelsize_arcsec(file[0].header) )
+            file.close()
+        return background_cache[bg_filename]
+
+
+def background_stamp(im, pixsize, band, starti, startj, Npix_get):
+    """ Npix_get x Npix_get cutout of a background mosaic starting at (starti, startj), in microJy / str """
+    bg_image_raw = im[starti:starti+Npix_get,startj:startj+Npix_get]
+    bg_image_muJy = bg_image_raw * 10.0**(-0.4*(bg_zpt[band][0]- 23.9 ))
+    pixel_area_in_str       = pixsize**2 / n_arcsec_per_str
+    return bg_image_muJy / pixel_area_in_str 
+
+
+def rp_window_coords(n_old, Ntotal_new, n_out=n_pixels_galaxy_zoo):
+    """ source coordinates of the n_out pixel window that resize_image_from_rp cuts (or pads) from
+        congrid(image, (Ntotal_new, Ntotal_new)); padded pixels get coordinate -1 (i.e. zero)  """
+    diff  = n_out - Ntotal_new
+    index = np.arange(n_out)
+    if diff >= 0:
+        index = index - int(np.floor(1.0*diff/2.0))
+    else:
+        index = index + int(np.floor(-1.0*diff/2.0))
+    valid  = (index >= 0) & (index < Ntotal_new)
+    coords = -np.ones(n_out)
+    coords[valid] = congrid_coords(n_old, Ntotal_new)[index[valid]]
+    return coords
+
+
+def resample_weights(coords, n_old):
+    """ linear interpolation taps (lo, hi, weight, in-bounds) for resampling an axis of length n_old at coords """
+    return _linear_weights(np.asarray(coords, dtype=float), n_old)
+
+
+def resample_stack(stack, row_weights, col_weights=None):
+    """ resample every image of a (K x n x n) stack at the same coordinates (see resample_weights),
+        columns first and then rows with the congrid arithmetic; None leaves an axis unchanged """
+    if col_weights is None:
+        col_weights = row_weights
+    if col_weights is not None:
+        lo, hi, w, valid = col_weights
+        y_lo  = stack[:, :, lo]
+        stack = (stack[:, :, hi] - y_lo) * w + y_lo
+        stack[:, :, ~valid] = 0.0
+    if row_weights is not None:
+        lo, hi, w, valid = row_weights
+        y_lo  = stack[:, lo, :]
+        stack = (stack[:, hi, :] - y_lo) * w[:,None] + y_lo
+        stack[:, ~valid, :] = 0.0
+    return stack
+
+
+def build_synthetic_ensemble(filename, band, n_realizations, r_petro_kpc=None, seed=None, fix_seed=True,
+			add_noise=True, add_background=True, resize_rp=True, rebin_gz=False,
+			n_target_pixels=n_pixels_galaxy_zoo, chunk_size=16, out=None, **kwargs):
+    """ n_realizations noise + background realizations of one galaxy in one band.  Returns
+        (images, rp, bg_failed) with images an (n_realizations x N x N) array (or out).
+
+        The load, psf, rebinning and Petrosian radius are computed once -- rp is measured on
+        the first noise draw, as in a single synthetic_image run -- and then the noise fields
+        and background stamp positions of chunk_size realizations at a time are drawn in one
+        go.  Stamps are cut from the cached background mosaic.  Noise streams depend on the
+        band, stamp positions do not, so realization k lines up across bands.  Results do
+        not depend on chunk_size.  Always runs the legacy resample chain, since the
+        realizations are drawn on the rebinned image (resample_mode is ignored).          """
+    kwargs.pop('resample_mode', None)
+    base = synthetic_image(filename, band=band, r_petro_kpc=r_petro_kpc, seed=seed, add_noise=add_noise,
+			add_background=False, resize_rp=resize_rp, rebin_gz=False, resample_mode='legacy', **kwargs)
+    image = base.rebinned_image
+    n_old = image.n_pixels
+    n     = base.rp_image.n_pixels
+
+    if resize_rp:
+        Ntotal_new = int( (image.pixel_in_kpc / (0.008 * base.r_petro_kpc) ) * n_old )
+        rp_weights = resample_weights( rp_window_coords(n_old, Ntotal_new, n), n_old )
+        rp_base    = resample_stack(image.image[None,:,:], rp_weights)
+    else:
+        rp_weights = None
+        rp_base    = image.image[None,:,:]
+
+    use_background = add_background and (len(backgrounds[base.band]) > 0)
+    if use_background:
+        im, pixsize = load_background(base.band)
+        Npix_get  = min( int(np.floor(n * base.rp_image.pixel_in_arcsec / pixsize)), n )
+        halfval_i = int(np.floor(np.float(im.shape[0])/1.3))
+        halfval_j = int(np.floor(np.float(im.shape[1])/1.3))
+        bg_weights = resample_weights( congrid_coords(Npix_get, n), Npix_get )
+
+    if rebin_gz:
+        gz_weights = resample_weights( congrid_coords(n, n_target_pixels), n )
+        n_final   = n_target_pixels
+    else:
+        n_final   = n
+    if out is None:
+        out = np.empty( (n_realizations, n_final, n_final) )
+    bg_failed = np.zeros(n_realizations, dtype=bool)
+
+    noise_stream = random_stream(seed, 'ensemble_noise', os.path.basename(filename), base.band, base.camera)
+    for first in range(0, n_realizations, chunk_size):
+        k = min(chunk_size, n_realizations - first)
+        if add_noise:
+            noise    = base.sky_sig * noise_stream.standard_normal( (k, n_old, n_old) )
+            rp_stack = rp_base + resample_stack(noise, rp_weights)
+            del noise
+        else:
+            rp_stack = np.repeat(rp_base, k, axis=0)
+
+        if use_background:
+            tot_img  = rp_stack.sum(axis=(1,2))
+            bg_stack = np.empty( (k, n, n) )
+            redraw   = np.ones(k, dtype=bool)
+            bg_streams = [ random_stream(seed, 'ensemble_background', os.path.basename(filename), base.camera, first + index)
+                           for index in range(k) ]		# one per realization, so chunking does not change the stamps
+            while np.any(redraw):
+                todo   = np.nonzero(redraw)[0]
+                starts = [ (bg_streams[index].random_integers(5, halfval_i), bg_streams[index].random_integers(5, halfval_j))
+                           for index in todo ]
+                stamps = np.array( [ background_stamp(im, pixsize, base.band, i, j, Npix_get) for i, j in starts ] )
+                bg_stack[todo] = resample_stack(stamps, bg_weights)
+                if fix_seed:
+                    redraw[:] = False
+                else:
+                    redraw[todo] = bg_stack[todo].sum(axis=(1,2)) > tot_img[todo]
+
+            floor    = rp_stack.min(axis=(1,2))
+            rp_mean  = rp_stack.mean(axis=(1,2))
+            rp_stack = np.maximum(bg_stack + rp_stack, floor[:,None,None])
+            bg_failed[first:first+k] = rp_stack.mean(axis=(1,2)) > 5 * rp_mean
+            del bg_stack
+
+        if rebin_gz:
+            rp_stack = resample_stack(rp_stack, gz_weights)
+        out[first:first+k] = rp_stack
+        del rp_stack
+
+    return out, base.r_petro_kpc, bg_failed
+
+
+class sunrise_inputs:
+    """ the parts of a SUNRISE file needed by synthetic_image, loaded once and shared (read-only)
+        between the synthetic_image instances of several bands                          """
+    def __init__(self, filename, camera=0):
+        if (not os.path.exists(filename)):
+            print "file not found:", filename
+            sys.exit()
+
+        self.filename   = filename
+        self.camera     = camera
+        self.band_names = sunpy.sunpy__load.load_broadband_names(filename)
+        hdulist = fits.open(filename)
+        self.image_header     = hdulist['CAMERA'+str(camera)+'-BROADBAND-NONSCATTER'].header
+        self.broadband_header = hdulist['BROADBAND'].header
+        self.param_header     = hdulist['CAMERA'+str(camera)+'-PARAMETERS'].header
+        self.int_quant_data   = hdulist['INTEGRATED_QUANTITIES'].data
+        self.filter_data      = hdulist['FILTERS'].data
+        hdulist.close()
+        self.all_images = sunpy.sunpy__load.load_all_broadband_images(filename,camera=camera)
+
 def load_resolved_broadband_apparent_magnitudes(filename, redshift, camera=0, seed=12345, n_bands=36, **kwargs):
     """ loads n_band x n_pix x n_pix image array with apparent mags for synthetic images """
     mags   = sunpy.sunpy__load.load_all_broadband_photometry(filename, camera=0)
@@ -160,32 +379,52 @@ class synthetic_image:
 			sky_sig=None,
 			verbose=True,
 			fix_seed=True,
+			profiler=None,
+			inputs=None,
+			writer=None,
+			psf_tile_size=None,
+			run_pipeline=True,
+			resample_mode='legacy',
+			psf_library=None,
+			fits_compression=None,
+			fits_quantize=16.0,
 			**kwargs):
 
         if (not os.path.exists(filename)):
             print "file not found:", filename
             sys.exit()
+	if resample_mode not in resample_modes:
+	    print "unknown resample_mode:", resample_mode, "(use one of "+", ".join(resample_modes)+")"
+	    sys.exit()
 
 	start_time = time.time()
+	if profiler is None:
+	    self.profiler = sunpy.sunpy__profile.new_run(filename=filename, band=band, camera=camera)
+	else:
+	    self.profiler = profiler
+	self.profiler.start_stage('load')
+
 	self.filename  = filename
-	self.cosmology = cosmology(redshift)
+	self.camera    = camera
+	self.seed      = seed
+	self.cosmology = get_cosmology(redshift)
 	self.telescope = telescope(psf_fwhm_arcsec, pixelsize_arcsec)
 
-        band_names  = sunpy.sunpy__load.load_broadband_names(filename)
-        hdulist = fits.open(filename)
+	if inputs is None:
+	    inputs = sunrise_inputs(filename, camera=camera)
+        band_names  = inputs.band_names
 	
         if type(band) is not int:
             band = (((band_names == band).nonzero())[0])[0]
 
 	self.band	      = band
         self.band_name        = band_names[band]
-        self.image_header     = hdulist['CAMERA'+str(camera)+'-BROADBAND-NONSCATTER'].header
-        self.broadband_header = hdulist['BROADBAND'].header
-        self.param_header     = hdulist['CAMERA'+str(camera)+'-PARAMETERS'].header
-        self.int_quant_data   = hdulist['INTEGRATED_QUANTITIES'].data
-        self.filter_data      = hdulist['FILTERS'].data
+        self.image_header     = inputs.image_header
+        self.broadband_header = inputs.broadband_header
+        self.param_header     = inputs.param_header
+        self.int_quant_data   = inputs.int_quant_data
+        self.filter_data      = inputs.filter_data
         self.lambda_eff       = (self.filter_data['lambda_eff'])[band]
-        hdulist.close()
 #============= DECLARE ALL IMAGES HERE =================#
 	self.sunrise_image  = single_image()		# orig sunrise image
 	self.psf_image      = single_image()		# supersampled image + psf convolution 
@@ -195,7 +434,7 @@ class synthetic_image:
 	self.rp_image       = single_image()		# scale image based on rp radius criteria (for GZ)
 	self.bg_image	    = single_image()		# add backgrounds (only possible for 5 SDSS bands at the moment)
 #============ SET ORIGINAL IMAGE ======================#
-	all_images  = sunpy.sunpy__load.load_all_broadband_images(filename,camera=camera)
+	all_images  = inputs.all_images
 
         to_nu                     = ((self.lambda_eff**2 ) / (speedoflight_m)) #* pixel_area_in_str
         to_microjanskies          = (1.0e6) * to_nu * (1.0e26)                 # 1 muJy/str (1Jy = 1e-26 W/m^2/Hz)
@@ -209,16 +448,46 @@ class synthetic_image:
 
 	self.sunrise_image.init_image(this_image, self, comoving_to_phys_fov=False)
 	# assume now that all images are in micro-Janskies per str
+	self.profiler.end_stage(self.sunrise_image.image)
+
+	if not run_pipeline:		# only load; the caller drives the stages (see sunpy__sweep)
+	    if profiler is None:
+	        self.profiler.finish()
+	    return
+
+	self.profiler.start_stage('add_gaussian_psf')
+	self.add_gaussian_psf(add_psf=add_psf, tile_size=psf_tile_size, psf_library=psf_library)
+	self.profiler.end_stage(self.psf_image.image)
+	fold_gz = rebin_gz and resize_rp and not (add_background and (len(backgrounds[self.band]) > 0))
+	if fold_gz:
+	    n_final = n_target_pixels
+	else:
+	    n_final = n_pixels_galaxy_zoo
 
-	self.add_gaussian_psf(add_psf=add_psf)
-	self.rebin_to_physical_scale(rebin_phys=rebin_phys)
-	self.add_noise(add_noise=add_noise, sn_limit=sn_limit, sky_sig=sky_sig)
-	self.calc_r_petro(r_petro_kpc=r_petro_kpc, resize_rp=resize_rp)
-	self.resize_image_from_rp(resize_rp=resize_rp)
+	if resample_mode == 'composed' and self.composable(rebin_phys, resize_rp, r_petro_kpc, add_noise, n_final):
+	    self.profiler.start_stage('composed_resample')
+	    self.composed_resample(r_petro_kpc, n_final, add_noise=add_noise, sn_limit=sn_limit, sky_sig=sky_sig)
+	    self.profiler.end_stage(self.rp_image.image)
+	else:
+	    self.profiler.start_stage('rebin_to_physical_scale')
+	    self.rebin_to_physical_scale(rebin_phys=rebin_phys, tile_size=psf_tile_size)
+	    self.profiler.end_stage(self.rebinned_image.image)
+	    self.profiler.start_stage('add_noise')
+	    self.add_noise(add_noise=add_noise, sn_limit=sn_limit, sky_sig=sky_sig)
+	    self.profiler.end_stage(self.noisy_image.image)
+	    self.profiler.start_stage('calc_r_petro')
+	    self.calc_r_petro(r_petro_kpc=r_petro_kpc, resize_rp=resize_rp)
+	    self.profiler.end_stage()
+	    self.profiler.start_stage('resize_image_from_rp')
+	    self.resize_image_from_rp(resize_rp=resize_rp, n_target_pixels=(n_target_pixels if fold_gz else None))
+	    self.profiler.end_stage(self.rp_image.image)
 
-	self.seed = seed
         self.bg_failed= False
-	self.seed = self.add_background(seed=self.seed, add_background=add_background, rebin_gz=rebin_gz, n_target_pixels=n_target_pixels, fix_seed=fix_seed)
+	self.bg_retries = 0
+	self.profiler.start_stage('add_background')
+	self.seed = self.add_background(seed=self.seed, add_background=add_background, rebin_gz=(rebin_gz and not fold_gz), n_target_pixels=n_target_pixels, fix_seed=fix_seed)
+	self.profiler.end_stage(self.bg_image.image)
+	self.profiler.count('background_retries', self.bg_retries)
 
 	end_time   = time.time()
         if verbose:
@@ -230,10 +499,20 @@ class synthetic_image:
 	if save_fits:
 	    orig_dir=filename[:filename.index('broadband')]
 	    outputfitsfile = orig_dir+'synthetic_image_'+filename[filename.index('broadband_')+10:filename.index('.fits')]+'_band_'+str(self.band)+'_camera_'+str(camera)+'_'+str(int(self.seed))+'.fits'
-	    self.save_bgimage_fits(outputfitsfile)
+	    self.profiler.start_stage('save')
+	    self.save_bgimage_fits(outputfitsfile, writer=writer, compression=fits_compression, quantize=fits_quantize, verbose=verbose)
+	    self.profiler.end_stage()
 
+	if profiler is None:
+	    self.profiler.finish()
 
-    def add_gaussian_psf(self, add_psf=True, sample_factor=1.0):		# operates on sunrise_image -> creates psf_image
+
+    def add_gaussian_psf(self, add_psf=True, sample_factor=1.0, tile_size=None, psf_library=None):		# operates on sunrise_image -> creates psf_image
+	""" convolve with the telescope psf.  With tile_size set, the supersampled image and its
+	    convolution are kept in scratch memory-mapped files and processed in tiles (with halos),
+	    so the 2500 pixel cap is not needed and peak memory is set by tile_size.  If a
+	    sunpy__psf.psf_library has a kernel for this band, that kernel is used (by FFT) in
+	    place of the gaussian; the supersampling is still set by psf_fwhm_arcsec  """
 	if add_psf:
 	    current_psf_sigma_pixels = self.telescope.psf_fwhm_arcsec * (1.0/2.355) / self.sunrise_image.pixel_in_arcsec
 
@@ -241,31 +520,55 @@ class synthetic_image:
 	        target_psf_sigma_pixels  = 8.0
 	        n_pixel_new = np.floor(self.sunrise_image.n_pixels * target_psf_sigma_pixels / current_psf_sigma_pixels )
 
-	        if n_pixel_new > 2500:		# an upper limit owing to memory constraints...  
+	        if n_pixel_new > 2500 and tile_size is None:	# an upper limit owing to memory constraints...  
 						# beyond this, the PSF is already very small...
 		    n_pixel_new = 2500
 		    target_psf_sigma_pixels = n_pixel_new * current_psf_sigma_pixels / self.sunrise_image.n_pixels
 
-	        new_image = congrid(self.sunrise_image.image,  (n_pixel_new, n_pixel_new) )
+		if tile_size is None:
+	            new_image = congrid(self.sunrise_image.image,  (n_pixel_new, n_pixel_new) )
+		else:
+		    new_image = congrid_tiled(self.sunrise_image.image,  (n_pixel_new, n_pixel_new), tile_size,
+						out=scratch_array( (int(n_pixel_new), int(n_pixel_new)) ) )
 	        current_psf_sigma_pixels = target_psf_sigma_pixels * (
 			(self.sunrise_image.n_pixels * target_psf_sigma_pixels 
 				/ current_psf_sigma_pixels) / n_pixel_new )
 	    else:
 	        new_image = self.sunrise_image.image
 
-	    psf_image = np.zeros_like( new_image ) * 1.0
-	    dummy = sp.ndimage.filters.gaussian_filter(new_image, 
+	    kernel_name = None
+	    if psf_library is not None:
+		kernel_name = psf_library.kernel_for_band(self.band, self.band_name)
+
+	    if kernel_name is not None:
+		pixel_arcsec = self.sunrise_image.pixel_in_arcsec * self.sunrise_image.n_pixels / new_image.shape[0]
+		if tile_size is None:
+		    psf_image = psf_library.convolve(new_image, kernel_name, pixel_arcsec)
+		else:
+		    psf_image = psf_library.convolve_tiled(new_image, kernel_name, pixel_arcsec, tile_size,
+						out=scratch_array(new_image.shape))
+		    del new_image
+	    elif tile_size is None:
+	        psf_image = np.zeros_like( new_image ) * 1.0
+	        dummy = sp.ndimage.filters.gaussian_filter(new_image, 
 			current_psf_sigma_pixels, output=psf_image, mode='constant')
+	    else:
+		psf_image = tiled_gaussian_filter(new_image, current_psf_sigma_pixels, tile_size,
+						out=scratch_array(new_image.shape))
+		del new_image
 
 	    self.psf_image.init_image(psf_image, self) 
 	else:
 	    self.psf_image.init_image(self.sunrise_image.image, self)
 
 
-    def rebin_to_physical_scale(self, rebin_phys=True):
+    def rebin_to_physical_scale(self, rebin_phys=True, tile_size=None):
 	if rebin_phys:
 	    n_pixel_new = np.floor( ( self.psf_image.pixel_in_arcsec / self.telescope.pixelsize_arcsec )  * self.psf_image.n_pixels )
-	    rebinned_image = congrid(self.psf_image.image,  (n_pixel_new, n_pixel_new) )
+	    if tile_size is None:
+	        rebinned_image = congrid(self.psf_image.image,  (n_pixel_new, n_pixel_new) )
+	    else:
+		rebinned_image = congrid_tiled(self.psf_image.image,  (n_pixel_new, n_pixel_new), tile_size)
   	    self.rebinned_image.init_image(rebinned_image, self) 
 	else:
 	    self.rebinned_image.init_image(self.psf_image.image, self)
@@ -277,34 +580,23 @@ class synthetic_image:
 	        area 		= 1.0 * self.rebinned_image.n_pixels * self.rebinned_image.n_pixels
 	        sky_sig 	= np.sqrt( (total_flux / sn_limit)**2 / (area**2 ) )
 
-	    noise_image 	=  sky_sig * np.random.randn( self.rebinned_image.n_pixels, self.rebinned_image.n_pixels ) 
+	    random_state = random_stream(self.seed, 'noise', os.path.basename(self.filename), self.band, self.camera)
+	    noise_image 	=  sky_sig * random_state.randn( self.rebinned_image.n_pixels, self.rebinned_image.n_pixels ) 
 	    new_image = self.rebinned_image.image + noise_image
 	    self.noisy_image.init_image(new_image, self)
 	else:
+	    sky_sig = 0.0
 	    self.noisy_image.init_image(self.rebinned_image.image, self)
+	self.sky_sig = sky_sig
 
 
     def calc_r_petro(self, r_petro_kpc=None, resize_rp=True):		# rename to "set_r_petro"
         if ( resize_rp==False):
 	    r_petro_kpc = 1.0;
 	elif ( r_petro_kpc==None ):
-            i=0
-	
-	    image_to_use 	= self.noisy_image.image		#_in_nmaggies
-	    RadiusObject 	= RadialInfo(self.noisy_image.n_pixels)
-            PetroRatio 		= np.ones_like(RadiusObject.RadiusGrid)
-            sumI_r 		= np.zeros_like(RadiusObject.RadiusGrid)
-
-            for radius in RadiusObject.RadiusGrid:
-                pflux_annulus 	= image_to_use[ RadiusObject.annulus_indices[i]]
-                pflux_interior 	= image_to_use[RadiusObject.interior_indices[i]]
-                sumI_r[i] 	= (np.sum(pflux_interior))
-                if RadiusObject.annulus_sums[i]*RadiusObject.interior_sums[i] != 0.0:
-                    PetroRatio[i] = (np.sum(pflux_annulus)/RadiusObject.annulus_sums[i])/(np.sum(pflux_interior)/RadiusObject.interior_sums[i])
-                i=i+1
-
-            Pind = np.argmin( np.absolute( np.flipud(PetroRatio) - 0.2) )
-            PetroRadius = np.flipud(RadiusObject.RadiusGrid)[Pind]
+	    # ratio of annulus to interior surface brightness on the RadialInfo radius grid, from
+	    # one cumulative sum of the image in radius order (see sunpy__photometry)
+	    PetroRadius = sunpy.sunpy__photometry.petrosian_radius(self.noisy_image.image, petro_ratio=0.2)
 	    r_petro_kpc = PetroRadius * self.noisy_image.pixel_in_kpc
 	else:
 	    r_petro_kpc = r_petro_kpc
@@ -316,25 +608,80 @@ class synthetic_image:
 	self.r_petro_kpc    = r_petro_kpc
 
 
-    def resize_image_from_rp(self, resize_rp=True):
+    def rebinned_geometry(self):
+	""" (n_pixels, pixel_in_kpc) that rebin_to_physical_scale gives, without computing the image """
+	n_pixels = int( np.floor( ( self.psf_image.pixel_in_arcsec / self.telescope.pixelsize_arcsec )  * self.psf_image.n_pixels ) )
+	return n_pixels, self.param_header.get('linear_fov') / n_pixels
+
+
+    def composable(self, rebin_phys, resize_rp, r_petro_kpc, add_noise, n_final):
+	""" whether the rebin -> noise -> resize (-> rebin_gz) chain can be done as one resample: the
+	    Petrosian radius must be known up front, and noise can only be drawn at the final scale
+	    if the final pixels are no smaller than the telescope pixels  """
+	if not (rebin_phys and resize_rp) or r_petro_kpc is None:
+	    return False
+	final_pixel_in_kpc = n_pixels_galaxy_zoo * 0.008 * r_petro_kpc / n_final
+	return (not add_noise) or final_pixel_in_kpc >= self.rebinned_geometry()[1]
+
+
+    def composed_resample(self, r_petro_kpc, n_final=n_pixels_galaxy_zoo, add_noise=True, sn_limit=25.0, sky_sig=None):
+	""" rebin_to_physical_scale, add_noise, resize_image_from_rp and (n_final != 424) rebin_gz in
+	    one pass: the coordinate maps of the three resamples are composed and the psf image is
+	    interpolated once.  Noise is drawn at the final pixel scale with the per-pixel sigma the
+	    legacy chain gives (sky_sig times the root sum of squared resample weights of each
+	    axis), and only inside the window; the zero padding stays zero.  Not bit-identical to
+	    the legacy chain (which interpolates three times, and whose noise is correlated between
+	    neighbouring pixels), but much cheaper.  """
+	n_psf = self.psf_image.n_pixels
+	n_rebinned, rebinned_pixel_in_kpc = self.rebinned_geometry()
+	Ntotal_new = int( (rebinned_pixel_in_kpc / (0.008 * r_petro_kpc) ) * n_rebinned )
+
+	# final pixel -> 424 window pixel -> Ntotal_new grid -> rebinned grid -> psf grid
+	index = congrid_coords(n_pixels_galaxy_zoo, n_final)
+	diff  = n_pixels_galaxy_zoo - Ntotal_new
+	if diff >= 0:
+	    index = index - int(np.floor(1.0*diff/2.0))
+	else:
+	    index = index + int(np.floor(-1.0*diff/2.0))
+	coords = (1.0 * n_rebinned / Ntotal_new) * index
+	valid  = (index >= 0) & (index <= Ntotal_new - 1) & (coords <= n_rebinned - 1)
+	coords = np.where(valid, (1.0 * n_psf / n_rebinned) * coords, -1.0)
+	new_image = resample_separable(self.psf_image.image, coords, coords)
+
+	if add_noise:
+	    if sky_sig==None:		# mean of the rebinned image / sn_limit, as add_noise
+	        rebin_sums = resample_matrix(congrid_coords(n_psf, n_rebinned), n_psf).sum(axis=0) / n_rebinned
+	        sky_sig = np.dot( rebin_sums, np.dot(self.psf_image.image, rebin_sums) ) / sn_limit
+	    noise_weights = resample_matrix(rp_window_coords(n_rebinned, Ntotal_new, n_pixels_galaxy_zoo), n_rebinned)
+	    if n_final != n_pixels_galaxy_zoo:
+	        noise_weights = np.dot( resample_matrix(congrid_coords(n_pixels_galaxy_zoo, n_final), n_pixels_galaxy_zoo), noise_weights )
+	    noise_scale = np.sqrt( np.sum(noise_weights**2, axis=1) ) * valid
+	    random_state = random_stream(self.seed, 'noise', os.path.basename(self.filename), self.band, self.camera)
+	    new_image = new_image + sky_sig * noise_scale[:,None] * noise_scale[None,:] * random_state.randn(n_final, n_final)
+	else:
+	    sky_sig = 0.0
+	self.sky_sig = sky_sig		# sigma at the telescope pixel scale, as in add_noise
+
+	self.r_petro_kpc    = r_petro_kpc
+	self.r_petro_pixels = r_petro_kpc / rebinned_pixel_in_kpc
+	self.rp_image.init_image(new_image, self, fov = 424.0*(0.008 * r_petro_kpc) )
+
+
+    def resize_image_from_rp(self, resize_rp=True, n_target_pixels=None):
+	""" cut the n_pixels_galaxy_zoo window, scaled to 0.008 r_petro per pixel, straight from the
+	    noisy image.  With n_target_pixels set the rebin_gz resample is folded into the same
+	    pass (only used when no background is added in between)  """
 	if resize_rp:
 	    rp_pixel_in_kpc = 0.008 * self.r_petro_kpc	# The target scale; was 0.008, upping to 0.016 for GZ based on feedback
 	    Ntotal_new = int( (self.noisy_image.pixel_in_kpc / rp_pixel_in_kpc ) * self.noisy_image.n_pixels )
-	    rebinned_image = congrid(self.noisy_image.image            ,  (Ntotal_new, Ntotal_new) )
-
-	    diff = n_pixels_galaxy_zoo - Ntotal_new		#
-            if diff >= 0:
-                shift = int(np.floor(1.0*diff/2.0))
-		lp = shift
-		up = shift + Ntotal_new
-	        tmp_image = np.zeros( (n_pixels_galaxy_zoo, n_pixels_galaxy_zoo) )
-                tmp_image[lp:up,lp:up] = rebinned_image[0:Ntotal_new, 0:Ntotal_new]
-                rp_image = tmp_image
-            else:
-                shift = int( np.floor(-1.0*diff/2.0) )
-                lp = int(shift)
-		up = int(shift+n_pixels_galaxy_zoo)
-                rp_image = rebinned_image[lp:up, lp:up]	
+
+	    # same result as congrid-ing to Ntotal_new x Ntotal_new and then cropping / zero padding
+	    # to the central n_pixels_galaxy_zoo pixels, but only the window is computed
+	    coords = rp_window_coords(self.noisy_image.n_pixels, Ntotal_new, n_pixels_galaxy_zoo)
+	    if n_target_pixels is None:
+	        rp_image = resample_separable(self.noisy_image.image, coords, coords)
+	    else:
+	        rp_image = resample_composed(self.noisy_image.image, coords, congrid_coords(n_pixels_galaxy_zoo, n_target_pixels))
 
 	    self.rp_image.init_image(rp_image, self, fov = 424.0*(0.008 * self.r_petro_kpc) )
 	else:
@@ -364,32 +711,25 @@ class synthetic_image:
 			print "     http://illustris.rc.fas.harvard.edu/data/illustris_images_aux/backgrounds/SDSS_backgrounds/J113959.99+300000.0-z.fits "
 			print "  "
 			print "  Contact Paul Torrey (ptorrey@mit.edu) or Greg Snyder (gsnyder@stsci.edu) with further questions "
-                    file = pyfits.open(bg_filename) ; 
-                    header = file[0].header ; 
-                    pixsize = get_pixelsize_arcsec(header) ; 
-                    Nx = header.get('NAXIS2') ; Ny = header.get('NAXIS1')
+                    im, pixsize = load_background(self.band)
+                    Nx, Ny = im.shape
 	
 	        #=== figure out how much of the image to extract ===#
-                    Npix_get = np.floor(self.rp_image.n_pixels * self.rp_image.pixel_in_arcsec / pixsize)
+                    Npix_get = int(np.floor(self.rp_image.n_pixels * self.rp_image.pixel_in_arcsec / pixsize))
 
 	            if (Npix_get > self.rp_image.n_pixels):	# P. Torrey 9/10/14   -- sub optimal, but avoids strange noise ...
 	                Npix_get = self.rp_image.n_pixels	#		... in the images.  Could cause problems for automated analysis.
   
-    	            im = file[0].data 	# this is in some native units
-                    halfval_i = np.floor(np.float(Nx)/1.3)
-	            halfval_j = np.floor(np.float(Ny)/1.3)
+                    halfval_i = int(np.floor(np.float(Nx)/1.3))
+	            halfval_j = int(np.floor(np.float(Ny)/1.3))
 		    print seed
-	            np.random.seed(seed=int(seed))
-
-                    starti = np.random.random_integers(5,halfval_i)
-                    startj = np.random.random_integers(5,halfval_j)
+	            random_state = np.random.RandomState(seed=int(seed))	# same stream for every band, so the cutouts line up
 
-                    bg_image_raw = im[starti:starti+Npix_get,startj:startj+Npix_get]
+                    starti = random_state.random_integers(5,halfval_i)
+                    startj = random_state.random_integers(5,halfval_j)
 
-	            #=== need to convert to microJy / str ===#
-	            bg_image_muJy = bg_image_raw * 10.0**(-0.4*(bg_zpt[self.band][0]- 23.9 ))
-	            pixel_area_in_str       = pixsize**2 / n_arcsec_per_str
-	            bg_image = bg_image_muJy / pixel_area_in_str 
+	            #=== cut out and convert to microJy / str ===#
+	            bg_image = background_stamp(im, pixsize, self.band, starti, startj, Npix_get)
 
 	            #=== need to rebin bg_image  ===#
                     bg_image = congrid(bg_image, (self.rp_image.n_pixels, self.rp_image.n_pixels)) 
@@ -404,6 +744,7 @@ class synthetic_image:
 		        #print np.max(bg_image), np.max(self.rp_image.image), np.max(bg_image)/ np.max(self.rp_image.image)
 			if(tot_bg > tol_fac*tot_img):
 			    seed+=1
+			    self.bg_retries+=1
 
 
 		
@@ -425,8 +766,57 @@ class synthetic_image:
 
 
 
-    def save_bgimage_fits(self,outputfitsfile, save_img_in_muJy=False):
-	""" Written by G. Snyder 8/4/2014 to output FITS files from Sunpy module """
+    def save_bgimage_fits(self,outputfitsfile, save_img_in_muJy=False, writer=None, compression=None, quantize=16.0, verbose=True):
+	""" Written by G. Snyder 8/4/2014 to output FITS files from Sunpy module.  With compression
+	    ('RICE_1', 'GZIP_1' or 'GZIP_2') the image is written tile-compressed, quantized in steps
+	    of the sky noise of the saved image / quantize (0: lossless, GZIP only); see
+	    load_synthetic_image  """
+	primhdu = self.bgimage_hdu(save_img_in_muJy=save_img_in_muJy)
+
+	if compression is not None:
+	    import sunpy.sunpy__writer
+	    sky_sig = self.saved_image_sky_sig(primhdu.data)
+	    if quantize == 0:
+	        quantize_level = 0.0
+	    elif sky_sig > 0:
+	        quantize_level = -sky_sig / quantize		# absolute quantization step
+	    else:
+	        quantize_level = quantize			# too little sky: cfitsio estimates the noise
+	    sunpy.sunpy__writer.check_compression(compression, quantize_level)
+	    if writer is not None:
+	        writer.save_compressed_fits(outputfitsfile, primhdu.data, primhdu.header, compression, quantize_level)
+	        return
+	    self.fits_write_stats = sunpy.sunpy__writer.write_compressed_fits(outputfitsfile, primhdu.data, primhdu.header.tostring(),
+	                                                                      compression, quantize_level, verbose=verbose)
+	    self.profiler.count('fits_raw_bytes', self.fits_write_stats['raw_bytes'])
+	    self.profiler.count('fits_file_bytes', self.fits_write_stats['file_bytes'])
+	    return
+
+        if writer is not None:		# encode + write in the background (see sunpy__writer)
+            writer.save_fits(outputfitsfile, primhdu.data, primhdu.header)
+            return
+
+        #Optionally, we can save additional images alongside these final ones
+        #e.g., the raw sunrise image below
+        #simhdu = pyfits.ImageHDU(self.sunriseimage, header=self.image_header) ; simhdu.name = 'SIMULATED_IMAGE'
+        #newlist = pyfits.HDUList([primhdu, simhdu])
+
+        #create HDU List container
+        newlist = pyfits.HDUList([primhdu])
+
+        #save container to file, overwriting as needed
+        newlist.writeto(outputfitsfile,clobber=True)
+
+
+    def saved_image_sky_sig(self, image, min_sky_pixels=50):
+	""" robust (1.4826 MAD) noise of a final image from its pixels outside 2 r_p, leaving out
+	    the zero padding; 0 if fewer than min_sky_pixels are left  """
+	r_petro_pixels = self.r_petro_kpc / self.bg_image.pixel_in_kpc
+	return float( sunpy.sunpy__photometry.sky_sigma(image, r_petro_pixels, min_sky_pixels=min_sky_pixels) )
+
+
+    def bgimage_hdu(self, save_img_in_muJy=False):
+	""" the final (background added) image and its header as a primary HDU, in nanomaggies """
         theobj = self.bg_image
 
 	myimage = theobj.return_image()		# in muJy / str 
@@ -449,42 +839,32 @@ class synthetic_image:
 	print "before saving the image min/max are:"
 	print image.min(), image.max(), np.sum(image) 
 
-        primhdu = pyfits.PrimaryHDU(image) ; primhdu.header.update('IMUNIT','NMAGGIE',comment='approx 3.63e-6 Jy')
-        primhdu.header.update('ABABSZP',22.5,'For Final Image')  #THIS SHOULD BE CORRECT FOR NANOMAGGIE IMAGES ONLY
-#        primhdu.header.update('ORIGZP',theobj.ab_abs_zeropoint,'For Original Image')
-        primhdu.header.update('PIXSCALE',theobj.pixel_in_arcsec,'For Final Image, arcsec')
-        primhdu.header.update('PIXORIG', theobj.camera_pixel_in_arcsec, 'For Original Image, arcsec')
-        primhdu.header.update('PIXKPC',theobj.pixel_in_kpc, 'KPC')
-        primhdu.header.update('ORIGKPC',self.sunrise_image.pixel_in_kpc,'For Original Image, KPC')
-        primhdu.header.update('NPIX',theobj.n_pixels)
-        primhdu.header.update('NPIXORIG',self.sunrise_image.n_pixels)
+        primhdu = pyfits.PrimaryHDU(image) ; primhdu.header['IMUNIT'] = ('NMAGGIE','approx 3.63e-6 Jy')
+        primhdu.header['ABABSZP'] = (22.5,'For Final Image')  #THIS SHOULD BE CORRECT FOR NANOMAGGIE IMAGES ONLY
+#        primhdu.header['ORIGZP'] = (theobj.ab_abs_zeropoint,'For Original Image')
+        primhdu.header['PIXSCALE'] = (theobj.pixel_in_arcsec,'For Final Image, arcsec')
+        primhdu.header['PIXORIG'] = (theobj.camera_pixel_in_arcsec, 'For Original Image, arcsec')
+        primhdu.header['PIXKPC'] = (theobj.pixel_in_kpc, 'KPC')
+        primhdu.header['ORIGKPC'] = (self.sunrise_image.pixel_in_kpc,'For Original Image, KPC')
+        primhdu.header['NPIX'] = theobj.n_pixels
+        primhdu.header['NPIXORIG'] = self.sunrise_image.n_pixels
 
-        primhdu.header.update('REDSHIFT',self.cosmology.redshift)
-        primhdu.header.update('LUMDIST' ,self.cosmology.lum_dist, 'MPC')
-        primhdu.header.update('ANGDIST' ,self.cosmology.ang_diam_dist, 'MPC')
-        primhdu.header.update('PSCALE'  ,self.cosmology.kpc_per_arcsec,'KPC')
+        primhdu.header['REDSHIFT'] = self.cosmology.redshift
+        primhdu.header['LUMDIST'] = (self.cosmology.lum_dist, 'MPC')
+        primhdu.header['ANGDIST'] = (self.cosmology.ang_diam_dist, 'MPC')
+        primhdu.header['PSCALE'] = (self.cosmology.kpc_per_arcsec,'KPC')
 
-        primhdu.header.update('H0',self.cosmology.H0)
-        primhdu.header.update('WM',self.cosmology.WM)
-        primhdu.header.update('WV',self.cosmology.WV)
-
-        primhdu.header.update('PSFFWHM',self.telescope.psf_fwhm_arcsec,'arcsec')
-        primhdu.header.update('TPIX',self.telescope.pixelsize_arcsec,'arcsec')
-
-        primhdu.header.update('FILTER', self.band_name)
-        primhdu.header.update('FILE',self.filename)
-        primhdu.update_ext_name('SYNTHETIC_IMAGE')
-
-        #Optionally, we can save additional images alongside these final ones
-        #e.g., the raw sunrise image below
-        #simhdu = pyfits.ImageHDU(self.sunriseimage, header=self.image_header) ; zhdu.update_ext_name('SIMULATED_IMAGE')
-        #newlist = pyfits.HDUList([primhdu, simhdu])
+        primhdu.header['H0'] = self.cosmology.H0
+        primhdu.header['WM'] = self.cosmology.WM
+        primhdu.header['WV'] = self.cosmology.WV
 
-        #create HDU List container
-        newlist = pyfits.HDUList([primhdu])
+        primhdu.header['PSFFWHM'] = (self.telescope.psf_fwhm_arcsec,'arcsec')
+        primhdu.header['TPIX'] = (self.telescope.pixelsize_arcsec,'arcsec')
 
-        #save container to file, overwriting as needed
-        newlist.writeto(outputfitsfile,clobber=True)
+        primhdu.header['FILTER'] = self.band_name
+        primhdu.header['FILE'] = self.filename
+        primhdu.name = 'SYNTHETIC_IMAGE'
+        return primhdu
 
 
 
@@ -577,6 +957,15 @@ def my_fits_open(filename):
 # adopted cosmology (e.g.,image kpc per arcsec)
 #
 #=======================================================#
+cosmology_cache = {}
+
+def get_cosmology(redshift, H0=70.4, WM=0.2726, WV=0.7274):
+    """ shared cosmology instance for these parameters (the cosmocalc calls are only made once) """
+    key = (redshift, H0, WM, WV)
+    if key not in cosmology_cache:
+        cosmology_cache[key] = cosmology(redshift, H0=H0, WM=WM, WV=WV)
+    return cosmology_cache[key]
+
 class cosmology:
     def __init__(self, redshift, H0=70.4, WM=0.2726, WV=0.7274):
         self.H0=H0
@@ -639,8 +1028,7 @@ class single_image:
         self.camera_pixel_in_arcsec = (self.pixel_in_kpc / parent_obj.param_header.get('cameradist') ) * 2.06e5
 
 	pixel_in_sr = (1e3*self.pixel_in_kpc /10.0)**2
-	image_in_muJy =  self.image  * pixel_in_sr		# should now have muJy
-        tot_img_in_Jy = np.sum(image_in_muJy) / 1e6		# now have total image flux in Jy
+        tot_img_in_Jy = np.sum(self.image) * pixel_in_sr / 1e6	# now have total image flux in Jy (image in muJy/sr)
 	abmag = -2.5 * np.log10(tot_img_in_Jy / 3631 )
 #	print "the ab magnitude of this image is :"+str(abmag)
 
@@ -729,7 +1117,130 @@ def congrid(a, newdims, centre=False, minusone=False):
 
     return newa
 
+
+def congrid_coords(n_old, n_new):
+    """ the source pixel coordinates sampled by congrid when resizing an axis from n_old to n_new """
+    return (n_old - 0) / (np.asarray(n_new, dtype=float) - 0) * (np.arange(n_new) + 0.0) - 0.0
+
+
+def _linear_weights(coords, n):
+    """ interp1d-style bracketing indices, weights and in-bounds mask for linear interpolation """
+    hi = np.clip( np.searchsorted(np.arange(n, dtype=np.float), coords), 1, n - 1 )
+    lo = hi - 1
+    return lo, hi, coords - lo, (coords >= 0) & (coords <= n - 1)
+
+
+def _needed_indices(taps):
+    """ sorted source indices read by a set of interpolation taps """
+    lo, hi, w, valid = taps
+    return np.unique( np.concatenate( [lo[valid], hi[valid]] ) )
+
+
+def _interpolate_taps(sub, rows, cols, row_taps, col_taps):
+    """ apply row/col taps to sub, which holds only the source rows and cols listed in rows/cols """
+    col_lo, col_hi, col_w, col_valid = col_taps
+    row_lo, row_hi, row_w, row_valid = row_taps
+
+    col_lo = np.searchsorted(cols, np.where(col_valid, col_lo, cols[0]))
+    col_hi = np.searchsorted(cols, np.where(col_valid, col_hi, cols[0]))
+    y_lo = sub[:, col_lo]
+    newa = (sub[:, col_hi] - y_lo) * col_w + y_lo
+    newa[:, ~col_valid] = 0.0
+
+    row_lo = np.searchsorted(rows, np.where(row_valid, row_lo, rows[0]))
+    row_hi = np.searchsorted(rows, np.where(row_valid, row_hi, rows[0]))
+    y_lo = newa[row_lo]
+    newa = (newa[row_hi] - y_lo) * row_w[:,None] + y_lo
+    newa[~row_valid] = 0.0
+    return newa
+
+
+def resample_matrix(coords, n):
+    """ (len(coords) x n) matrix R of the linear interpolation taps at coords, so that
+        resample_separable(a, row_coords, col_coords) = R_row . a . R_col^T              """
+    lo, hi, w, valid = _linear_weights(np.asarray(coords, dtype=float), n)
+    matrix = np.zeros( (len(lo), n) )
+    rows = np.arange(len(lo))[valid]
+    np.add.at(matrix, (rows, lo[valid]), 1.0 - w[valid])
+    np.add.at(matrix, (rows, hi[valid]), w[valid])
+    return matrix
+
+
+def resample_separable(a, row_coords, col_coords):
+    """ linearly interpolate the 2d array a at the (row, col) coordinate grid, columns first and
+        then rows, with 0 outside the array -- the same arithmetic as congrid.  Only the source
+        rows and columns that are needed are read, so a can be a (large) memory-mapped array. """
+    row_taps = _linear_weights(np.asarray(row_coords, dtype=float), a.shape[0])
+    col_taps = _linear_weights(np.asarray(col_coords, dtype=float), a.shape[1])
+
+    rows = _needed_indices(row_taps)
+    cols = _needed_indices(col_taps)
+    if rows.size == 0 or cols.size == 0:
+        return np.zeros( (len(row_taps[0]), len(col_taps[0])) )
+    sub = np.asarray( a[rows[:,None], cols[None,:]] )
+    if not sub.dtype in [np.float64, np.float32]:
+        sub = np.cast[float](sub)
+    return _interpolate_taps(sub, rows, cols, row_taps, col_taps)
+
+
+def resample_composed(a, first_coords, second_coords):
+    """ resample_separable applied twice on a square grid -- first at first_coords, then the
+        result at second_coords -- computing only the intermediate pixels the second pass reads """
+    first_coords = np.asarray(first_coords, dtype=float)
+    taps   = _linear_weights(np.asarray(second_coords, dtype=float), len(first_coords))
+    needed = _needed_indices(taps)
+    if needed.size == 0:
+        return np.zeros( (len(taps[0]), len(taps[0])) )
+    sub = resample_separable(a, first_coords[needed], first_coords[needed])
+    return _interpolate_taps(sub, needed, needed, taps, taps)
+
+
+def congrid_window(a, newdims, start, size):
+    """ the [start:start+size] window of congrid(a, newdims), without computing the rest """
+    row_coords = congrid_coords(a.shape[0], newdims[0])[int(start[0]):int(start[0])+int(size[0])]
+    col_coords = congrid_coords(a.shape[1], newdims[1])[int(start[1]):int(start[1])+int(size[1])]
+    return resample_separable(a, row_coords, col_coords)
+
+
+def congrid_tiled(a, newdims, tile_size, out=None):
+    """ congrid(a, newdims) computed tile by tile into out (e.g. a scratch memmap) """
+    newdims = ( int(newdims[0]), int(newdims[1]) )
+    tile_size = int(tile_size)
+    if out is None:
+        out = np.zeros(newdims)
+    for i in range(0, newdims[0], tile_size):
+        for j in range(0, newdims[1], tile_size):
+            size = ( min(tile_size, newdims[0] - i), min(tile_size, newdims[1] - j) )
+            out[i:i+size[0], j:j+size[1]] = congrid_window(a, newdims, (i, j), size)
+    return out
+
+
+def tiled_gaussian_filter(image, sigma, tile_size, out=None, truncate=4.0):
+    """ gaussian_filter(image, sigma, mode='constant') computed tile by tile.  Each tile is read
+        with a halo of the kernel radius, so the result matches the full-image filter.       """
+    halo = int(truncate * float(sigma) + 0.5)		# kernel radius used by scipy.ndimage
+    tile_size = int(tile_size)
+    if out is None:
+        out = np.zeros(image.shape)
+    n_rows, n_cols = image.shape
+    for i in range(0, n_rows, tile_size):
+        for j in range(0, n_cols, tile_size):
+            i0, i1 = max(i - halo, 0), min(i + tile_size + halo, n_rows)
+            j0, j1 = max(j - halo, 0), min(j + tile_size + halo, n_cols)
+            tile = sp.ndimage.filters.gaussian_filter(np.asarray(image[i0:i1, j0:j1], dtype=float),
+						sigma, mode='constant', truncate=truncate)
+            out[i:min(i+tile_size, n_rows), j:min(j+tile_size, n_cols)] = \
+			tile[i-i0:min(i+tile_size, n_rows)-i0, j-j0:min(j+tile_size, n_cols)-j0]
+    return out
+
+
+def scratch_array(shape, dtype=np.float64):
+    """ zero-filled array backed by an anonymous temporary file in scratch_dir (None = system default) """
+    return np.memmap(tempfile.TemporaryFile(dir=scratch_dir), dtype=dtype, mode='w+', shape=shape)
+
+
 def download_backgrounds():
+    import wget
     if not os.path.exists('./data'):
         os.makedirs('./data')
     if not os.path.exists('./data/SDSS_backgrounds'):
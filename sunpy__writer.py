@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+""" Write-behind output queue for png and fits products.
+
+Encoding a png with my_save_image or writing a fits file with save_bgimage_fits can take as
+long as the render itself on a shared filesystem.  output_writer takes finished arrays (plus
+header metadata) and encodes and writes them on background worker threads, or worker processes
+with use_processes=True.  The queue is bounded: when it is full, save_image / save_fits block
+until a worker catches up, so memory stays capped.  flush waits for everything queued so far
+and reports the writes that failed; close flushes and stops the workers.
+
+Arrays are handed over to the writer, not copied, so they must not be modified after queueing.
+
+Example usage:
+    writer = sunpy__writer.output_writer(max_queue=8, n_workers=2)
+    sunpy__plot.plot_synthetic_sdss_gri(filename, savefile='./gri.png', writer=writer)
+    sunpy__synthetic_image.synthetic_image(filename, band='r_SDSS.res', save_fits=True, writer=writer)
+    failed = writer.close()
+"""
+import numpy as np
+import os
+import sys
+import time
+import Queue
+import threading
+import traceback
+import multiprocessing
+
+import sunpy.sunpy__plot as sunpy__plot
+import sunpy.sunpy__atlas as sunpy__atlas
+import sunpy.sunpy__lazy as sunpy__lazy
+fits = sunpy__lazy.lazy_import('astropy.io.fits')
+
+
+__author__ = "Paul Torrey and Greg Snyder"
+__copyright__ = "Copyright 2014, The Authors"
+__credits__ = ["Paul Torrey", "Greg Snyder"]
+__license__ = "GPL"
+__version__ = "1.0"
+__maintainer__ = "Paul Torrey"
+__email__ = "ptorrey@mit.harvard.edu"
+__status__ = "Production"
+if __name__ == '__main__':    #code to execute if called from command-line
+    pass    #do nothing
+
+
+def write_image(savefile, img, opt_text=None):
+    sunpy__plot.my_save_image(img, savefile, opt_text=opt_text)
+
+
+def write_png(savefile, img):
+    sunpy__atlas.write_png(savefile, img)
+
+
+def write_fits(filename, data, header_string=None):
+    """ write data (and a header, given as a header card string) as a single HDU fits file """
+    if header_string is None:
+        header = None
+    else:
+        header = fits.Header.fromstring(header_string)
+    fits.HDUList([ fits.PrimaryHDU(data, header=header) ]).writeto(filename, overwrite=True)
+
+
+compression_types = ['RICE_1', 'GZIP_1', 'GZIP_2']
+
+
+def check_compression(compression_type, quantize_level):
+    """ exit with a message for settings cfitsio would reject while writing """
+    if compression_type not in compression_types:
+        print "unknown fits compression type:", compression_type, "(use one of "+", ".join(compression_types)+")"
+        sys.exit()
+    if quantize_level == 0 and not compression_type.startswith('GZIP'):
+        print "lossless (quantize_level=0) compression of floating point images needs GZIP_1 or GZIP_2, not", compression_type
+        sys.exit()
+
+
+def write_compressed_fits(filename, data, header_string=None, compression_type='RICE_1', quantize_level=16.0, verbose=True):
+    """ write data as a tile-compressed image extension (behind an empty primary HDU).  Floats
+        are quantized with subtractive dithering: quantize_level > 0 sets the step to the
+        image noise (estimated by cfitsio) / quantize_level, < 0 the absolute step, and 0
+        keeps them lossless (GZIP only).  Returns (and with verbose prints) the compression
+        ratio against the uncompressed float64 data and the write throughput.          """
+    check_compression(compression_type, quantize_level)
+    if header_string is None:
+        header = None
+    else:
+        header = fits.Header.fromstring(header_string)
+    data = np.asarray(data)
+    start_time = time.time()
+    hdu = fits.CompImageHDU(data, header=header, compression_type=compression_type, quantize_level=quantize_level,
+                            quantize_method=(1 if quantize_level != 0 else -1), dither_seed=-1)
+    fits.HDUList([ fits.PrimaryHDU(), hdu ]).writeto(filename, overwrite=True)
+    write_time = time.time() - start_time
+
+    raw_bytes = 8 * data.size
+    stats = { 'filename':         filename,
+              'compression_type': compression_type,
+              'quantize_level':   quantize_level,
+              'raw_bytes':        raw_bytes,
+              'file_bytes':       os.path.getsize(filename),
+              'write_time':       write_time }
+    stats['compression_ratio'] = float(raw_bytes) / stats['file_bytes']
+    stats['throughput_mb']     = raw_bytes / 1e6 / max(write_time, 1e-9)       # uncompressed MB per second
+    if verbose:
+        print "wrote "+filename+" ("+compression_type+"): compression ratio "+("%.2f" % stats['compression_ratio'])+ \
+              ", "+("%.1f" % stats['throughput_mb'])+" MB/s"
+    return stats
+
+
+writer_tasks = { 'image': write_image,
+                 'png':   write_png,
+                 'fits':  write_fits,
+                 'compressed_fits': write_compressed_fits }
+
+
+def _worker_loop(tasks, errors):
+    """ run queued (task, args) items until a None is received; failures go to the errors queue """
+    while True:
+        item = tasks.get()
+        try:
+            if item is None:
+                return
+            task, args = item
+            try:
+                writer_tasks[task](*args)
+            except Exception:
+                errors.put( (task, args[0], traceback.format_exc()) )
+        finally:
+            tasks.task_done()
+
+
+class output_writer:
+    """ bounded background queue that encodes and writes png / fits products """
+    def __init__(self, max_queue=8, n_workers=1, use_processes=False):
+        self.use_processes = use_processes
+        if use_processes:
+            self.tasks  = multiprocessing.JoinableQueue(maxsize=max_queue)
+            self.errors = multiprocessing.Queue()
+        else:
+            self.tasks  = Queue.Queue(maxsize=max_queue)
+            self.errors = Queue.Queue()
+
+        self.workers = []
+        for index in range(n_workers):
+            if use_processes:
+                worker = multiprocessing.Process(target=_worker_loop, args=(self.tasks, self.errors))
+            else:
+                worker = threading.Thread(target=_worker_loop, args=(self.tasks, self.errors))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.n_queued     = 0
+        self.blocked_time = 0.0         # time spent waiting on a full queue (backpressure)
+        self.failed       = []
+        self.closed       = False
+
+    def submit(self, task, *args):
+        """ queue one write; blocks while the queue is full """
+        if self.closed:
+            print "output_writer is closed, cannot write:", args[0]
+            sys.exit()
+        start_time = time.time()
+        self.tasks.put( (task, args) )
+        self.blocked_time += time.time() - start_time
+        self.n_queued += 1
+
+    def save_image(self, img, savefile, opt_text=None):
+        """ queue an n x n x 3 image to be saved as a png with sunpy__plot.my_save_image """
+        self.submit('image', savefile, img, opt_text)
+
+    def save_png(self, img, savefile):
+        """ queue a rows x cols (x 3) uint8 image to be written as a png with sunpy__atlas.write_png """
+        self.submit('png', savefile, img)
+
+    def save_fits(self, filename, data, header=None):
+        """ queue data (with an optional fits header) to be written to filename """
+        if header is not None:
+            header = header.tostring()
+        self.submit('fits', filename, data, header)
+
+    def save_compressed_fits(self, filename, data, header=None, compression_type='RICE_1', quantize_level=16.0):
+        """ queue data to be written as tile-compressed fits (see write_compressed_fits) """
+        check_compression(compression_type, quantize_level)
+        if header is not None:
+            header = header.tostring()
+        self.submit('compressed_fits', filename, data, header, compression_type, quantize_level)
+
+    def flush(self, verbose=True):
+        """ wait until everything queued so far is written; returns the list of failed writes
+            as (task, filename, traceback) tuples                                        """
+        self.tasks.join()
+        while True:
+            try:
+                error = self.errors.get(timeout=0.1) if self.use_processes else self.errors.get_nowait()
+            except Queue.Empty:
+                break
+            self.failed.append(error)
+            if verbose:
+                print "write failed:", error[1]
+                print error[2]
+        return list(self.failed)
+
+    def close(self, verbose=True):
+        """ flush, stop the workers and return the list of failed writes """
+        if self.closed:
+            return list(self.failed)
+        failed = self.flush(verbose=verbose)
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.closed = True
+        if verbose:
+            print "output_writer wrote "+str(self.n_queued - len(failed))+" of "+str(self.n_queued)+" products, "+ \
+                  "blocked for "+str(self.blocked_time)+" seconds"
+        return failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return False
@@ -0,0 +1,6 @@
+# the modules import each other as sunpy.sunpy__<name>: make the checkout (a directory named
+# sunpy) importable as that package when the tests are run from a source tree
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) ))
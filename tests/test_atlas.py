@@ -0,0 +1,71 @@
+""" tests for the streamed atlas canvases of sunpy__atlas """
+import numpy as np
+import matplotlib.image
+import astropy.io.fits as fits
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__atlas as sunpy__atlas
+
+
+@pytest.fixture(scope='module')
+def mock_file(tmpdir_factory):
+    filename = str( tmpdir_factory.mktemp('atlas').join('broadband_123.fits') )
+    sunpy__mock.write_mock_sunrise_file(filename, n_pixels=48, n_bands=8)
+    return filename
+
+
+def test_build_atlas_missing_first_file(mock_file, tmpdir):
+    output = str(tmpdir.join('atlas.png'))
+    failed = sunpy__atlas.build_atlas(['nope.fits', mock_file], output, n_cols=2, verbose=False)
+    assert failed == ['nope.fits']
+    atlas = matplotlib.image.imread(output)
+    assert atlas.shape[:2] == (48, 96)
+    assert atlas[:,:48].max() == 0                      # empty tile for the missing file
+    assert atlas[:,48:].max() > 0
+
+
+@pytest.mark.parametrize('n_channels', [1, 3])
+def test_png_stream_round_trip(tmpdir, n_channels):
+    shape = (37, 53) if n_channels == 1 else (37, 53, 3)
+    img = np.random.RandomState(4).randint(0, 256, shape).astype(np.uint8)
+    filename = str(tmpdir.join('stream.png'))
+    stream = sunpy__atlas.png_stream(filename, 53, 37, n_channels)
+    for first in range(0, 37, 10):
+        stream.write_rows(img[first:first+10])
+    stream.close()
+    png = np.round( 255 * matplotlib.image.imread(filename) ).astype(np.uint8)
+    assert np.array_equal(png if n_channels == 3 else png.reshape(shape), img)
+
+
+@pytest.mark.parametrize('n_channels', [1, 3])
+def test_fits_stream_round_trip(tmpdir, n_channels):
+    img = np.random.RandomState(5).rand(30, 20, n_channels).astype(np.float32)
+    filename = str(tmpdir.join('stream.fits'))
+    stream = sunpy__atlas.fits_stream(filename, 20, 30, n_channels, cards=[('PRODUCT', 'test')])
+    stream.write_rows(20, img[20:])                     # rows in any order
+    stream.write_rows(0, img[:20])
+    stream.close()
+    hdulist = fits.open(filename)
+    data = hdulist[0].data
+    assert hdulist[0].header['PRODUCT'] == 'test'
+    if n_channels == 1:
+        assert np.array_equal(data[::-1], img[:,:,0])                 # fits row 0 is the bottom row
+    else:
+        assert np.array_equal(np.transpose(data, (1, 2, 0))[::-1], img)
+    hdulist.close()
+
+
+def test_canvas_tiles_in_any_order(tmpdir):
+    tiles = [ np.full((4, 4, 3), 10 * (index + 1), dtype=np.uint8) for index in range(5) ]
+    filename = str(tmpdir.join('canvas.png'))
+    canvas = sunpy__atlas.atlas_canvas(filename, 2, 3, 4)
+    for index in [4, 0, 2, 1, 3]:
+        canvas.add_tile(index, tiles[index])
+    canvas.close()
+    png = np.round( 255 * matplotlib.image.imread(filename) ).astype(np.uint8)
+    assert png.shape == (8, 12, 3)
+    for index in range(5):
+        row, col = divmod(index, 3)
+        assert (png[4*row:4*row+4, 4*col:4*col+4] == 10 * (index + 1)).all()
+    assert (png[4:, 8:] == 0).all()                     # the sixth tile was never added
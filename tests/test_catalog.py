@@ -0,0 +1,37 @@
+""" tests for the binary galaxy catalog of sunpy__catalog """
+import numpy as np
+import pytest
+
+import sunpy.sunpy__catalog as sunpy__catalog
+
+
+lines = [ ('543', 12345, 10.5), ('001', 7, 9.2), ('120', 400, 11.3), ('002', 9, 10.1) ]
+
+
+@pytest.fixture
+def txt_catalog(tmpdir):
+    filename = str(tmpdir.join('directory_catalog_135.txt'))
+    f = open(filename, 'w')
+    for subdir, galaxy_number, mass in lines:
+        f.write( subdir+' '+str(galaxy_number)+' '+str(mass)+'\n' )
+    f.close()
+    return filename
+
+
+def test_catalog_lookups(txt_catalog):
+    catalog = sunpy__catalog.load_catalog(txt_catalog, download=False)
+    assert list(catalog.galaxy_numbers[catalog.select_all()]) == [7, 9, 400, 12345]
+    assert list(catalog.galaxy_numbers[catalog.select_file_order()]) == [ line[1] for line in lines ]
+    assert list(catalog.subdir([400, 7])) == ['120', '001']
+    assert list(catalog.galaxy_numbers[catalog.select_mass(10.0, 11.0)]) == [9, 12345]
+    url = catalog.urls(catalog.find([12345]))[0]
+    assert url == sunpy__catalog.dl_base+'illustris_images/subdir_543/broadband_12345.fits'
+
+
+def test_old_table_is_converted_again(txt_catalog):
+    table_filename, index_filename = sunpy__catalog.catalog_filenames(txt_catalog)
+    sunpy__catalog.convert_catalog(txt_catalog)
+    old_table = np.zeros(len(lines), dtype=sunpy__catalog.catalog_dtype)       # a table without file_rows
+    np.save(table_filename, old_table)
+    catalog = sunpy__catalog.load_catalog(txt_catalog, download=False)
+    assert list(catalog.galaxy_numbers[catalog.select_file_order()]) == [ line[1] for line in lines ]
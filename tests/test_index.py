@@ -0,0 +1,43 @@
+""" tests for the SQLite header metadata index of sunpy__index """
+import os
+import numpy as np
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__index as sunpy__index
+
+
+@pytest.fixture
+def directory(tmpdir):
+    for galaxy_number, redshift in [ (1, 0.05), (2, 0.5), (3, 0.5) ]:
+        sunpy__mock.write_mock_sunrise_file(str(tmpdir.join('broadband_'+str(galaxy_number)+'.fits')), n_pixels=16,
+                                            n_bands=8, n_cameras=2, redshift=redshift, linear_fov=50.0 * galaxy_number)
+    return tmpdir
+
+
+def test_index_matches_headers(directory):
+    index = sunpy__index.metadata_index(str(directory.join('metadata.sqlite')))
+    assert index.update(str(directory), verbose=False) == 3
+    assert index.update(str(directory), verbose=False) == 0            # nothing changed
+    assert [ os.path.basename(f) for f in index.files_at_redshift(0.5) ] == ['broadband_2.fits', 'broadband_3.fits']
+
+    filename = str(directory.join('broadband_3.fits'))
+    from_headers = ( sunpy__load.load_redshift(filename), sunpy__load.load_fov(filename),
+                     list(sunpy__load.load_broadband_names(filename)), sunpy__load.load_camera_angles(filename, camera=1) )
+    sunpy__load.use_metadata_index(index)
+    try:
+        assert sunpy__load._indexed_metadata(filename) is not None
+        from_index = ( sunpy__load.load_redshift(filename), sunpy__load.load_fov(filename),
+                       list(sunpy__load.load_broadband_names(filename)), sunpy__load.load_camera_angles(filename, camera=1) )
+    finally:
+        sunpy__load.use_metadata_index(None)
+    assert from_index[0] == pytest.approx(from_headers[0])
+    assert from_index[1] == pytest.approx(from_headers[1])
+    assert from_index[2] == from_headers[2]
+    assert np.allclose(from_index[3], from_headers[3])
+
+    os.remove(str(directory.join('broadband_1.fits')))
+    index.update(str(directory), verbose=False)
+    assert len(index.query('SELECT filename FROM files')) == 2
+    index.close()
@@ -0,0 +1,43 @@
+""" tests for the non-parametric morphology of sunpy__morphology """
+import numpy as np
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__photometry as sunpy__photometry
+import sunpy.sunpy__morphology as sunpy__morphology
+
+
+def gaussian(n_pixels, sigma, center_offset=(0.0, 0.0)):
+    x, y = sunpy__photometry.pixel_offsets(n_pixels)
+    return np.exp( -0.5 * ( (x[np.newaxis,:] - center_offset[1])**2 + (y[:,np.newaxis] - center_offset[0])**2 ) / sigma**2 )
+
+
+def test_gaussian_statistics():
+    stack = np.array([ gaussian(161, 10.0), gaussian(161, 10.0) + 0.5 * gaussian(161, 3.0, (20.0, 0.0)) ])
+    results = sunpy__morphology.measure(stack, 40.0, sigma=0.0)
+    expected_c = 5.0 * np.log10( np.sqrt( np.log(5.0) / np.log(1.25) ) )        # r80 / r20 of a gaussian
+    assert abs(results['concentration'][0] - expected_c) < 0.05
+    assert results['asymmetry'][0] < 0.01
+    assert results['asymmetry'][1] > 0.05                # an off-centre clump is asymmetric
+    assert results['gini'][0] > 0.0 and results['gini'][0] < 1.0
+
+
+def test_flat_image_has_zero_gini():
+    flat = np.ones((1, 64, 64))
+    gini, m20 = sunpy__morphology.gini_m20(flat, 10.0)
+    assert abs(gini[0]) < 1e-10
+
+
+def test_batch_morphology(tmpdir):
+    filenames = [ str(tmpdir.join('broadband_'+str(n)+'.fits')) for n in [1, 2] ] + [ str(tmpdir.join('broadband_404.fits')) ]
+    for seed, filename in enumerate(filenames[:2]):
+        sunpy__mock.write_mock_sunrise_file(filename, n_pixels=128, n_bands=8, seed=seed)
+    output = str(tmpdir.join('morphology.npy'))
+    table = sunpy__morphology.batch_morphology(filenames, ['g_SDSS.res', 'r_SDSS.res'], output, seed=1,
+                                               add_background=False)
+    assert len(table) == 6
+    assert list(table['failed']) == [0, 0, 0, 0, 1, 1]
+    assert np.isfinite(table['concentration'][:4]).all()
+    saved = np.load(output)
+    assert np.array_equal(saved['filename'], table['filename'])
+    assert np.array_equal(saved['concentration'][:4], table['concentration'][:4])
+    assert sunpy__morphology.file_seed(1, filenames[0]) != sunpy__morphology.file_seed(1, filenames[1])
@@ -0,0 +1,24 @@
+""" tests for the stacked aperture photometry of sunpy__photometry """
+import numpy as np
+
+import sunpy.sunpy__photometry as sunpy__photometry
+
+
+def test_light_fraction_radius_multi_axis_stack():
+    stack = np.random.RandomState(1).rand(3, 2, 40, 40)
+    radii = sunpy__photometry.half_light_radius(stack)
+    assert radii.shape == (3, 2)
+    single = [ [ sunpy__photometry.half_light_radius(stack[i,j]) for j in range(2) ] for i in range(3) ]
+    assert np.allclose(radii, single)
+    assert np.allclose( sunpy__photometry.half_light_radius(stack, total=stack.sum(axis=(2,3))), radii )
+    assert sunpy__photometry.half_light_radius(stack, total=1.0).shape == (3, 2)
+
+
+def test_sky_sigma_ignores_padding_and_galaxy():
+    stack = 2.0 * np.random.RandomState(3).randn(2, 80, 80)
+    stack[:, 30:50, 30:50] += 100.0                     # the galaxy, inside 2 r_p
+    stack[1, :, :10] = 0.0                              # zero padding
+    sigma = sunpy__photometry.sky_sigma(stack, [8.0, 8.0])
+    assert sigma.shape == (2,)
+    assert np.allclose(sigma, 2.0, rtol=0.05)
+    assert sunpy__photometry.sky_sigma(stack, 40.0).tolist() == [0.0, 0.0]      # too few sky pixels
@@ -0,0 +1,37 @@
+""" tests for the prefetching galaxy stream of sunpy__pipeline """
+import os
+import time
+import shutil
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__pipeline as sunpy__pipeline
+
+
+@pytest.fixture
+def downloads(tmpdir, monkeypatch):
+    """ file names whose fetch 'downloads' a copy of a mock SUNRISE file (or garbage, for bad_*) """
+    source = str(tmpdir.join('source.fits'))
+    sunpy__mock.write_mock_sunrise_file(source, n_pixels=32, n_bands=8)
+    def fetch_file(filename, url=None):
+        if os.path.basename(filename).startswith('bad_'):
+            open(filename, 'w').write('not a fits file')
+        else:
+            shutil.copy(source, filename)
+        return True
+    monkeypatch.setattr(sunpy__pipeline, 'fetch_file', fetch_file)
+    return [ str(tmpdir.join(name+'_'+str(index)+'.fits')) for index, name in enumerate(['a', 'bad', 'b', 'c', 'd', 'e']) ]
+
+
+def test_unreadable_file_is_skipped(downloads):
+    seen = [ filename for filename, inputs in sunpy__pipeline.stream_galaxies(downloads, delete=True) ]
+    assert seen == [ filename for filename in downloads if 'bad_' not in filename ]
+    assert not any( [ os.path.exists(filename) for filename in downloads ] )
+
+
+def test_early_close_removes_prefetched_downloads(downloads):
+    stream = sunpy__pipeline.stream_galaxies(downloads, prefetch=3, delete=True)
+    next(stream)
+    stream.close()
+    time.sleep(0.5)                         # a file being decoded during close is removed by the thread
+    assert not any( [ os.path.exists(filename) for filename in downloads ] )
@@ -0,0 +1,40 @@
+""" tests for the psf kernel library of sunpy__psf """
+import numpy as np
+import scipy.ndimage
+from scipy.special import erf
+
+import sunpy.sunpy__psf as sunpy__psf
+
+
+def test_caches_are_bounded():
+    library = sunpy__psf.psf_library(max_cached_ffts=3, max_cached_kernels=4)
+    for fwhm in [0.8, 1.0, 1.2]:
+        library.add_gaussian('g'+str(fwhm), fwhm)
+        for pixel_arcsec in [0.1, 0.2, 0.3]:
+            library.convolve(np.ones((16, 16)), 'g'+str(fwhm), pixel_arcsec)
+    assert len(library.sampled_cache) == 4
+    assert len(library.fft_cache) == 3
+    assert ('g1.2', 0.3) in library.sampled_cache          # most recently used entries are kept
+
+
+def test_downsampled_kernel_integrates_pixels():
+    sigma, fine, coarse = 0.5, 0.01, 0.396
+    x = fine * np.arange(-300, 301)
+    profile = np.exp( -0.5 * (x / sigma)**2 )
+    kernel = sunpy__psf.resample_kernel(np.outer(profile, profile), fine, coarse)
+    centres = coarse * ( np.arange(kernel.shape[0]) - (kernel.shape[0] - 1) / 2.0 )
+    pixel = erf( (centres + coarse / 2) / (sigma * 2**0.5) ) - erf( (centres - coarse / 2) / (sigma * 2**0.5) )
+    expected = np.outer(pixel, pixel) / np.outer(pixel, pixel).sum()
+    assert abs(kernel - expected).max() < 1e-3 * expected.max()
+
+
+def test_fft_convolution_matches_direct():
+    image = np.random.RandomState(2).rand(40, 50)
+    library = sunpy__psf.psf_library()
+    library.add_gaussian('sdss', 1.0)
+    kernel = library.kernel_image('sdss', 0.2)
+    direct = scipy.ndimage.convolve(image, kernel, mode='constant', cval=0.0)
+    assert np.allclose(library.convolve(image, 'sdss', 0.2), direct)
+    assert np.allclose(library.convolve_tiled(image, 'sdss', 0.2, 16), direct)
+    stack = library.convolve_stack(np.array([image, 2 * image]), 'sdss', 0.2)
+    assert np.allclose(stack[1], 2 * direct)
@@ -0,0 +1,44 @@
+""" tests for the tile pyramids and thumbnails of sunpy__pyramid """
+import os
+import json
+import numpy as np
+import matplotlib.image
+
+import sunpy.sunpy__pyramid as sunpy__pyramid
+
+
+def read_png(filename):
+    return np.round( 255 * matplotlib.image.imread(filename) ).astype(np.uint8)
+
+
+def test_tile_layout(tmpdir):
+    img = np.random.RandomState(6).rand(300, 200, 3)            # 300 rows x 200 columns
+    directory = str(tmpdir.join('pyramid'))
+    metadata = sunpy__pyramid.write_pyramid(img, directory, tile_size=64, thumbnail_sizes=[32, 100])
+
+    assert metadata['max_zoom'] == 3                             # 300 px need 2^3 tiles of 64
+    assert metadata['n_tiles'] == [1, 2, 6, 20]                  # tiles that are all padding are not written
+    assert json.load(open(os.path.join(directory, 'pyramid.json'))) == json.loads(json.dumps(metadata))
+    for zoom, n_tiles in enumerate(metadata['n_tiles']):
+        written = [ os.path.join(x, y) for x in os.listdir(os.path.join(directory, str(zoom)))
+                                       for y in os.listdir(os.path.join(directory, str(zoom), x)) ]
+        assert len(written) == n_tiles
+    assert read_png(os.path.join(directory, '3', '0', '0.png')).shape == (64, 64, 3)
+    assert not os.path.exists(os.path.join(directory, '3', '4'))   # columns beyond the 200 px image
+
+
+def test_full_resolution_tiles_match_image(tmpdir):
+    img = np.random.RandomState(7).randint(0, 256, (100, 130)).astype(np.uint8)
+    directory = str(tmpdir.join('pyramid'))
+    sunpy__pyramid.write_pyramid(img, directory, tile_size=64, thumbnail_sizes=[], origin='upper')
+    tile = read_png(os.path.join(directory, '2', '1', '0.png'))      # x = column 1, y = row 0
+    assert np.array_equal(tile, img[:64, 64:128])
+
+
+def test_thumbnail_keeps_aspect_ratio(tmpdir):
+    img = np.ones((300, 200, 3))
+    directory = str(tmpdir.join('pyramid'))
+    sunpy__pyramid.write_pyramid(img, directory, tile_size=64, thumbnail_sizes=[60])
+    thumbnail = read_png(os.path.join(directory, 'thumb_60.png'))
+    assert thumbnail.shape == (60, 40, 3)
+    assert (thumbnail == 255).all()                              # no padding band
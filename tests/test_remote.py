@@ -0,0 +1,54 @@
+""" tests for the http range reader of sunpy__remote against the local fits loaders """
+import os
+import urllib2
+import numpy as np
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__remote as sunpy__remote
+
+
+@pytest.fixture(scope='module')
+def served(tmpdir_factory):
+    """ (local file, its url) of a mock SUNRISE file behind a range server """
+    directory = tmpdir_factory.mktemp('served')
+    filename = str(directory.join('broadband_123.fits'))
+    sunpy__mock.write_mock_sunrise_file(filename, n_pixels=64, n_bands=8)
+    server, base_url = sunpy__remote.start_range_server(str(directory))
+    yield filename, base_url + 'broadband_123.fits'
+    server.shutdown()
+
+
+def test_remote_file_matches_local(served, tmpdir):
+    filename, url = served
+    remote = sunpy__remote.remote_sunrise_file(url, cache_dir=str(tmpdir))
+    assert list(remote.load_broadband_names()) == list(sunpy__load.load_broadband_names(filename))
+    assert np.allclose(remote.load_fov(), sunpy__load.load_fov(filename))
+    assert np.array_equal(remote.load_broadband_image(band=4), sunpy__load.load_broadband_image(filename, band=4))
+    assert np.array_equal(remote.load_all_broadband_images(), sunpy__load.load_all_broadband_images(filename))
+
+
+def test_cache_survives_restart(served, tmpdir):
+    filename, url = served
+    size = os.path.getsize(filename)
+    cache = sunpy__remote.byte_range_cache(url, cache_dir=str(tmpdir))
+    tail = cache.read(size - 100, 2880)
+    assert len(tail) == 100 and cache.n_requests == 1
+    cache = sunpy__remote.byte_range_cache(url, cache_dir=str(tmpdir))
+    assert cache.read(size - 100, 2880) == tail         # the cached tail is known to end at EOF
+    assert cache.read(size, 10) == ''
+    assert cache.n_requests == 0
+
+
+@pytest.mark.parametrize('path', ['../secret.txt', '%2e%2e/secret.txt', '..%2fsecret.txt'])
+def test_range_server_stays_in_directory(tmpdir, path):
+    tmpdir.join('secret.txt').write('secret')
+    tmpdir.mkdir('public')
+    server, base_url = sunpy__remote.start_range_server(str(tmpdir.join('public')))
+    try:
+        with pytest.raises(urllib2.HTTPError) as error:
+            urllib2.urlopen(base_url + path)
+        assert error.value.code == 403
+    finally:
+        server.shutdown()
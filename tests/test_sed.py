@@ -0,0 +1,32 @@
+""" tests for the bulk SED table and matrix synthetic photometry of sunpy__sed """
+import numpy as np
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__sed as sunpy__sed
+
+
+def test_extract_seds(tmpdir):
+    filenames = [ str(tmpdir.join('broadband_'+str(n)+'.fits')) for n in [1, 2] ]
+    for seed, filename in enumerate(filenames):
+        sunpy__mock.write_mock_sunrise_file(filename, n_pixels=8, n_bands=8, n_lambda=200, seed=seed)
+    filenames.insert(1, str(tmpdir.join('broadband_404.fits')))            # missing
+    table = sunpy__sed.extract_seds(filenames, str(tmpdir.join('seds')), verbose=False)
+
+    assert len(table) == 3
+    assert list(table.valid) == [True, False, True]
+    assert np.array_equal(table.sed_lambda, sunpy__load.load_sed_lambda(filenames[0]))
+    seds = table.column('L_lambda')
+    assert np.array_equal(seds[2], sunpy__load.load_sed_l_lambda(filenames[2]))
+    assert np.isnan(seds[1]).all()
+
+
+def test_flat_spectrum_photometry():
+    sed_lambda = np.logspace(-7.0, -5.0, 2000)
+    l_nu = sunpy__sed.ab_zeropoint * 4.0 * np.pi * (10.0 * sunpy__sed.parsec_in_m)**2     # 0 mag at 10 pc
+    l_lambda = l_nu * sunpy__sed.speedoflight_m / sed_lambda**2
+    filters = sunpy__sed.tophat_filters(['b', 'r'], [4.5e-7, 8e-7], [1e-7, 1.5e-7])
+    seds = np.array([ l_lambda, 10.0 * l_lambda ])
+    assert np.allclose(filters.l_nu(seds, sed_lambda), [ [l_nu, l_nu], [10 * l_nu, 10 * l_nu] ], rtol=1e-4)
+    assert np.allclose(filters.ab_magnitudes(seds, sed_lambda), [ [0.0, 0.0], [-2.5, -2.5] ], atol=1e-4)
+    assert np.allclose(filters.l_nu(l_lambda, sed_lambda), [l_nu, l_nu], rtol=1e-4)
@@ -0,0 +1,81 @@
+""" tests for the http render server of sunpy__server on a mock SUNRISE file and mock backgrounds """
+import os
+import io
+import json
+import urllib2
+import numpy as np
+import matplotlib.image
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__server as sunpy__server
+
+
+@pytest.fixture(scope='module')
+def base_url(tmpdir_factory):
+    directory = tmpdir_factory.mktemp('server')
+    cwd = os.getcwd()
+    os.chdir(str(directory))                # the background mosaics are found relative to the working directory
+    sunpy__mock.write_mock_backgrounds(n_pixels=1000)
+    sunpy__mock.write_mock_sunrise_file(str(directory.join('broadband_123.fits')), n_pixels=128, n_bands=8)
+    server, url = sunpy__server.start_render_server(str(directory))
+    yield url
+    server.shutdown()
+    os.chdir(cwd)
+
+
+def get(url):
+    """ (status, body) of a GET request """
+    try:
+        response = urllib2.urlopen(url)
+        return response.getcode(), response.read()
+    except urllib2.HTTPError, error:
+        return error.code, error.read()
+
+
+def test_render_without_seed(base_url):
+    code, body = get(base_url+'render?file=broadband_123.fits&bands=g_SDSS.res&format=npy')
+    assert code == 200
+    image = np.load(io.BytesIO(body))
+    seeded = np.load(io.BytesIO( get(base_url+'render?file=broadband_123.fits&bands=g_SDSS.res&format=npy&seed=123')[1] ))
+    assert np.array_equal(image, seeded)                # the default seed is the galaxy number
+
+
+@pytest.mark.parametrize('product', ['mass_weighted_age', 'stellar_metal'])
+def test_physical_product_png_is_stretched(base_url, product):
+    code, body = get(base_url+'render?file=broadband_123.fits&product='+product)
+    assert code == 200
+    png = matplotlib.image.imread(io.BytesIO(body), format='png')
+    assert png.min() < png.max()
+    code, body = get(base_url+'render?file=broadband_123.fits&product='+product+'&scale_min=-1e30&scale_max=1e30')
+    assert code == 200
+
+
+@pytest.mark.parametrize('query, code', [ ('file=broadband_123.fits&bands=99', 400),
+                                          ('file=broadband_123.fits&bands=bogus', 400),
+                                          ('file=broadband_123.fits&bands=3,4', 400),
+                                          ('file=broadband_123.fits&format=jpg', 400),
+                                          ('file=broadband_123.fits&product=nope', 400),
+                                          ('file=broadband_123.fits&camera=x', 400),
+                                          ('file=broadband_123.fits&colour=red', 400),
+                                          ('file=broadband_123.fits&resample_mode=fast', 400),
+                                          ('bands=4', 400),
+                                          ('file=../broadband_123.fits', 403),
+                                          ('file=broadband_404.fits', 404) ])
+def test_bad_requests(base_url, query, code):
+    assert get(base_url+'render?'+query)[0] == code
+
+
+def test_stats(base_url):
+    code, body = get(base_url+'stats')
+    assert code == 200
+    assert 'output_cache' in json.loads(body)
+
+
+def test_repeated_request_is_cached(base_url):
+    url = base_url+'render?file=broadband_123.fits&seed=5'
+    first = get(url)
+    renders = json.loads(get(base_url+'stats')[1])['renders']
+    assert first[0] == 200
+    assert get(url) == first
+    assert json.loads(get(base_url+'stats')[1])['renders'] == renders
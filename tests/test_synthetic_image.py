@@ -0,0 +1,49 @@
+""" regression tests for sunpy__synthetic_image on a mock SUNRISE file (see sunpy__mock) """
+import numpy as np
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+
+
+@pytest.fixture(scope='module')
+def inputs(tmpdir_factory):
+    filename = str( tmpdir_factory.mktemp('mock').join('broadband_12345.fits') )
+    sunpy__mock.write_mock_sunrise_file(filename, n_pixels=256, n_bands=8)
+    return sunpy__synthetic_image.sunrise_inputs(filename)
+
+
+def noise_and_image(inputs, resample_mode, r_petro_kpc):
+    """ (noise, noiseless image, sky_sig) of the final image in one resample mode """
+    kwargs = dict(band=4, seed=3, inputs=inputs, verbose=False, add_background=False,
+                  r_petro_kpc=r_petro_kpc, resample_mode=resample_mode)
+    noisy     = sunpy__synthetic_image.synthetic_image(inputs.filename, **kwargs)
+    noiseless = sunpy__synthetic_image.synthetic_image(inputs.filename, add_noise=False, **kwargs)
+    return noisy.bg_image.image - noiseless.bg_image.image, noiseless.bg_image.image, noisy.sky_sig
+
+
+@pytest.mark.parametrize('r_petro_kpc', [40.0, 80.0])
+def test_composed_noise_matches_legacy(inputs, r_petro_kpc):
+    legacy_noise, legacy_image, legacy_sky_sig = noise_and_image(inputs, 'legacy', r_petro_kpc)
+    noise, image, sky_sig = noise_and_image(inputs, 'composed', r_petro_kpc)
+    padding = legacy_image == 0
+    assert padding.any()                                    # the window is zero padded
+    assert np.all(image[padding] == 0)
+    assert np.all(noise[padding] == 0)                      # no noise in the padding
+    assert np.isclose(sky_sig, legacy_sky_sig, rtol=1e-6)
+    ratio = noise[~padding].std() / legacy_noise[~padding].std()
+    assert abs(ratio - 1.0) < 0.05
+
+
+def test_unknown_resample_mode(inputs):
+    with pytest.raises(SystemExit):
+        sunpy__synthetic_image.synthetic_image(inputs.filename, band=4, inputs=inputs, verbose=False,
+                                               resample_mode='compose')
+
+
+def test_random_stream_unicode_labels():
+    a = sunpy__synthetic_image.random_stream(7, 'subhalo', u'g_SDSS.res', 2).randn(5)
+    b = sunpy__synthetic_image.random_stream(7, u'subhalo', 'g_SDSS.res', 2).randn(5)
+    c = sunpy__synthetic_image.random_stream(7, u'subhalo', u'r_SDSS.res', 2).randn(5)
+    assert np.array_equal(a, b)
+    assert not np.array_equal(a, c)
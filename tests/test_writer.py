@@ -0,0 +1,43 @@
+""" tests for the tile-compressed fits output of sunpy__writer and save_bgimage_fits """
+import numpy as np
+import pytest
+
+import sunpy.sunpy__mock as sunpy__mock
+import sunpy.sunpy__load as sunpy__load
+import sunpy.sunpy__writer as sunpy__writer
+import sunpy.sunpy__synthetic_image as sunpy__synthetic_image
+
+
+@pytest.fixture(scope='module')
+def image(tmpdir_factory):
+    filename = str( tmpdir_factory.mktemp('writer').join('broadband_12345.fits') )
+    sunpy__mock.write_mock_sunrise_file(filename, n_pixels=256, n_bands=8)
+    return sunpy__synthetic_image.synthetic_image(filename, band=4, seed=3, verbose=False, add_background=False,
+                                                  r_petro_kpc=10.0, save_fits=False)
+
+
+def write_and_read(image, filename, compression, quantize):
+    image.save_bgimage_fits(filename, compression=compression, quantize=quantize, verbose=False)
+    return sunpy__load.load_synthetic_image(filename)[0]
+
+
+def test_rice_error_within_half_a_step(image, tmpdir):
+    uncompressed = write_and_read(image, str(tmpdir.join('plain.fits')), None, 16.0)
+    rice = write_and_read(image, str(tmpdir.join('rice.fits')), 'RICE_1', 16.0)
+    step = image.saved_image_sky_sig(uncompressed) / 16.0
+    assert step > 0
+    assert rice.shape == uncompressed.shape
+    assert abs(rice - uncompressed).max() <= 0.5 * step * (1 + 1e-6)
+    assert image.fits_write_stats['file_bytes'] < image.fits_write_stats['raw_bytes']
+
+
+def test_gzip_lossless(image, tmpdir):
+    uncompressed = write_and_read(image, str(tmpdir.join('plain.fits')), None, 16.0)
+    gzip = write_and_read(image, str(tmpdir.join('gzip.fits')), 'GZIP_2', 0)
+    assert np.array_equal(gzip, uncompressed)
+
+
+@pytest.mark.parametrize('compression_type, quantize_level', [('HCOMPRESS_1', 16.0), ('RICE_1', 0.0)])
+def test_check_compression_rejects(compression_type, quantize_level):
+    with pytest.raises(SystemExit):
+        sunpy__writer.check_compression(compression_type, quantize_level)